@@ -155,7 +155,8 @@ func buildVideoListCache() error {
 	// 获取文件夹的修改时间信息
 	var dirs []dirEntryWithInfo
 	for _, file := range files {
-		if !file.IsDir() {
+		// 跳过.开头的目录（如下载器复制中的.staging）
+		if !file.IsDir() || strings.HasPrefix(file.Name(), ".") {
 			continue
 		}
 		info, err := file.Info()
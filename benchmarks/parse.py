@@ -0,0 +1,130 @@
+# doc: 页面解析的微基准：用fixtures渲染各站点的页面，补齐到真实页面的大小，测每页的解析耗时
+"""
+用法:
+    python3 benchmarks/parse.py                    # 各站点默认页面大小
+    python3 benchmarks/parse.py --scale 2 --json parse.json
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from urllib.parse import quote
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from server import BenchSite
+
+# 站点 -> (fixture, 补齐后的大小KB)，大小按真实页面估计
+PAGES = {
+    "javbus": ("javbus.html", 60),
+    "missav": ("missav.html", 150),
+    "jable": ("jable.html", 100),
+    "hohoj_search": ("hohoj_search.html", 30),
+    "hohoj_embed": ("hohoj_embed.html", 20),
+    "memo": ("memo.json", 0),
+}
+
+RELATED_ITEM = ('<div class="item"><a class="movie-box" href="/ABC-{0:03d}"><div class="photo-frame">'
+                '<img src="/pics/thumb/{0}.jpg" title="相關影片 {0}"></div><div class="photo-info">'
+                '<span>相關影片 {0} <br><date>ABC-{0:03d}</date> / <date>2024-01-01</date></span></div></a></div>\n')
+HEAD_SCRIPT = '<script>var cfg{0} = {{"k": "value {0}", "list": [1,2,3,4,5,6,7,8,9]}}; function f{0}(a) {{ return a * {0}; }}</script>\n'
+
+def pad(html: str, kb: int) -> str:
+    """在</head>前补脚本（约20%），在</body>前补相关推荐列表（约80%）"""
+    if kb <= 0 or "</body>" not in html:
+        return html
+    size = kb * 1024
+    head, body = [], []
+    i = 0
+    while sum(map(len, head)) < size * 0.2:
+        head.append(HEAD_SCRIPT.format(i))
+        i += 1
+    while sum(map(len, body)) < size * 0.8:
+        body.append(RELATED_ITEM.format(i))
+        i += 1
+    related = '<div id="related-waterfall">\n' + "".join(body) + "</div>\n"
+    return html.replace("</head>", "".join(head) + "</head>", 1).replace("</body>", related + "</body>", 1)
+
+def renderPages(site: BenchSite, avid: str, scale: float) -> dict:
+    uuid = site.uuid(avid)
+    extra = {
+        "javbus.html": {"base": f"{site.base}/javbus"},
+        "missav.html": {"packed": "|".join(uuid.split("-")[::-1])},
+        "hohoj_search.html": {"videoid": "12345"},
+        "memo.json": {"encoded": quote(f"{site.streamUrl(avid)}/index.m3u8", safe="")},
+    }
+    pages = {}
+    for name, (fixture, kb) in PAGES.items():
+        html = site.render(fixture, avid, **extra.get(fixture, {})).decode("utf-8")
+        pages[name] = pad(html, int(kb * scale))
+    return pages
+
+def main():
+    parser = argparse.ArgumentParser(description="页面解析微基准")
+    parser.add_argument('--iterations', type=int, default=2000, help='每个页面解析的次数')
+    parser.add_argument('--scale', type=float, default=1.0, help='页面大小的倍数')
+    parser.add_argument('--json', type=str, help='结果另存为json，便于对比')
+    args = parser.parse_args()
+
+    # 导入src前指定临时配置，日志不落到当前目录
+    workdir = tempfile.mkdtemp(prefix="nassav-parse-")
+    with open(os.path.join(ROOT, "cfg", "configs.json"), "r", encoding="utf-8") as f:
+        configs = json.load(f)
+    configs.update({"LogPath": os.path.join(workdir, "logs"), "DBPath": os.path.join(workdir, "bench.db"),
+                    "MetricsPath": "", "MetricsPort": 0})
+    os.environ["NASSAV_CONFIG"] = os.path.join(workdir, "configs.json")
+    with open(os.environ["NASSAV_CONFIG"], "w", encoding="utf-8") as f:
+        json.dump(configs, f, ensure_ascii=False)
+
+    from src.comm import logger
+    from src.scraper import Sracper
+    from src.downloader.downloaderBase import AVDownloadInfo
+    from src.downloader.missAVDownloader import MissAVDownloader
+    from src.downloader.jableDownloder import JableDownloader
+    from src.downloader.hohoJDownloader import HohoJDownloader, HOHOJ_SEARCH
+    from src.downloader.memoDownloader import MemoDownloader
+    logger.remove()
+
+    site = BenchSite(segments=1, segment_size=1)
+    site.base = "http://127.0.0.1"
+    pages = renderPages(site, "ABC-123", args.scale)
+    scraper = Sracper(workdir)
+    jable, hohoj, memo = JableDownloader(workdir), HohoJDownloader(workdir), MemoDownloader(workdir)
+    parsers = {
+        "javbus": scraper._extract,
+        "missav": lambda html: MissAVDownloader._extract_uuid(html) and MissAVDownloader._extract_metadata(html, AVDownloadInfo()),
+        "jable": jable.parseHTML,
+        "hohoj_search": lambda html: HOHOJ_SEARCH.first(html, "id"),
+        "hohoj_embed": hohoj.parseHTML,
+        "memo": memo.parseHTML,
+    }
+
+    report = {"iterations": args.iterations, "scale": args.scale, "pages": {}}
+    print(f"{'page':<14}{'KB':>8}{'us/page':>12}{'MB/s':>10}")
+    for name, parse in parsers.items():
+        html = pages[name]
+        if not parse(html):
+            print(f"{name} 解析失败，fixtures和解析规则不一致")
+            sys.exit(1)
+        begin = time.perf_counter()
+        for _ in range(args.iterations):
+            parse(html)
+        per_page = (time.perf_counter() - begin) / args.iterations
+        size = len(html.encode("utf-8"))
+        row = {"kb": round(size / 1024, 1), "us_per_page": round(per_page * 1e6, 1),
+               "mb_per_second": round(size / 1024 / 1024 / per_page, 1)}
+        report["pages"][name] = row
+        print(f"{name:<14}{row['kb']:>8}{row['us_per_page']:>12}{row['mb_per_second']:>10}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
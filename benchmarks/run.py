@@ -0,0 +1,198 @@
+# doc: 离线性能测试：启动本地站点，用临时配置运行真实的下载器、HLS下载和刮削，输出吞吐和各阶段延迟
+"""
+用法:
+    python3 benchmarks/run.py                          # 合成分片，只测解析、分片下载和刮削
+    python3 benchmarks/run.py --full                   # ffmpeg生成的片源，走完整的downloadAV + gen_nfo
+    python3 benchmarks/run.py --full --scratch /dev/shm/nassav   # 在暂存目录中生成，完成后移到SavePath
+    python3 benchmarks/run.py --latency 50 --bandwidth 20 --error-rate 0.02 --json result.json
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from server import BenchSite, startServer, generateMedia
+
+# 参与测试的下载器和权重，都指向本地站点
+DOWNLOADERS = [("Memo", "memo", 600), ("Jable", "jable", 500), ("MissAV", "missav", 300), ("HohoJ", "hohoj", 100)]
+
+def writeConfig(workdir: str, base: str, args) -> str:
+    with open(os.path.join(ROOT, "cfg", "configs.json"), "r", encoding="utf-8") as f:
+        configs = json.load(f)
+    configs.update({
+        "LogPath": os.path.join(workdir, "logs"),
+        "SavePath": os.path.join(workdir, "save"),
+        "ScratchPath": args.scratch,
+        "DBPath": os.path.join(workdir, "bench.db"),
+        "QueuePath": os.path.join(workdir, "queue.txt"),
+        "Proxy": "",
+        "IsNeedVideoProxy": False,
+        "SegmentConcurrency": args.concurrency,
+        "StreamRemux": True,
+        "FragmentedMP4": args.fragmented,
+        "ScrapeBaseUrl": f"{base}/javbus",
+        "ScrapeRate": 1000,
+        "ScrapeBurst": 1000,
+        "MetricsPath": "",
+        "MetricsPort": 0,
+        "BandwidthLimit": args.limit,
+        "HostConnections": args.host_connections,
+        "BandwidthSchedule": [],
+        "Downloader": [
+            {"downloaderName": name, "domain": f"{base}/{path}", "weight": weight,
+             "cacheTTL": 3600 if args.cache else 0,
+             **({"streamHost": f"{base}/surrit"} if name == "MissAV" else {})}
+            for name, path, weight in DOWNLOADERS
+        ],
+    })
+    os.makedirs(os.path.join(workdir, "save", "thumb"), exist_ok=True)
+    path = os.path.join(workdir, "configs.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(configs, f, ensure_ascii=False, indent=4)
+    return path
+
+class NullSink:
+    """只计数不落盘，合成分片不需要转封装"""
+    def write(self, data: bytes) -> int:
+        return len(data)
+
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = (len(values) - 1) * p
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+def main():
+    parser = argparse.ArgumentParser(description="离线性能测试")
+    parser.add_argument('--jobs', type=int, default=20, help='车牌号数量')
+    parser.add_argument('--workers', type=int, default=2, help='同时下载的车牌号数，相当于WorkerCount')
+    parser.add_argument('--concurrency', type=int, default=8, help='单个视频同时下载的分片数')
+    parser.add_argument('--segments', type=int, default=50, help='每个视频的分片数')
+    parser.add_argument('--segment-kb', type=int, default=512, help='合成分片的大小(KB)')
+    parser.add_argument('--latency', type=float, default=20, help='每个请求的延迟(毫秒)')
+    parser.add_argument('--bandwidth', type=float, default=0, help='每个连接的带宽(MB/s)，0表示不限')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='返回503的概率')
+    parser.add_argument('--corrupt-rate', type=float, default=0.0, help='分片内容被截断的概率，配合--full检查完整性校验')
+    parser.add_argument('--limit', type=float, default=0, help='BandwidthLimit：客户端的总带宽上限(MB/s)')
+    parser.add_argument('--host-connections', type=int, default=0, help='HostConnections：每个host的连接数上限')
+    parser.add_argument('--cache', action='store_true', help='开启解析结果缓存（默认每次都重新解析）')
+    parser.add_argument('--no-scrape', action='store_true', help='不测刮削')
+    parser.add_argument('--full', action='store_true', help='使用ffmpeg生成的片源，走完整的下载、转封装和生成nfo')
+    parser.add_argument('--fragmented', action='store_true', help='FragmentedMP4：输出fMP4，配合--full使用')
+    parser.add_argument('--scratch', type=str, default="", help='ScratchPath：暂存目录，配合--full使用')
+    parser.add_argument('--json', type=str, help='结果另存为json，便于对比')
+    parser.add_argument('--keep', action='store_true', help='保留临时目录')
+    parser.add_argument('--verbose', action='store_true', help='输出WARNING及以上的日志')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="nassav-bench-")
+    media_dir = None
+    if args.full:
+        media_dir = os.path.join(workdir, "media")
+        if not generateMedia(media_dir, args.segments * 2):
+            sys.exit(1)
+    site = BenchSite(args.latency / 1000, args.bandwidth * 1024 * 1024, args.error_rate,
+                     args.segments, args.segment_kb * 1024, media_dir=media_dir, corrupt_rate=args.corrupt_rate)
+    server = startServer(site)
+
+    # 配置在导入src时读取，必须先写好临时配置
+    os.environ["NASSAV_CONFIG"] = writeConfig(workdir, site.base, args)
+    from src.comm import logger, resolve_deadline, segment_concurrency, segment_retries, save_path
+    from src import downloaderMgr
+    from src.hls import HLSDownloader
+    from src.metrics import metrics
+    from src.resolver import Resolver
+    from src.scraper import Sracper
+    from src.pipeline import downloadAV
+    from metadata import gen_nfo
+    logger.remove()
+    if args.verbose:
+        logger.add(sys.stderr, level="WARNING")
+    metrics.samples = {}
+
+    local = threading.local()
+
+    def runJob(avid: str) -> bool:
+        if not hasattr(local, "mgr"):
+            local.mgr = downloaderMgr.DownloaderMgr()
+        if args.full:
+            if not downloadAV(local.mgr, avid):
+                return False
+            gen_nfo(avid)
+            return True
+
+        ok = False
+        for candidate in Resolver(local.mgr, resolve_deadline).candidates(avid):
+            downloader = candidate.downloader
+            hls = HLSDownloader(None, segment_concurrency, retries=segment_retries)
+            playlist = downloader._fetchPlaylist(hls, candidate.info.m3u8, False)
+            if playlist is None:
+                continue
+            with downloader._stage("segments", playlist.url) as stage:
+                sink = NullSink()
+                stage.ok = hls.download(playlist, sink, lambda done, total, written: setattr(stage, "bytes", written))
+            if stage.ok:
+                ok = True
+                break
+        if ok and not args.no_scrape:
+            os.makedirs(os.path.join(save_path, avid), exist_ok=True) # 完整流程中由下载创建
+            ok = Sracper(save_path).scrape(avid) is not None
+        return ok
+
+    avids = [f"BENCH-{i:03d}" for i in range(1, args.jobs + 1)]
+    begin = time.time()
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        results = list(pool.map(runJob, avids))
+    wall = time.time() - begin
+    server.shutdown()
+
+    segment_bytes = sum(value for (name, labels), value in metrics.counters.items()
+                        if name == "nassav_stage_bytes_total" and ("stage", "segments") in labels)
+    report = {
+        "jobs": len(avids),
+        "succeeded": sum(results),
+        "wall_seconds": round(wall, 3),
+        "jobs_per_hour": round(sum(results) / wall * 3600, 1) if wall else 0,
+        "segment_mb": round(segment_bytes / 1024 / 1024, 1),
+        "mb_per_second": round(segment_bytes / 1024 / 1024 / wall, 2) if wall else 0,
+        "requests": site.requests,
+        "peak_connections": site.peak,
+        "stages": {
+            stage: {
+                "count": len(values),
+                "p50_ms": round(percentile(values, 0.5) * 1000, 1),
+                "p99_ms": round(percentile(values, 0.99) * 1000, 1),
+            }
+            for stage, values in sorted(metrics.samples.items())
+        },
+        "params": vars(args),
+    }
+
+    print(f"jobs: {report['succeeded']}/{report['jobs']} 成功, 耗时 {report['wall_seconds']}s, "
+          f"{report['jobs_per_hour']} jobs/hour, {report['mb_per_second']} MB/s, 请求数 {report['requests']}, "
+          f"最大并发 {report['peak_connections']}")
+    print(f"{'stage':<16}{'count':>8}{'p50(ms)':>12}{'p99(ms)':>12}")
+    for stage, row in report["stages"].items():
+        print(f"{stage:<16}{row['count']:>8}{row['p50_ms']:>12}{row['p99_ms']:>12}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.keep:
+        print(f"临时目录: {workdir}")
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+# doc: 性能测试用的本地站点：按路径模拟MissAV/Jable/HohoJ/Memo/JavBus的页面，以及HLS master/media playlist和分片
+import hashlib
+import io
+import os
+import random
+import re
+import subprocess
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from string import Template
+from typing import Dict, Optional
+from urllib.parse import parse_qs, quote, urlparse
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+def _fixture(name: str) -> Template:
+    with open(os.path.join(FIXTURES, name), "r", encoding="utf-8") as f:
+        return Template(f.read())
+
+def _jpeg(width: int = 800, height: int = 538) -> bytes:
+    from PIL import Image
+    buf = io.BytesIO()
+    Image.new("RGB", (width, height), (90, 120, 150)).save(buf, "JPEG")
+    return buf.getvalue()
+
+class BenchSite:
+    """
+    站点行为参数：
+    - latency: 每个请求的首字节延迟(秒)
+    - bandwidth: 每个连接的带宽(字节/秒)，0表示不限
+    - error_rate: 返回503的概率
+    - corrupt_rate: 分片返回200但内容被截断的概率（Content-Length和截断后的内容一致，只能靠内容检查发现）
+    - segments / segment_size / segment_duration: 合成playlist的分片数、分片大小和时长
+    - media_dir: 不为空时使用该目录下ffmpeg生成的fMP4 HLS（完整流程测试需要可转封装的分片）
+    """
+    def __init__(self, latency: float = 0.0, bandwidth: float = 0, error_rate: float = 0.0,
+                 segments: int = 50, segment_size: int = 512 * 1024, segment_duration: float = 4.0,
+                 media_dir: Optional[str] = None, corrupt_rate: float = 0.0):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.corrupt_rate = corrupt_rate
+        self.segments = segments
+        self.segment_duration = segment_duration
+        self.payload = os.urandom(segment_size)
+        self.media_dir = media_dir
+        self.jpeg = _jpeg()
+        self.templates: Dict[str, Template] = {
+            name: _fixture(name) for name in os.listdir(FIXTURES)
+        }
+        self.base = ""
+        self.requests = 0
+        self.active = 0
+        self.peak = 0 # 同时处理的最大请求数
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def uuid(avid: str) -> str:
+        digits = hashlib.md5(avid.encode("utf-8")).hexdigest()
+        return f"{digits[:8]}-{digits[8:12]}-{digits[12:16]}-{digits[16:20]}-{digits[20:]}"
+
+    def streamUrl(self, avid: str) -> str:
+        return f"{self.base}/stream/{avid.lower()}"
+
+    def render(self, name: str, avid: str, **extra) -> bytes:
+        values = {"avid": avid, "base": self.base, "stream": self.streamUrl(avid)}
+        values.update(extra)
+        return self.templates[name].substitute(values).encode("utf-8")
+
+    def masterPlaylist(self) -> bytes:
+        return (
+            "#EXTM3U\n"
+            "#EXT-X-STREAM-INF:BANDWIDTH=800000,RESOLUTION=842x480\n480p/video.m3u8\n"
+            "#EXT-X-STREAM-INF:BANDWIDTH=3000000,RESOLUTION=1280x720\n720p/video.m3u8\n"
+        ).encode("utf-8")
+
+    def mediaPlaylist(self) -> bytes:
+        if self.media_dir:
+            with open(os.path.join(self.media_dir, "index.m3u8"), "rb") as f:
+                return f.read()
+        lines = ["#EXTM3U", "#EXT-X-VERSION:3", f"#EXT-X-TARGETDURATION:{int(self.segment_duration + 0.999)}",
+                 "#EXT-X-MEDIA-SEQUENCE:0"]
+        for i in range(self.segments):
+            lines.append(f"#EXTINF:{self.segment_duration:.3f},")
+            lines.append(f"seg{i}.ts")
+        lines.append("#EXT-X-ENDLIST")
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+    def segment(self, name: str) -> Optional[bytes]:
+        if self.media_dir:
+            path = os.path.join(self.media_dir, os.path.basename(name))
+            if not os.path.exists(path):
+                return None
+            with open(path, "rb") as f:
+                return f.read()
+        return self.payload
+
+    def route(self, path: str, query: dict) -> Optional[tuple]:
+        """返回(content_type, body)，404返回None"""
+        html = "text/html; charset=utf-8"
+        # HLS：master/media playlist和分片，各站点的视频流都指向这里
+        if path.endswith("playlist.m3u8"):
+            return "application/vnd.apple.mpegurl", self.masterPlaylist()
+        if path.endswith(".m3u8"):
+            return "application/vnd.apple.mpegurl", self.mediaPlaylist()
+        if re.search(r"\.(ts|m4s|mp4)$", path):
+            body = self.segment(path)
+            if body is not None and self.corrupt_rate and random.random() < self.corrupt_rate:
+                body = body[:len(body) * 2 // 3]
+            return ("video/mp2t", body) if body is not None else None
+        if path.endswith(".jpg"):
+            return "image/jpeg", self.jpeg
+
+        # MissAV: 只有不带后缀的页面存在，带后缀的变体返回404
+        if m := re.match(r"^/missav/cn/([a-z0-9]+-\d+)$", path):
+            avid = m.group(1).upper()
+            packed = "|".join(self.uuid(avid).split("-")[::-1])
+            return html, self.render("missav.html", avid, packed=packed)
+        if m := re.match(r"^/jable/videos/([a-z0-9]+-\d+)/$", path):
+            return html, self.render("jable.html", m.group(1).upper())
+        if path == "/hohoj/search":
+            avid = query.get("text", [""])[0].upper()
+            return html, self.render("hohoj_search.html", avid, videoid=str(int(hashlib.md5(avid.encode("utf-8")).hexdigest()[:5], 16)))
+        if path == "/hohoj/embed":
+            videoid = query.get("id", [""])[0]
+            return html, self.render("hohoj_embed.html", "", stream=f"{self.base}/stream/hohoj{videoid}")
+        if path == "/memo/hls/get_video_info.php":
+            avid = query.get("id", [""])[0].upper()
+            return "application/json", self.render("memo.json", avid,
+                                                   encoded=quote(f"{self.streamUrl(avid)}/index.m3u8", safe=""))
+        if m := re.match(r"^/javbus/([A-Z0-9]+-\d+)$", path):
+            return html, self.render("javbus.html", m.group(1), base=f"{self.base}/javbus")
+        return None
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # keep-alive，和真实站点一样复用连接
+    site: BenchSite = None
+
+    def do_GET(self):
+        site = self.site
+        with site.lock:
+            site.requests += 1
+            site.active += 1
+            site.peak = max(site.peak, site.active)
+        try:
+            self._handle(site)
+        finally:
+            with site.lock:
+                site.active -= 1
+
+    def _handle(self, site: BenchSite):
+        if site.latency:
+            time.sleep(site.latency)
+        if site.error_rate and random.random() < site.error_rate:
+            self._send(503, "text/plain", b"service unavailable")
+            return
+        parsed = urlparse(self.path)
+        result = site.route(parsed.path, parse_qs(parsed.query))
+        if result is None:
+            self._send(404, "text/plain", b"not found")
+            return
+        self._send(200, *result)
+
+    def _send(self, status: int, content_type: str, body: bytes):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        bandwidth = self.site.bandwidth
+        try:
+            if not bandwidth:
+                self.wfile.write(body)
+                return
+            chunk = 64 * 1024
+            for i in range(0, len(body), chunk):
+                piece = body[i:i+chunk]
+                self.wfile.write(piece)
+                time.sleep(len(piece) / bandwidth)
+        except (BrokenPipeError, ConnectionResetError):
+            # 下载器找到视频流地址后会提前断开
+            self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+def startServer(site: BenchSite, port: int = 0) -> ThreadingHTTPServer:
+    """在后台线程启动，site.base设置为实际地址"""
+    handler = type("Handler", (_Handler,), {"site": site})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    site.base = f"http://127.0.0.1:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def generateMedia(out_dir: str, seconds: float, segment_duration: float = 2.0) -> bool:
+    """用ffmpeg生成fMP4 HLS测试片源（index.m3u8 + init.mp4 + seg*.m4s）"""
+    os.makedirs(out_dir, exist_ok=True)
+    cmd = ["ffmpeg", "-y", "-loglevel", "error",
+           "-f", "lavfi", "-i", f"testsrc=size=640x360:rate=25:duration={seconds}",
+           "-c:v", "libx264", "-preset", "ultrafast", "-g", str(int(25 * segment_duration)),
+           "-f", "hls", "-hls_time", str(segment_duration), "-hls_playlist_type", "vod",
+           "-hls_segment_type", "fmp4", "-hls_fmp4_init_filename", "init.mp4",
+           "-hls_segment_filename", os.path.join(out_dir, "seg%d.m4s"),
+           os.path.join(out_dir, "index.m3u8")]
+    try:
+        subprocess.run(cmd, check=True)
+        return True
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"生成测试片源失败: {e}")
+        return False
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="性能测试用的本地站点")
+    parser.add_argument('--port', type=int, default=8800)
+    parser.add_argument('--latency', type=float, default=0.0, help='每个请求的延迟(毫秒)')
+    parser.add_argument('--bandwidth', type=float, default=0, help='每个连接的带宽(MB/s)，0表示不限')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='返回503的概率')
+    args = parser.parse_args()
+    site = BenchSite(args.latency / 1000, args.bandwidth * 1024 * 1024, args.error_rate)
+    server = startServer(site, args.port)
+    print(f"listening on {site.base}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,98 @@
+# doc: main.py冷启动基准：后端每个请求都会启动一次main.py，测已下载、已入队两条快速路径的耗时，并检查没有导入重量级模块
+"""
+用法:
+    python3 benchmarks/startup.py                      # 各路径运行20次，取中位数
+    python3 benchmarks/startup.py --iterations 50 --json startup.json
+    python3 benchmarks/startup.py --max-ms 150         # 快速路径的中位数超过150ms时返回非0
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAIN = os.path.join(ROOT, "main.py")
+
+# 快速路径上不应该出现的模块（出现说明又被提前导入了）
+HEAVY = ("loguru", "curl_cffi", "PIL", "src.downloaderMgr", "src.pipeline", "src.scraper", "metadata")
+
+def writeConfig(workdir: str) -> str:
+    with open(os.path.join(ROOT, "cfg", "configs.json"), "r", encoding="utf-8") as f:
+        configs = json.load(f)
+    configs.update({"LogPath": os.path.join(workdir, "logs"), "DBPath": os.path.join(workdir, "bench.db"),
+                    "SavePath": os.path.join(workdir, "videos"), "MetricsPath": "", "MetricsPort": 0})
+    path = os.path.join(workdir, "configs.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(configs, f, ensure_ascii=False)
+    return path
+
+def prepare(workdir: str, env: dict, downloaded: str):
+    """写入一个已下载的车牌号，并登记一个有心跳的worker，让main.py走提交到下载服务的路径"""
+    script = (
+        "from src import data\n"
+        "from src.comm import downloaded_path\n"
+        "from src.jobs import open_queue\n"
+        f"data.open_db(downloaded_path, 'MissAV').insert_many([{downloaded!r}])\n"
+        "open_queue().heartbeat('startup-bench')\n"
+    )
+    subprocess.run([sys.executable, "-c", script], cwd=ROOT, env=env, check=True, capture_output=True)
+    # 万一快速路径失效，也只会记到任务表里，不会真的开始下载
+    with open(os.path.join(workdir, "work"), "w") as f:
+        f.write("1")
+
+def timeRun(args: list, env: dict, cwd: str) -> float:
+    begin = time.perf_counter()
+    subprocess.run(args, cwd=cwd, env=env, check=True, capture_output=True)
+    return time.perf_counter() - begin
+
+def heavyImports(args: list, env: dict, cwd: str) -> list:
+    result = subprocess.run([sys.executable, "-X", "importtime"] + args[1:], cwd=cwd, env=env,
+                            capture_output=True, text=True)
+    imported = {line.rsplit("|", 1)[-1].strip() for line in result.stderr.splitlines() if line.startswith("import time:")}
+    return sorted(name for name in imported if name.split(".")[0] in HEAVY or name in HEAVY)
+
+def main():
+    parser = argparse.ArgumentParser(description="main.py冷启动基准")
+    parser.add_argument('--iterations', type=int, default=20, help='每条路径运行的次数')
+    parser.add_argument('--max-ms', type=float, default=0, help='快速路径中位数的上限(毫秒)，0表示不检查')
+    parser.add_argument('--json', type=str, help='结果另存为json，便于对比')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="nassav-startup-")
+    env = dict(os.environ, NASSAV_CONFIG=writeConfig(workdir), PYTHONDONTWRITEBYTECODE="1")
+    prepare(workdir, env, "ABC-123")
+
+    paths = {
+        "interpreter": lambda i: [sys.executable, "-c", "pass"], # 解释器本身的启动时间，作为下限
+        "downloaded": lambda i: [sys.executable, MAIN, "ABC-123"],
+        "enqueue": lambda i: [sys.executable, MAIN, f"NEW-{i:03d}"],
+    }
+    report = {"iterations": args.iterations, "paths": {}}
+    failed = False
+    print(f"{'path':<14}{'median ms':>11}{'min ms':>9}  heavy imports")
+    for name, command in paths.items():
+        timeRun(command(-1), env, workdir) # 预热文件缓存
+        samples = [timeRun(command(i), env, workdir) for i in range(args.iterations)]
+        heavy = heavyImports(command(args.iterations), env, workdir) if name != "interpreter" else []
+        row = {"median_ms": round(statistics.median(samples) * 1000, 1), "min_ms": round(min(samples) * 1000, 1),
+               "heavy_imports": heavy}
+        report["paths"][name] = row
+        print(f"{name:<14}{row['median_ms']:>11}{row['min_ms']:>9}  {', '.join(heavy) or '-'}")
+        if name != "interpreter" and (heavy or (args.max_ms and row["median_ms"] > args.max_ms)):
+            failed = True
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    shutil.rmtree(workdir, ignore_errors=True)
+    if failed:
+        print("快速路径变慢或导入了重量级模块")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
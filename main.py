@@ -1,114 +1,119 @@
-from src import downloaderMgr
+# 这里只导入轻量的模块：后端每次请求都会启动一次main.py，多数情况下查库或入队后就退出，
+# 下载器、刮削器（curl_cffi、PIL）在真正开始下载时才导入，日志在第一次使用时才初始化
 from src.comm import *
 from src import data
+from src.jobs import open_queue
 import sys
 import argparse
-from metadata import *
 
-def append_if_not_duplicate(filename, new_content):
-    new_content = new_content.strip()
-    try:
-        with open(filename, 'r', encoding='utf-8') as file:
-            existing_lines = [line.strip() for line in file.readlines()]
-    except FileNotFoundError:
-        existing_lines = []
-    
-    if new_content not in existing_lines:
-        with open(filename, 'a', encoding='utf-8') as file:
-            file.write(new_content + '\n')
-        return True
-    else:
-        return False
+def normalize_avids(lines) -> list:
+    """去掉空行和#注释，取每行第一个字段并大写，保持顺序去重"""
+    avids = []
+    for line in lines:
+        line = line.split('#', 1)[0].strip()
+        if line:
+            avids.append(line.split()[0].upper())
+    return list(dict.fromkeys(avids))
+
+def submit_batch(avids: list, force: bool, priority: int = 0) -> dict:
+    """批量提交：一次查询过滤已下载的，其余一次性写入任务表，返回每个车牌号的结果"""
+    outcomes = {}
+    ordered = list(avids)
+    if not force:
+        downloaded = data.open_db(downloaded_path, "MissAV").contains_many(avids)
+        for avid in avids:
+            if avid in downloaded:
+                outcomes[avid] = "已在小姐姐数据库中"
+        avids = [avid for avid in avids if avid not in downloaded]
+
+    jobs = open_queue()
+    for avid, added in jobs.enqueueMany(avids, priority, force).items():
+        outcomes[avid] = "已加入任务表" if added else "已在任务表中"
+    if avids and not jobs.serviceAlive():
+        logger.warning("下载服务没有运行，任务会在执行 worker.py 后开始下载")
+    return {avid: outcomes[avid] for avid in ordered}
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Process some parameters.")
     
+    parser.add_argument('targets', nargs='*', help='车牌号，可以有多个')
     parser.add_argument('-f', '--force', action='store_true', help='跳过DB检查，强制执行')
     parser.add_argument('-t', '--target', type=str, help='指定车牌号')
+    parser.add_argument('-i', '--input', type=str, help='从文件批量读取车牌号，每行一个，"-"表示标准输入')
+    parser.add_argument('-p', '--priority', type=int, default=0, help='任务优先级，数值大的先下载')
     
-    args, unknown = parser.parse_known_args()
-    if not args and not unknown:
-        logger.error(f"Error: Unknown arguments are not allowed: {args, unknown}")
-        sys.exit(1)
-    
-    # 获取位置参数
-    positional_args = [arg for arg in sys.argv[1:] if not arg.startswith('-')]
-    
-    if len(positional_args) == 1:
-        args.target = positional_args[0]
-    elif args.target is None:
+    args = parser.parse_args()
+    targets = list(args.targets)
+    if args.target:
+        targets.append(args.target)
+    if args.input == '-':
+        targets += sys.stdin.readlines()
+    elif args.input:
+        with open(args.input, 'r', encoding='utf-8') as f:
+            targets += f.readlines()
+    targets = normalize_avids(targets)
+
+    if not targets:
         logger.error("需要提供车牌号")
+        print("用法: python main.py <车牌号> [车牌号 ...] | -i <文件>")
         sys.exit(1)
     
-    logger.info(f"Force: {args.force}")
-    logger.info(f"Target: {args.target}")
+    # 批量模式：多个车牌号或从文件读取，全部交给任务表
+    if len(targets) > 1 or args.input:
+        outcomes = submit_batch(targets, args.force, args.priority)
+        for avid, outcome in outcomes.items():
+            print(f"{avid}\t{outcome}")
+        print(f"批量提交 {len(outcomes)} 个车牌号，新加入 {list(outcomes.values()).count('已加入任务表')} 个")
+        sys.exit(0)
 
+    avid = targets[0]
     data.initialize_db(downloaded_path, "MissAV")
-    if len(sys.argv) < 2:
-        print("用法: python main.py <车牌号>")
-        sys.exit(1)
-
-    avid = args.target.upper()
 
     if not args.force:
         if data.find_in_db(avid, downloaded_path, "MissAV"):
-            logger.info(f"{avid} 已在小姐姐数据库中")
+            print(f"{avid} 已在小姐姐数据库中")
             exit(0)
-            
-    logger.info(f"开始执行 车牌号: {avid}")
+
+    # 常驻下载服务在运行时，直接交给服务的任务表
+    jobs = open_queue()
+    if jobs.serviceAlive():
+        if jobs.enqueue(avid, args.priority, args.force):
+            print(f"'{avid}' 已提交到下载服务")
+        else:
+            print(f"'{avid}' 已在下载服务的任务表中")
+        exit(0)
 
     # 文件锁实现全局下载单例
     with open("work", "r") as f:
         content = f.read().strip()
     if content == "1":
-        logger.info(f"A download task is running, save {avid} to download queue")
-        with open(queue_path, 'a') as f: # 记录到queue中，等待下载
-                f.write(f'{avid}\n')
+        print(f"A download task is running, save {avid} to download queue")
+        jobs.enqueue(avid, args.priority, args.force) # 记录到任务表中，等待下载
         exit(0)
 
+    from src import downloaderMgr
+    from src.pipeline import downloadAV
+    from src.metrics import startExport
+    from metadata import gen_nfo
+    logger.info(f"Force: {args.force}")
+    logger.info(f"开始执行 车牌号: {avid}")
+
     with open("work", "w") as f:
         f.write("1")
-    
+    startExport("main") # 退出前写入本次下载各阶段的耗时
+
     mgr = downloaderMgr.DownloaderMgr()
     try:
         # 按照配置好的下载器顺序，依次尝试
-        if len(sorted_downloaders) == 0:
-            raise ValueError(f"cfg没有配置下载器：{sorted_downloaders}")
-        
-        count = 0
-        for it in sorted_downloaders:
-            count += 1
-            downloader = mgr.GetDownloader(it["downloaderName"])
-            if not downloader.setDomain(it["domain"]): # 设置成配置中的域名
-                logger.error(f"下载器 {downloader.getDownloaderName()} 的域名没有配置")
-                continue
-            if downloader is None:
-                logger.error(f"下载器{args.plugin} 没有找到")
-                raise ValueError(f"下载器{args.plugin} 没有找到")
-            logger.info(f"尝试使用Downloader: {downloader.getDownloaderName()} 下载")
-            lastDownloader = downloader
-
-            # 下载失败使用下一个downloader
-            info = downloader.downloadInfo(avid)
-            if not info:
-                logger.error(f"{avid} 下载元数据失败")
-                if count >= len(sorted_downloaders):
-                    raise ValueError(f"{avid} 下载元数据失败")
-                continue
-            logger.info(info)
-            if not downloader.downloadM3u8(info.m3u8, avid):
-                logger.error(f"{info.m3u8} 下载视频失败")
-                if count >= len(sorted_downloaders):
-                    raise ValueError(f"{info.m3u8} 下载视频失败")
-                continue
-            break
+        if not downloadAV(mgr, avid):
+            raise ValueError(f"{avid} 下载失败")
             
-        # 元数据只尝试下载一次，且只使用配置中权重最大的刮削器
-        gen_nfo()
+        # 元数据只尝试下载一次，且只使用配置中权重最大的刮削器；只处理刚下载完的车牌号
+        gen_nfo(avid)
             
     except ValueError as e:
         logger.error(e)
-        if append_if_not_duplicate(queue_path, avid):
+        if jobs.enqueue(avid, args.priority, args.force):
             logger.info(f"'{avid}' 已成功添加到下载队列。")
         else:
             logger.info(f"'{avid}' 已存在下载队列中。")
@@ -2,8 +2,11 @@
 from src.comm import *
 from src import data
 import os
-import time
-from src.scraper import Sracper
+from typing import Optional, Tuple
+from src.scraper import BatchScraper
+from src.ratelimit import scrape_limiter
+from src.staging import workPath, publish
+from src.metrics import metrics, startExport
 
 def list_folders(path):
     """返回指定路径下的所有文件夹名称"""
@@ -22,27 +25,90 @@ def has_nfo_file(folder_path):
                 return True
     return False
 
-def gen_nfo():
-    folders = list_folders(save_path)
-    data.batch_insert_bvids(folders, downloaded_path, "MissAV") # 多点脏数据也无所谓
-    for folder in folders:
-        if folder == "thumb":
-            continue
+def folder_state(folder_path) -> Tuple[bool, bool, float]:
+    """返回(是否有nfo, 是否有图片, 文件夹mtime)。先看第一层，没有nfo才递归子目录"""
+    has_nfo = has_images = False
+    has_subdir = False
+    with os.scandir(folder_path) as it:
+        for entry in it:
+            name = entry.name.lower()
+            if name.endswith('.nfo'):
+                has_nfo = True
+            elif name.endswith('.jpg'):
+                has_images = True
+            elif entry.is_dir():
+                has_subdir = True
+    if not has_nfo and has_subdir:
+        has_nfo = has_nfo_file(folder_path)
+    return has_nfo, has_images, os.stat(folder_path).st_mtime
+
+def changed_folders(path) -> Tuple[list, list]:
+    """
+    和LibraryState索引比较，返回(mtime有变化或新增的文件夹, 已删除的文件夹)
+    nfo和图片都直接写在车牌号文件夹下，文件有增删时文件夹的mtime会变
+    """
+    index = data.load_library_state(downloaded_path)
+    changed = []
+    seen = set()
+    with os.scandir(path) as it:
+        for entry in it:
+            if not entry.is_dir() or entry.name == "thumb" or entry.name.startswith("."):
+                continue
+            seen.add(entry.name)
+            state = index.get(entry.name)
+            if state is None or state[2] != entry.stat().st_mtime or not state[0]:
+                changed.append(entry.name)
+    removed = [folder for folder in index if folder not in seen]
+    return changed, removed
+
+def gen_nfo(avid: Optional[str] = None):
+    """
+    增量生成nfo：只处理LibraryState索引中有变化或还没有nfo的文件夹
+    :avid: 只处理这一个车牌号（下载完成后调用）。配置了ScratchPath时在暂存目录中刮削，然后整个文件夹移到SavePath，
+           移动失败时抛出ValueError，文件夹保留在暂存目录
+    """
+    with metrics.stage("gen_nfo"):
+        _gen_nfo(avid)
 
+def _gen_nfo(avid: Optional[str]):
+    root = save_path
+    if avid:
+        root = workPath()
+        folders = [avid] if os.path.isdir(os.path.join(root, avid)) else []
+    else:
+        with metrics.stage("scan_library"):
+            folders, removed = changed_folders(save_path)
+        if removed:
+            data.delete_library_state(removed, downloaded_path)
+    if not folders:
+        return
+
+    todo = []
+    states = []
+    for folder in folders:
         # 检查文件夹中是否有.nfo文件
-        if has_nfo_file(os.path.join(save_path, folder)):
+        state = folder_state(os.path.join(root, folder))
+        if state[0]:
             print(f"已有nfo: {folder}")
+            states.append((folder, *state))
             continue
-        # if os.path.exists(f"{folder}.html"):
-        #     print(f"已刮削: {folder}")
-        #     continue
+        todo.append(folder)
 
-        print(folder)
-        scraper = Sracper(save_path, myproxy)
-        scraper.scrape(folder)
-
-        time.sleep(5)
+    if todo:
+        # 并发刮削，按host限速代替固定的sleep
+        scraper = BatchScraper(save_path, myproxy, scrape_workers, work_path=root, limiter=scrape_limiter)
+        scraper.scrapeAll(todo)
+    changed = todo
+    if root != save_path:
+        if not publish(avid):
+            raise ValueError(f"{avid} 移到SavePath失败")
+        changed, states = folders, [] # 移动后以SavePath中的文件夹为准
+    data.batch_insert_bvids(folders, downloaded_path, "MissAV") # 多点脏数据也无所谓
+    # 刮削会写入新文件，重新记录状态；失败的文件夹has_nfo为0，下次还会尝试
+    states += [(folder, *folder_state(os.path.join(save_path, folder))) for folder in changed]
+    data.save_library_state(states, downloaded_path)
 
 if __name__ == "__main__":
+    startExport("metadata")
     data.initialize_db(downloaded_path, "MissAV")
-    gen_nfo()
\ No newline at end of file
+    gen_nfo()
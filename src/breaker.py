@@ -0,0 +1,132 @@
+# doc: 请求错误分类，以及按下载器和域名的熔断器：连续失败后短时间内直接跳过，到期后放一个请求试探
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional
+from curl_cffi.requests import exceptions
+from .comm import *
+
+# 错误类型
+DNS = "dns"
+TLS = "tls"
+TIMEOUT = "timeout"
+CONNECT = "connect"
+PROXY = "proxy"
+FORBIDDEN = "http_403"
+NOT_FOUND = "http_404"
+RATE_LIMITED = "http_429"
+SERVER_ERROR = "http_5xx"
+HTTP_ERROR = "http"
+EMPTY_PLAYLIST = "empty_playlist"
+CIRCUIT_OPEN = "circuit_open"
+NO_SPACE = "no_space" # 磁盘空间不够，不是网络问题
+LOCAL = "local" # 本地处理失败（转封装、合并part、完整性检查），和站点无关
+OTHER = "other"
+
+# 网络层面的错误，换一条线路（代理/直连）可能就好了
+NETWORK_ERRORS = {DNS, TLS, TIMEOUT, CONNECT, PROXY}
+# 说明域名本身不可用，计入熔断；404只说明这个车牌号不存在，站点是好的
+TRIPPING_ERRORS = NETWORK_ERRORS | {FORBIDDEN, RATE_LIMITED, SERVER_ERROR}
+# 本机的问题，不计入下载器的得分
+LOCAL_ERRORS = {NO_SPACE, LOCAL}
+
+def classifyError(e: Exception) -> str:
+    """把curl_cffi的异常归类成上面的错误类型"""
+    if isinstance(e, exceptions.DNSError):
+        return DNS
+    if isinstance(e, (exceptions.SSLError, exceptions.CertificateVerifyError)):
+        return TLS
+    if isinstance(e, exceptions.Timeout):
+        return TIMEOUT
+    if isinstance(e, exceptions.ProxyError):
+        return PROXY
+    if isinstance(e, exceptions.HTTPError):
+        response = getattr(e, "response", None)
+        return classifyStatus(response.status_code if response is not None else 0)
+    if isinstance(e, exceptions.ConnectionError):
+        return CONNECT
+    return OTHER
+
+def classifyStatus(status: int) -> Optional[str]:
+    """HTTP状态码对应的错误类型，2xx/3xx返回None"""
+    if status == 403:
+        return FORBIDDEN
+    if status == 404:
+        return NOT_FOUND
+    if status == 429:
+        return RATE_LIMITED
+    if status >= 500:
+        return SERVER_ERROR
+    if status >= 400 or status == 0:
+        return HTTP_ERROR
+    return None
+
+@dataclass
+class Circuit:
+    failures: int = 0
+    opened_at: float = 0.0 # 0表示闭合
+    cooldown: float = 0.0
+    probe_at: float = 0.0 # 试探请求放行的时间，0表示没有进行中的试探
+    last_error: str = ""
+
+class CircuitBreaker:
+    """
+    - 闭合: 正常请求，连续threshold次计入熔断的失败后断开
+    - 断开: cooldown秒内allow直接返回False，请求方立刻失败，不再等超时
+    - 半开: 冷却结束后只放行一个试探请求，成功则闭合，失败则以两倍的cooldown（不超过max_cooldown）重新断开；
+      试探请求cooldown秒内没有结果时再放行一个
+    """
+    def __init__(self, threshold: int = 3, cooldown: float = 60, max_cooldown: float = 1800):
+        self.threshold = max(1, threshold)
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.circuits: Dict[str, Circuit] = {}
+        self.lock = threading.Lock()
+
+    def allow(self, key: str) -> bool:
+        with self.lock:
+            circuit = self.circuits.get(key)
+            if circuit is None or not circuit.opened_at:
+                return True
+            now = time.time()
+            if now - circuit.opened_at < circuit.cooldown:
+                return False
+            # 试探请求没有回报结果（线程异常退出等）时，再过一个cooldown放行新的试探
+            if circuit.probe_at and now - circuit.probe_at < circuit.cooldown:
+                return False
+            circuit.probe_at = now
+            logger.info(f"{key} 熔断冷却结束，放行一个试探请求")
+            return True
+
+    def success(self, key: str):
+        with self.lock:
+            circuit = self.circuits.pop(key, None)
+        if circuit is not None and circuit.opened_at:
+            logger.info(f"{key} 已恢复，熔断关闭")
+
+    def failure(self, key: str, kind: str):
+        if kind not in TRIPPING_ERRORS:
+            # 站点有正常响应（如404），不算站点故障
+            self.success(key)
+            return
+        with self.lock:
+            circuit = self.circuits.setdefault(key, Circuit())
+            circuit.failures += 1
+            circuit.last_error = kind
+            if circuit.probe_at:
+                circuit.cooldown = min(self.max_cooldown, circuit.cooldown * 2)
+            elif circuit.failures >= self.threshold and not circuit.opened_at:
+                circuit.cooldown = self.cooldown
+            else:
+                return
+            circuit.opened_at = time.time()
+            circuit.probe_at = 0.0
+            cooldown = circuit.cooldown
+        logger.warning(f"{key} 连续失败({kind})，熔断 {cooldown:.0f}s")
+
+    def state(self, key: str) -> Optional[Circuit]:
+        with self.lock:
+            return self.circuits.get(key)
+
+# 进程内共享
+breaker = CircuitBreaker(breaker_threshold, breaker_cooldown)
@@ -0,0 +1,74 @@
+# doc: 分片级别的断点续传记录，和download_info.json放在同一目录
+import json
+import os
+import time
+from dataclasses import dataclass, asdict, field
+from typing import List, Optional
+from .comm import *
+from .hls import MediaPlaylist
+
+CHECKPOINT_FILE = "download_checkpoint.json"
+
+def playlistFingerprint(playlist: MediaPlaylist) -> str:
+    """分片数+总时长。重新解析得到的playlist url带的token会变，但同一个视频流的分片结构不变"""
+    return f"{len(playlist.segments)}:{playlist.duration:.1f}"
+
+@dataclass
+class Checkpoint:
+    """
+    done: 已按顺序写入输出的分片数，续传时从第done个分片开始
+    ts模式: offset是前done个分片在ts文件中的字节数，续传时截断到offset再追加
+    流式模式: 每次尝试生成一个part文件，parts记录每个part覆盖的分片区间[start, end)；
+    current是正在写入的part（下载中定期保存），进程崩溃或重启后从中保留已完整写入的分片
+    """
+    path: str = ""
+    downloader: str = ""
+    fingerprint: str = ""
+    mode: str = ""
+    total: int = 0
+    done: int = 0
+    offset: int = 0
+    parts: List[dict] = field(default_factory=list)
+    current: Optional[dict] = None
+    updated_at: float = 0.0
+
+    @classmethod
+    def load(cls, folder: str) -> "Checkpoint":
+        path = os.path.join(folder, CHECKPOINT_FILE)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                content = json.load(f)
+            content["path"] = path
+            return cls(**content)
+        except FileNotFoundError:
+            return cls(path=path)
+        except (ValueError, TypeError) as e:
+            logger.error(f"断点记录损坏，重新下载: {e}")
+            return cls(path=path)
+
+    def matches(self, downloader: str, playlist: MediaPlaylist, mode: str) -> bool:
+        return self.downloader == downloader and self.mode == mode \
+            and self.fingerprint == playlistFingerprint(playlist)
+
+    def reset(self, downloader: str, playlist: MediaPlaylist, mode: str):
+        self.downloader = downloader
+        self.fingerprint = playlistFingerprint(playlist)
+        self.mode = mode
+        self.total = len(playlist.segments)
+        self.done = 0
+        self.offset = 0
+        self.parts = []
+        self.current = None
+
+    def save(self):
+        self.updated_at = time.time()
+        content = asdict(self)
+        content.pop("path")
+        tmp = self.path + ".tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(content, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.path) # 原子替换，写到一半断电也不会损坏
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
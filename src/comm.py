@@ -1,50 +1,102 @@
 import json
-from loguru import logger
 import os
-import platform
+import threading
 
 # 获取项目目录
 current_file_path = os.path.abspath(__file__)
 project_root = os.path.dirname(os.path.dirname(current_file_path))
 
-# 获取配置
-with open(project_root+'/cfg/configs.json', 'r', encoding='utf-8') as file:
+# 获取配置，NASSAV_CONFIG可以指定其他配置文件（性能测试使用）
+config_path = os.environ.get("NASSAV_CONFIG") or project_root+'/cfg/configs.json'
+with open(config_path, 'r', encoding='utf-8') as file:
     configs = json.load(file)
-logger.info(configs)
-
-# 初始化日志
-logger.add(
-    configs["LogPath"]+"/{time:YYYY-MM-DD}.log",
-    rotation="00:00",            
-    retention="7 days", 
-    enqueue=False,
-    level="DEBUG",
-    format="{time:YYYY-MM-DD HH:mm:ss} | {level} | {message}"
-)
+
+class _LazyLogger:
+    """
+    第一次使用时才导入loguru并初始化日志：导入loguru要几十毫秒，
+    main.py已下载/已入队就退出的路径用不到日志，不需要付出这部分启动时间
+    """
+    def __init__(self):
+        self._logger = None
+        self._lock = threading.Lock()
+
+    def _setup(self):
+        with self._lock:
+            if self._logger is not None:
+                return self._logger
+            from loguru import logger
+            # 初始化日志
+            logger.add(
+                configs["LogPath"]+"/{time:YYYY-MM-DD}.log",
+                rotation="00:00",
+                retention="7 days",
+                enqueue=False,
+                level="DEBUG",
+                format="{time:YYYY-MM-DD HH:mm:ss} | {level} | {message}"
+            )
+            logger.info(configs)
+            logger.info(f"missav domain: {missAVDomain}")
+            logger.info(f"downloaders: {sorted_downloaders}")
+            self._logger = logger
+            return logger
+
+    def __getattr__(self, name):
+        return getattr(self._logger or self._setup(), name)
+
+logger = _LazyLogger()
 
 # 存储到变量中
 save_path = configs["SavePath"]
+scratch_path = configs.get("ScratchPath", "") # 本地暂存目录，整个车牌号文件夹在这里生成后再移到SavePath，空表示直接写SavePath
+disk_reserve = configs.get("DiskReserve", 1024) # 下载前检查空间时，工作目录和SavePath至少保留的空间(MB)
 downloaded_path = configs["DBPath"]
 queue_path = configs["QueuePath"]
 myproxy = configs["Proxy"]
 isNeedVideoProxy = configs["IsNeedVideoProxy"]
+db_bloom_filter = configs.get("DBBloomFilter", False) # 常驻服务在内存中用布隆过滤器判断“一定没下载过”
+worker_count = configs.get("WorkerCount", 2) # 常驻下载服务的并发worker数
+job_lease = configs.get("JobLeaseSeconds", 600) # 任务租约时长，超时未续约的任务会被重新领取
+job_max_attempts = configs.get("JobMaxAttempts", 3)
+job_retry_backoff = configs.get("JobRetryBackoff", 300) # 失败后第n次重试前等待 JobRetryBackoff * 2^(n-1) 秒
 if myproxy == "":
     myproxy = None
+extra_proxies = configs.get("Proxies", []) # Proxy之外的其他代理
+auto_route = configs.get("AutoRoute", True) # 按host测速，在直连和各代理之间选线路，单个请求失败时换线路
+route_probe_ttl = configs.get("RouteProbeTTL", 600) # 视频流host重新测速的间隔(秒)
 sorted_downloaders = sorted(
     [downloader for downloader in configs["Downloader"] if downloader["weight"] != 0],
     key=lambda x: x["weight"],
     reverse=True  # 降序排序
 )
-print(sorted_downloaders)
 missAVDomain = ""
+missAVStreamHost = "https://surrit.com" # MissAV视频流的地址，性能测试时指向本地服务
 for downloader in configs["Downloader"]:
     if downloader["downloaderName"] == "MissAV":
         missAVDomain = downloader["domain"]
+        missAVStreamHost = downloader.get("streamHost", missAVStreamHost)
         break
-logger.info(f"missav domain: {missAVDomain}")
+# 每个下载器解析结果的缓存时间(秒)，0表示不缓存
+resolve_cache_ttl = {
+    downloader["downloaderName"]: downloader.get("cacheTTL", 3600)
+    for downloader in configs["Downloader"]
+}
+resolve_deadline = configs.get("ResolveDeadline", 20) # 并发解析时等待高权重下载器的最长时间
+breaker_threshold = configs.get("BreakerThreshold", 3) # 同一下载器/域名连续失败多少次后熔断
+breaker_cooldown = configs.get("BreakerCooldown", 60) # 熔断后多少秒再试探，试探失败时翻倍
+adaptive_order = configs.get("AdaptiveOrder", True) # 按实测的成功率、耗时和吞吐调整下载器顺序
+save_html = configs.get("SaveHTML", False) # 调试用：读取并保存完整的页面，否则找到视频流地址后就停止读取
 
-# 初始化下载器
-download_tool = f"'{project_root}/tools/m3u8-Downloader-Go'"
-if platform.system() == 'Windows':
-    print("platform: Windows")
-    download_tool = rf"{project_root}\tools\m3u8-Downloader-Go.exe"
\ No newline at end of file
+segment_concurrency = configs.get("SegmentConcurrency", 8) # 同时下载的分片数
+segment_retries = configs.get("SegmentRetries", 3)
+stream_remux = configs.get("StreamRemux", True) # 分片直接送进ffmpeg转封装，不落地ts文件
+fragmented_mp4 = configs.get("FragmentedMP4", False) # 输出fMP4，不用等moov就能开始播放，流式下载中的视频也能边下边播
+verify_download = configs.get("VerifyDownload", True) # 检查每个分片的格式，下载完成后检查mp4的结构和时长
+scrape_workers = configs.get("ScrapeWorkers", 4) # 批量刮削的并发数
+scrape_rate = configs.get("ScrapeRate", 1.0) # 每个host每秒允许的请求数
+scrape_burst = configs.get("ScrapeBurst", 5)
+scrape_base_url = configs.get("ScrapeBaseUrl", "https://www.javbus.com") # 刮削站点
+bandwidth_limit = configs.get("BandwidthLimit", 0) # 所有请求的总带宽上限(MB/s)，0表示不限
+host_connections = configs.get("HostConnections", 0) # 每个host同时进行的请求数，0表示不限
+bandwidth_schedule = configs.get("BandwidthSchedule", []) # 按时段覆盖上面两项
+metrics_path = configs.get("MetricsPath", "") # Prometheus textfile路径，空表示不写
+metrics_port = configs.get("MetricsPort", 0) # 本地指标端点端口，0表示不开启
@@ -1,61 +1,286 @@
+import hashlib
+import json
+import math
 import sqlite3
-from typing import List
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 from .comm import *
 
-def initialize_db(db_path: str, table_name: str):
-    logger.debug(f"db_path: {db_path}, table_name: {table_name}")
+# 每个数据库文件在进程内只保留一个长连接，所有线程共用，写操作用锁串行
+_connections: Dict[str, Tuple[sqlite3.Connection, threading.RLock]] = {}
+_connections_lock = threading.Lock()
+
+def _shared_connection(db_path: str) -> Tuple[sqlite3.Connection, threading.RLock]:
+    with _connections_lock:
+        if db_path not in _connections:
+            conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False, cached_statements=256)
+            # WAL: 读写互不阻塞，提交时不需要每次整库fsync
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            _connections[db_path] = (conn, threading.RLock())
+        return _connections[db_path]
+
+class BloomFilter:
+    """判断“一定不存在”，不会误判已存在的车牌号为不存在"""
+    def __init__(self, capacity: int = 100000, error_rate: float = 0.001):
+        capacity = max(capacity, 1000)
+        self.size = int(-capacity * math.log(error_rate) / (math.log(2) ** 2))
+        self.hashes = max(1, int(self.size / capacity * math.log(2)))
+        self.bits = bytearray(self.size // 8 + 1)
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.size
+
+    def add(self, key: str):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+class AVDatabase:
+    """
+    已下载车牌号表的访问对象：
+    - 进程内共用一个WAL模式的长连接，语句由sqlite3缓存为预编译语句
+    - contains_many / insert_many 一次查询处理任意数量的车牌号
+    - 可选的布隆过滤器，“一定没下载过”的车牌号不需要查库；其他进程（main.py、metadata.py）插入的车牌号
+      通过 PRAGMA data_version 发现，按rowid增量加入过滤器
+    """
+    def __init__(self, db_path: str, table_name: str = "MissAV", bloom: bool = False):
+        self.db_path = db_path
+        self.table_name = table_name
+        self.conn, self.lock = _shared_connection(db_path)
+        self.bloom: Optional[BloomFilter] = None
+        self.bloom_rowid = 0        # 已加入过滤器的最大rowid
+        self.bloom_version = None   # 上次同步时的data_version
+        self.initialize()
+        if bloom:
+            self.enableBloom()
+
+    def initialize(self):
+        with self.lock:
+            self.conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {self.table_name} (
+                bvid TEXT PRIMARY KEY
+            )
+            ''')
+            self.conn.commit()
+
+    def enableBloom(self):
+        """全表扫描一次构建过滤器，适合常驻进程"""
+        with self.lock:
+            count = self.conn.execute(f"SELECT COUNT(*) FROM {self.table_name}").fetchone()[0]
+            self.bloom = BloomFilter(count * 2)
+            self.bloom_rowid = 0
+            self._syncBloom()
+
+    def _syncBloom(self):
+        """调用方持有锁。其他连接提交过修改时（data_version变化），把新插入的行加入过滤器"""
+        version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        if version == self.bloom_version:
+            return
+        for rowid, bvid in self.conn.execute(
+                f"SELECT rowid, bvid FROM {self.table_name} WHERE rowid > ? ORDER BY rowid", (self.bloom_rowid,)):
+            self.bloom.add(bvid)
+            self.bloom_rowid = rowid
+        self.bloom_version = version
 
+    def contains(self, bvid: str) -> bool:
+        with self.lock:
+            if self.bloom is not None:
+                self._syncBloom()
+                if bvid not in self.bloom:
+                    return False
+            row = self.conn.execute(f"SELECT 1 FROM {self.table_name} WHERE bvid = ? LIMIT 1", (bvid,)).fetchone()
+        return row is not None
+
+    def contains_many(self, bvids: Iterable[str]) -> Set[str]:
+        """返回其中已存在的车牌号，整批只查一次库"""
+        bvids = list(bvids)
+        with self.lock:
+            if self.bloom is not None:
+                self._syncBloom()
+                bvids = [bvid for bvid in bvids if bvid in self.bloom]
+            if not bvids:
+                return set()
+            rows = self.conn.execute(
+                f"SELECT bvid FROM {self.table_name} WHERE bvid IN (SELECT value FROM json_each(?))",
+                (json.dumps(bvids),)
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def insert_many(self, bvids: Iterable[str]) -> int:
+        """批量插入，自动忽略已存在的，返回新插入的数量"""
+        bvids = list(bvids)
+        with self.lock:
+            try:
+                # 使用 INSERT OR IGNORE 避免重复插入
+                before = self.conn.total_changes
+                self.conn.executemany(
+                    f'INSERT OR IGNORE INTO {self.table_name} (bvid) VALUES (?)',
+                    [(bvid,) for bvid in bvids]
+                )
+                self.conn.commit()
+                inserted = self.conn.total_changes - before
+            except sqlite3.Error as e:
+                logger.error(f"插入BVID时出错: {e}")
+                self.conn.rollback()
+                return 0
+            # 在锁内更新，多个worker同时插入时不会丢失过滤器中的位
+            if self.bloom is not None:
+                for bvid in bvids:
+                    self.bloom.add(bvid)
+        return inserted
+
+_databases: Dict[Tuple[str, str], AVDatabase] = {}
+
+def open_db(db_path: str, table_name: str = "MissAV") -> AVDatabase:
+    """进程内复用同一个AVDatabase"""
+    key = (db_path, table_name)
+    with _connections_lock:
+        db = _databases.get(key)
+    if db is None:
+        db = AVDatabase(db_path, table_name)
+        with _connections_lock:
+            db = _databases.setdefault(key, db)
+    return db
+
+def initialize_db(db_path: str, table_name: str):
     """初始化数据库，创建表"""
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    
-    # 创建表（如果不存在）
-    cursor.execute(f'''
-    CREATE TABLE IF NOT EXISTS {table_name} (
-        bvid TEXT PRIMARY KEY
-    )
-    ''')
-    
-    conn.commit()
-    conn.close()
+    open_db(db_path, table_name)
 
 def batch_insert_bvids(bvid_list: list[str], db_path: str, table_name: str):
     """批量插入BVID，自动忽略已存在的"""
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    
-    try:
-        # 使用 INSERT OR IGNORE 避免重复插入
-        cursor.executemany(
-            f'INSERT OR IGNORE INTO {table_name} (bvid) VALUES (?)',
-            [(bvid,) for bvid in bvid_list]
-        )
-        conn.commit()
-        logger.info(f"成功插入 {cursor.rowcount}")
-    except sqlite3.Error as e:
-        logger.error(f"插入BVID时出错: {e}")
-        conn.rollback()
-    finally:
-        conn.close()
+    inserted = open_db(db_path, table_name).insert_many(bvid_list)
+    logger.info(f"成功插入 {inserted}")
 
 def find_in_db(bvid: str, db_path: str, table_name: str) -> bool:
     try:
-        # 连接到 SQLite 数据库
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        # 执行查询
-        query = f"SELECT 1 FROM {table_name} WHERE bvid = ? LIMIT 1"
-        cursor.execute(query, (bvid,))
-        result = cursor.fetchone()
-        # 关闭连接
-        cursor.close()
-        conn.close()
-        
-        return result is not None
-        
+        return open_db(db_path, table_name).contains(bvid)
     except sqlite3.Error as e:
         print(f"数据库错误: {e}")
         return False
     except Exception as e:
         print(f"发生错误: {e}")
-        return False
\ No newline at end of file
+        return False
+
+def _query(db_path: str, init: str, sql: str, params=(), many: bool = False) -> list:
+    """在共享连接上执行一条语句（先确保表存在），出错时返回空列表"""
+    try:
+        conn, lock = _shared_connection(db_path)
+        with lock:
+            conn.execute(init)
+            if many:
+                conn.executemany(sql, params)
+                rows = []
+            else:
+                rows = conn.execute(sql, params).fetchall()
+            conn.commit()
+            return rows
+    except sqlite3.Error as e:
+        logger.error(f"数据库错误: {e}")
+        return []
+
+_KV_TABLE = "CREATE TABLE IF NOT EXISTS {} (key TEXT PRIMARY KEY, value TEXT)"
+
+def get_value(key: str, db_path: str, table_name: str) -> Optional[str]:
+    """简单的键值表，表不存在时返回None"""
+    rows = _query(db_path, _KV_TABLE.format(table_name), f"SELECT value FROM {table_name} WHERE key = ?", (key,))
+    return rows[0][0] if rows else None
+
+def set_value(key: str, value: str, db_path: str, table_name: str):
+    _query(db_path, _KV_TABLE.format(table_name),
+           f"INSERT OR REPLACE INTO {table_name} (key, value) VALUES (?, ?)", (key, value))
+
+_RESOLVE_CACHE_TABLE = '''
+CREATE TABLE IF NOT EXISTS ResolveCache (
+    avid TEXT NOT NULL,
+    downloader TEXT NOT NULL,
+    info TEXT NOT NULL,
+    resolved_at REAL NOT NULL,
+    PRIMARY KEY (avid, downloader)
+)
+'''
+
+def get_resolve_cache(avid: str, downloader: str, ttl: float, db_path: str) -> Optional[str]:
+    """返回TTL内的解析结果(download_info的json)，没有或已过期返回None，过期的记录顺便删除"""
+    rows = _query(db_path, _RESOLVE_CACHE_TABLE,
+                  "SELECT info, resolved_at FROM ResolveCache WHERE avid = ? AND downloader = ?",
+                  (avid, downloader))
+    if not rows:
+        return None
+    if rows[0][1] <= time.time() - ttl:
+        drop_resolve_cache(avid, downloader, db_path)
+        return None
+    return rows[0][0]
+
+def set_resolve_cache(avid: str, downloader: str, info: str, db_path: str):
+    _query(db_path, _RESOLVE_CACHE_TABLE,
+           "INSERT OR REPLACE INTO ResolveCache (avid, downloader, info, resolved_at) VALUES (?, ?, ?, ?)",
+           (avid, downloader, info, time.time()))
+
+def drop_resolve_cache(avid: str, downloader: str, db_path: str):
+    _query(db_path, _RESOLVE_CACHE_TABLE,
+           "DELETE FROM ResolveCache WHERE avid = ? AND downloader = ?", (avid, downloader))
+
+def prune_resolve_cache(ttls: Dict[str, float], db_path: str):
+    """删除所有已过期的解析结果，ttls中没有或TTL为0的下载器的记录全部删除"""
+    _query(db_path, _RESOLVE_CACHE_TABLE,
+           """DELETE FROM ResolveCache WHERE resolved_at <= ? -
+           COALESCE((SELECT value FROM json_each(?) WHERE key = ResolveCache.downloader), 0)""",
+           (time.time(), json.dumps(ttls)))
+
+_LIBRARY_STATE_TABLE = '''
+CREATE TABLE IF NOT EXISTS LibraryState (
+    folder TEXT PRIMARY KEY,
+    has_nfo INTEGER NOT NULL DEFAULT 0,
+    has_images INTEGER NOT NULL DEFAULT 0,
+    mtime REAL NOT NULL
+)
+'''
+
+def load_library_state(db_path: str) -> dict:
+    """返回 {folder: (has_nfo, has_images, mtime)}"""
+    rows = _query(db_path, _LIBRARY_STATE_TABLE, "SELECT folder, has_nfo, has_images, mtime FROM LibraryState")
+    return {row[0]: (bool(row[1]), bool(row[2]), row[3]) for row in rows}
+
+def save_library_state(states: list, db_path: str):
+    """states: [(folder, has_nfo, has_images, mtime)]"""
+    _query(db_path, _LIBRARY_STATE_TABLE,
+           "INSERT OR REPLACE INTO LibraryState (folder, has_nfo, has_images, mtime) VALUES (?, ?, ?, ?)",
+           [(folder, int(has_nfo), int(has_images), mtime) for folder, has_nfo, has_images, mtime in states],
+           many=True)
+
+def delete_library_state(folders: list, db_path: str):
+    _query(db_path, _LIBRARY_STATE_TABLE,
+           "DELETE FROM LibraryState WHERE folder = ?", [(folder,) for folder in folders], many=True)
+
+_DOWNLOADER_STATS_TABLE = '''
+CREATE TABLE IF NOT EXISTS DownloaderStats (
+    downloader TEXT NOT NULL,
+    domain TEXT NOT NULL,
+    success REAL NOT NULL,
+    latency REAL,
+    throughput REAL,
+    samples INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (downloader, domain)
+)
+'''
+
+def load_downloader_stats(db_path: str) -> dict:
+    """返回 {(downloader, domain): (success, latency, throughput, samples, updated_at)}"""
+    rows = _query(db_path, _DOWNLOADER_STATS_TABLE,
+                  "SELECT downloader, domain, success, latency, throughput, samples, updated_at FROM DownloaderStats")
+    return {(row[0], row[1]): tuple(row[2:]) for row in rows}
+
+def save_downloader_stats(downloader: str, domain: str, stats: tuple, db_path: str):
+    """stats: (success, latency, throughput, samples, updated_at)"""
+    _query(db_path, _DOWNLOADER_STATS_TABLE,
+           "INSERT OR REPLACE INTO DownloaderStats (downloader, domain, success, latency, throughput, samples, updated_at) "
+           "VALUES (?, ?, ?, ?, ?, ?, ?)", (downloader, domain, *stats))
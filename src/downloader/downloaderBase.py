@@ -1,12 +1,27 @@
 # doc: 定义下载类的基础操作
 from abc import ABC, abstractmethod
+import codecs
 import json
-from loguru import logger
 import os
+import time
 from dataclasses import dataclass, asdict, field
-from typing import Optional, Tuple
+from typing import Optional, Sequence, Tuple
 from pathlib import Path
 from ..comm import *
+from ..hls import HLSDownloader, MediaPlaylist
+from ..remux import StreamRemuxer, remuxFile, concatParts
+from ..checkpoint import Checkpoint
+from ..staging import estimateSize, checkSpace
+from ..verify import inspectMp4, coveredSegments, salvageFragments
+from ..session import fetch
+from ..governor import governor
+from ..metrics import metrics
+from ..extract import Extractor
+from ..scoring import getScores
+from ..breaker import breaker, classifyError, NETWORK_ERRORS, TRIPPING_ERRORS, FORBIDDEN, CIRCUIT_OPEN, NO_SPACE, LOCAL, OTHER
+from ..routes import routes, RouteManager, DIRECT
+from urllib.parse import urlparse
+from .. import data
 from curl_cffi import requests
 
 # 下载信息，只保留最基础的信息。只需要填写avid，其他字段用于调试，选填
@@ -62,6 +77,7 @@ class Downloader(ABC):
             'https': proxy
         } if proxy else None
         self.timeout = timeout
+        self.lastError: Optional[str] = None # 最近一次视频下载失败的错误类型，见breaker.py
     
     def setDomain(self, domain: str) -> bool:
         if domain:  
@@ -69,10 +85,28 @@ class Downloader(ABC):
             return True
         return False
 
+    @property
+    def baseUrl(self) -> str:
+        '''站点地址，domain可以带scheme（如性能测试时的http://127.0.0.1:8000）'''
+        return self.domain if "://" in self.domain else f"https://{self.domain}"
+
     @abstractmethod
     def getDownloaderName(self) -> str:
         pass
 
+    def _stage(self, stage: str, url: str = ""):
+        '''统计一个阶段的耗时，默认按下载器的域名打标签，视频流相关的阶段传入url按CDN域名打标签'''
+        if not url and hasattr(self, "domain"):
+            url = self.baseUrl
+        return metrics.stage(stage, self.getDownloaderName(), urlparse(url).netloc)
+
+    def _circuitKey(self, url: str, useProxy: bool = False) -> str:
+        '''熔断按下载器和域名区分，视频流的直连和代理是两条线路，分开熔断'''
+        return f"{self.getDownloaderName()}@{urlparse(url).netloc}" + ("(proxy)" if useProxy else "")
+
+    def _recordError(self, kind: str, url: str):
+        metrics.inc("nassav_errors_total", downloader=self.getDownloaderName(), domain=urlparse(url).netloc, kind=kind)
+
     @abstractmethod
     def getHTML(self, avid: str) -> Optional[str]:
         '''需要实现的方法：根据avid，构造url并请求，获取html, 返回字符串'''
@@ -86,82 +120,497 @@ class Downloader(ABC):
         '''
         pass
     
-    def downloadInfo(self, avid: str) -> Optional[AVDownloadInfo]:
-        '''将元数据download_info.json序列化到到对应位置，同时返回AVDownloadInfo'''
-        # 获取html
+    def resolve(self, avid: str) -> Optional[Tuple[AVDownloadInfo, str]]:
+        '''
+        只请求和解析，不写文件，可以和其他下载器并发执行。返回(AVDownloadInfo, html)
+        TTL内解析过且视频流仍然可用时直接使用缓存，此时html为空
+        '''
         avid = avid.upper()
-        print(os.path.join(self.path, avid))
-        os.makedirs(os.path.join(self.path, avid), exist_ok=True)
-        html = self.getHTML(avid)
+        with self._stage("resolve") as stage:
+            with self._stage("resolve_cache") as cached:
+                info = self._loadCache(avid)
+                cached.ok = info is not None
+            result = (info, "") if info is not None else self._resolveFresh(avid)
+            stage.ok = result is not None
+        return result
+
+    def _resolveFresh(self, avid: str) -> Optional[Tuple[AVDownloadInfo, str]]:
+        with self._stage("fetch_html") as stage:
+            html = self.getHTML(avid)
+            stage.ok = bool(html)
+            stage.bytes = len(html or "")
         if not html:
-            logger.error("获取html失败")
+            logger.error(f"{self.getDownloaderName()} 获取html失败")
             return None
-        with open(os.path.join(self.path, avid, avid+".html"), "w+") as f:
-            f.write(html)
 
         # 从html中解析元数据，返回MissAVInfo结构体
-        info = self.parseHTML(html)
+        with self._stage("parse_html") as stage:
+            info = self.parseHTML(html)
+            stage.ok = info is not None
         if info is None:
-            logger.error("解析元数据失败")
+            logger.error(f"{self.getDownloaderName()} 解析元数据失败")
             return None
-        
         info.avid = info.avid.upper() # 强制大写
-        info.to_json(os.path.join(self.path, avid, "download_info.json"))
+        if resolve_cache_ttl.get(self.getDownloaderName(), 0) > 0:
+            data.set_resolve_cache(avid, self.getDownloaderName(), json.dumps(asdict(info), ensure_ascii=False), downloaded_path)
+        return info, html
+
+    def _loadCache(self, avid: str) -> Optional[AVDownloadInfo]:
+        ttl = resolve_cache_ttl.get(self.getDownloaderName(), 0)
+        if ttl <= 0:
+            return None
+        content = data.get_resolve_cache(avid, self.getDownloaderName(), ttl, downloaded_path)
+        if content is None:
+            return None
+        info = AVDownloadInfo(**json.loads(content))
+        if not self._streamAlive(info.m3u8):
+            logger.info(f"{self.getDownloaderName()} 缓存的视频流已失效，重新解析")
+            data.drop_resolve_cache(avid, self.getDownloaderName(), downloaded_path)
+            return None
+        logger.info(f"{self.getDownloaderName()} 使用缓存的解析结果: {info.m3u8}")
+        return info
+
+    def _streamAlive(self, url: str) -> bool:
+        """缓存的playlist是否还能访问，和下载分片一样按线路顺序请求，网络错误时换下一条线路"""
+        preferred = self.proxy if isNeedVideoProxy and self.proxy else DIRECT
+        candidates = routes.order(url, preferred, probe=False) if routes else [preferred]
+        for route in candidates:
+            begin = time.monotonic()
+            try:
+                response = fetch(url, proxies=RouteManager.proxies(route), timeout=10)
+            except Exception as e:
+                kind = classifyError(e)
+                if routes:
+                    routes.record(url, route, False, kind=kind)
+                logger.debug(f"视频流检查失败({kind}): {e}")
+                if kind in NETWORK_ERRORS:
+                    continue
+                return False
+            if routes and response.status_code == 200:
+                routes.record(url, route, True, time.monotonic() - begin)
+            return response.status_code == 200 and "#EXTM3U" in response.text
+        return False
+
+    def saveInfo(self, avid: str, info: AVDownloadInfo, html: str):
+        '''保存download_info.json，开启SaveHTML时同时保存html；使用缓存时没有html，保留已有的文件'''
+        avid = avid.upper()
+        with self._stage("save_info") as stage:
+            os.makedirs(os.path.join(self.path, avid), exist_ok=True)
+            if html and save_html:
+                with open(os.path.join(self.path, avid, avid+".html"), "w+") as f:
+                    f.write(html)
+                stage.bytes = len(html)
+            stage.ok = info.to_json(os.path.join(self.path, avid, "download_info.json"))
         logger.info("已保存到 download_info.json")
 
+    def downloadInfo(self, avid: str) -> Optional[AVDownloadInfo]:
+        '''将元数据download_info.json序列化到到对应位置，同时返回AVDownloadInfo'''
+        result = self.resolve(avid)
+        if result is None:
+            return None
+        info, html = result
+        self.saveInfo(avid, info, html)
         return info
 
     
     def downloadM3u8(self, url: str, avid: str) -> bool:
         """m3u8视频下载"""
-        os.makedirs(os.path.dirname(os.path.join(self.path, avid)), exist_ok=True)
+        os.makedirs(os.path.join(self.path, avid), exist_ok=True)
+        with self._stage("download_m3u8", url) as stage:
+            stage.ok = self._downloadM3u8(url, avid)
+        return stage.ok
+
+    def _downloadM3u8(self, url: str, avid: str) -> bool:
         try:
-            if isNeedVideoProxy and self.proxy:
-                logger.info("使用代理")
-                command = f"{download_tool} -u {url} -o {os.path.join(self.path, avid, avid+'.ts')} -p {self.proxy}"
-            else:
-                logger.info("不使用代理")
-                command = f"{download_tool} -u {url} -o {os.path.join(self.path, avid, avid+'.ts')}"
-            logger.debug(command)
-            if os.system(command) != 0:
-                # 难顶。。。使用代理下载失败，尝试不用代理；不用代理下载失败，尝试使用代理
-                if not isNeedVideoProxy and self.proxy:
-                    logger.info("尝试使用代理")
-                    command = f"{download_tool} -u {url} -o {os.path.join(self.path, avid, avid+'.ts')} -p {self.proxy}"
-                else:
-                    logger.info("尝试不使用代理")
-                    command = f"{download_tool} -u {url} -o {os.path.join(self.path, avid, avid+'.ts')}"
-                logger.debug(f"retry {command}")
-                if os.system(command) != 0:
-                    return False
-            
-            # 转mp4
-            convert = f"ffmpeg -i {os.path.join(self.path, avid, avid+'.ts')} -c copy -f mp4 {os.path.join(self.path, avid, avid+'.mp4')}"
-            logger.debug(convert)
-            if os.system(convert) != 0:
+            if routes is not None:
+                # 每个请求失败时各自换线路，不需要换一条线路从头再下载一遍
+                return self._downloadVideo(url, avid, False)
+            useProxy = bool(isNeedVideoProxy and self.proxy)
+            logger.info("使用代理" if useProxy else "不使用代理")
+            if self._downloadVideo(url, avid, useProxy):
+                return True
+            # 难顶。。。使用代理下载失败，尝试不用代理；不用代理下载失败，尝试使用代理
+            # 只有网络错误、403（地区限制）或线路已熔断时换线路才可能有用，404、空playlist、转封装失败换了也一样
+            if not self.proxy or self.lastError not in NETWORK_ERRORS | {FORBIDDEN, CIRCUIT_OPEN}:
                 return False
-            if os.system(f"rm {os.path.join(self.path, avid, avid+'.ts')}") != 0:
+            useProxy = not useProxy
+            logger.info("尝试使用代理" if useProxy else "尝试不使用代理")
+            return self._downloadVideo(url, avid, useProxy)
+        except Exception as e:
+            logger.error(f"视频下载异常: {e}")
+            return False
+
+    def _downloadVideo(self, url: str, avid: str, useProxy: bool) -> bool:
+        """
+        使用进程内的HLS下载器下载分片并转成mp4
+        流式模式下分片直接送进ffmpeg，只写一次mp4；否则先写完整的ts再转封装
+        下载进度记录在download_checkpoint.json，重试时只下载缺少的分片
+        """
+        self.lastError = None
+        if routes is not None:
+            hls = HLSDownloader(None, segment_concurrency, retries=segment_retries, routes=routes,
+                                preferred=self.proxy if isNeedVideoProxy and self.proxy else DIRECT)
+        else:
+            hls = HLSDownloader(self.proxy if useProxy else None, segment_concurrency, retries=segment_retries)
+        playlist = self._fetchPlaylist(hls, url, useProxy)
+        if playlist is None:
+            # 网络不通时重新解析也没用，直接返回换线路
+            if self.lastError in NETWORK_ERRORS or self.lastError == CIRCUIT_OPEN:
                 return False
+            # playlist链接可能已过期，用同一个下载器重新解析
+            url = self._reresolve(avid)
+            if not url:
+                return False
+            playlist = self._fetchPlaylist(hls, url, useProxy)
+            if playlist is None:
+                return False
+        size = estimateSize(playlist)
+        logger.info(f"分片数: {len(playlist.segments)}, 时长: {playlist.duration:.0f}s, 并发: {hls.concurrency}"
+                    + (f", 预计大小: {size/1024/1024:.0f}MB" if size else ""))
+        if size and not checkSpace(size):
+            self.lastError = NO_SPACE
+            return False
+
+        mode = "stream" if stream_remux else "ts"
+        checkpoint = Checkpoint.load(os.path.join(self.path, avid))
+        if checkpoint.matches(self.getDownloaderName(), playlist, mode):
+            logger.info(f"断点续传: 已完成 {checkpoint.done}/{checkpoint.total} 个分片")
+        else:
+            checkpoint.reset(self.getDownloaderName(), playlist, mode)
+
+        hls.lastError = None
+        if stream_remux:
+            ok = self._downloadStream(hls, playlist, avid, checkpoint)
+        else:
+            ok = self._downloadTS(hls, playlist, avid, checkpoint)
+        if ok and verify_download and not self._verify(playlist, avid, checkpoint):
+            # 只缺结尾的分片时_verify把已有的部分登记成part，续传一次只下载缺少的分片
+            ok = bool(checkpoint.parts) and self._downloadStream(hls, playlist, avid, checkpoint) \
+                and self._verify(playlist, avid, checkpoint)
+        if ok:
+            checkpoint.remove()
+        elif hls.lastError:
+            # 分片下载失败，计入视频流线路的熔断
+            self.lastError = hls.lastError
+            breaker.failure(self._circuitKey(playlist.url, useProxy), hls.lastError)
+            self._recordError(hls.lastError, playlist.url)
+        else:
+            # 分片都下载成功，失败在转封装、合并或完整性检查
+            self.lastError = LOCAL
+        return ok
+
+    def _fetchPlaylist(self, hls: HLSDownloader, url: str, useProxy: bool) -> Optional[MediaPlaylist]:
+        key = self._circuitKey(url, useProxy)
+        if not breaker.allow(key):
+            logger.warning(f"{key} 熔断中，跳过")
+            self.lastError = CIRCUIT_OPEN
+            return None
+        with self._stage("playlist", url) as stage:
+            playlist = hls.fetchPlaylist(url)
+            stage.ok = playlist is not None
+        if playlist is None:
+            self.lastError = hls.lastError or OTHER
+            breaker.failure(key, self.lastError)
+            self._recordError(self.lastError, url)
+        else:
+            breaker.success(key)
+        return playlist
+
+    def _downloadTS(self, hls: HLSDownloader, playlist: MediaPlaylist, avid: str, checkpoint: Checkpoint) -> bool:
+        ts_path = os.path.join(self.path, avid, avid+'.ts')
+        mp4_path = os.path.join(self.path, avid, avid+'.mp4')
+        resume = checkpoint.done > 0 and os.path.exists(ts_path)
+        if not resume:
+            checkpoint.done = checkpoint.offset = 0
+        last_save = [time.time()]
+
+        with open(ts_path, 'r+b' if resume else 'wb') as f:
+            # 丢弃最后一次记录之后写入的不完整数据
+            f.truncate(checkpoint.offset)
+            f.seek(checkpoint.offset)
+
+            def onProgress(done, total, written):
+                segments.bytes = written
+                f.flush()
+                checkpoint.done = done
+                checkpoint.offset = f.tell()
+                if time.time() - last_save[0] >= 5:
+                    checkpoint.save()
+                    last_save[0] = time.time()
+
+            with self._stage("segments", playlist.url) as segments:
+                ok = segments.ok = hls.download(playlist, f, onProgress, start=checkpoint.done, writeInit=not resume)
+            self._recordThroughput(segments)
+            f.flush()
+            checkpoint.offset = f.tell()
+        checkpoint.save()
+        if not ok:
+            return False
+        # 转mp4
+        with self._stage("remux") as stage:
+            stage.ok = remuxFile(ts_path, mp4_path)
+        if not stage.ok:
+            return False
+        os.remove(ts_path)
+        return True
+
+    def _downloadStream(self, hls: HLSDownloader, playlist: MediaPlaylist, avid: str, checkpoint: Checkpoint) -> bool:
+        folder = os.path.join(self.path, avid)
+        mp4_path = os.path.join(folder, avid+'.mp4')
+        # 只保留文件还在的part；上次中断时正在写入的part尽量保留已完整写入的分片
+        parts = [p for p in checkpoint.parts if os.path.exists(os.path.join(folder, p["file"]))]
+        checkpoint.parts = parts
+        checkpoint.done = parts[-1]["end"] if parts else 0
+        self._salvageCurrent(folder, playlist, checkpoint)
+        parts = checkpoint.parts
+        if parts and checkpoint.done >= len(playlist.segments):
+            # 分片都已写入，上次在合并或改名之前中断，不用再启动ffmpeg
+            logger.info(f"{len(parts)} 个part已覆盖全部分片，直接合并")
+            return self._finishParts(folder, avid, checkpoint)
+        # fMP4从头下载时直接写最终的mp4，下载过程中就能播放已写入的部分；续传的part另外命名，最后再合并
+        live = fragmented_mp4 and not parts
+        part = {"file": f"{avid}.mp4" if live else f"{avid}.part{len(parts)}.mp4", "start": checkpoint.done, "end": checkpoint.done}
+        # 有断点记录说明还没下载完，不会把写到一半的mp4当成已完成的视频；记下正在写入的part，重启后可以找回
+        checkpoint.current = part
+        checkpoint.save()
+        progress = [checkpoint.done]
+        last_save = [time.time()]
+
+        def onProgress(done, total, written):
+            progress[0] = done
+            segments.bytes = written
+            if time.time() - last_save[0] >= 5:
+                checkpoint.current = dict(part, end=done)
+                checkpoint.save()
+                last_save[0] = time.time()
+
+        remuxer = StreamRemuxer(os.path.join(folder, part["file"]))
+        # 流式模式下转封装和分片下载同时进行，remux阶段只统计结束ffmpeg和合并part的时间
+        with self._stage("segments", playlist.url) as segments:
+            ok = segments.ok = hls.download(playlist, remuxer, onProgress, start=checkpoint.done)
+        self._recordThroughput(segments)
+        if not ok and progress[0] == part["start"]:
+            remuxer.abort()
+            checkpoint.current = None
+            checkpoint.save()
+            return False
+        # 失败时也正常结束ffmpeg，已写入的分片保存为一个完整的part
+        with self._stage("remux") as stage:
+            stage.ok = remuxer.close()
+        checkpoint.current = None
+        if not stage.ok:
+            checkpoint.save()
+            return False
+        part["end"] = progress[0]
+        checkpoint.parts.append(part)
+        checkpoint.done = part["end"]
+        checkpoint.save()
+        if not ok:
+            return False
+        return self._finishParts(folder, avid, checkpoint)
+
+    def _salvageCurrent(self, folder: str, playlist: MediaPlaylist, checkpoint: Checkpoint):
+        """
+        上次进程崩溃或重启时正在写入的part：
+        - ffmpeg正常结束了（Python异常退出时stdin关闭）: mp4完整，时长正好落在分片边界上时整个保留
+        - fMP4: 截掉最后不完整的fragment，保留到最后一个分片边界
+        - 普通mp4在ffmpeg结束前没有moov，无法使用，删除后重新下载这些分片
+        """
+        current, checkpoint.current = checkpoint.current, None
+        if not current:
+            return
+        path = os.path.join(folder, current["file"])
+        start = current["start"]
+        if start != checkpoint.done or not os.path.exists(path):
+            return
+        durations = [seg.duration for seg in playlist.segments[start:]]
+        info = inspectMp4(path)
+        covered = coveredSegments(durations, info.duration) if info.ok else salvageFragments(path, durations)
+        if covered > 0:
+            checkpoint.parts.append({"file": current["file"], "start": start, "end": start + covered})
+            checkpoint.done = start + covered
+            checkpoint.save()
+            logger.info(f"找回中断时正在写入的 {current['file']}: {covered} 个分片")
+        else:
+            os.remove(path)
+
+    def _finishParts(self, folder: str, avid: str, checkpoint: Checkpoint) -> bool:
+        """把覆盖全部分片的part改名或合并成最终的mp4；合并失败时删除part和断点记录，下次重新下载"""
+        mp4_path = os.path.join(folder, avid+'.mp4')
+        part_paths = [os.path.join(folder, p["file"]) for p in checkpoint.parts]
+        if len(part_paths) == 1:
+            if part_paths[0] != mp4_path:
+                os.replace(part_paths[0], mp4_path)
+                checkpoint.parts[0]["file"] = os.path.basename(mp4_path)
+                checkpoint.save()
             return True
-        except:
+        logger.info(f"合并 {len(part_paths)} 个断点续传的part")
+        # 第一个part可能就是mp4_path，先合并到临时文件再替换
+        concat_path = os.path.join(folder, avid+'.concat.mp4')
+        with self._stage("concat") as stage:
+            stage.ok = concatParts(part_paths, concat_path)
+        if not stage.ok:
+            # 保留这些part的话每次重试都会再合并失败，视频永远下载不完
+            logger.error("合并part失败，删除后重新下载")
+            for path in part_paths + [concat_path]:
+                if os.path.exists(path):
+                    os.remove(path)
+            checkpoint.parts = []
+            checkpoint.done = 0
+            checkpoint.remove()
             return False
+        # 先把断点记录指向合并结果再替换：替换后中断时不会把已包含全部分片的mp4当成第一个part再合并一次
+        total = checkpoint.parts[-1]["end"]
+        checkpoint.parts = [{"file": os.path.basename(concat_path), "start": 0, "end": total}]
+        checkpoint.save()
+        os.replace(concat_path, mp4_path)
+        checkpoint.parts = [{"file": os.path.basename(mp4_path), "start": 0, "end": total}]
+        checkpoint.save()
+        for part_path in part_paths:
+            if part_path != mp4_path and os.path.exists(part_path):
+                os.remove(part_path)
+        return True
+
+    def _verify(self, playlist: MediaPlaylist, avid: str, checkpoint: Checkpoint) -> bool:
+        """
+        下载完成后检查：写入的分片数和playlist一致，mp4的box结构完整，时长不比playlist短（只读box头和moov/moof，不解码）
+        流式模式下mp4完整但正好缺了结尾的若干分片时，把它登记为第一个part，返回False由调用方续传；其他情况删除mp4和断点记录
+        """
+        folder = os.path.join(self.path, avid)
+        mp4_path = os.path.join(folder, avid+'.mp4')
+        total = len(playlist.segments)
+        tolerance = max(1.0, playlist.target_duration / 2)
+        with self._stage("verify") as stage:
+            info = inspectMp4(mp4_path)
+            if checkpoint.done != total:
+                reason = f"写入了 {checkpoint.done}/{total} 个分片"
+            elif not info.ok:
+                reason = info.reason
+            elif info.duration < playlist.duration - tolerance:
+                reason = f"时长 {info.duration:.1f}s，playlist为 {playlist.duration:.1f}s"
+            else:
+                stage.ok = True
+                return True
+        logger.error(f"{avid} 完整性检查失败: {reason}")
+
+        covered = coveredSegments([seg.duration for seg in playlist.segments], info.duration) if info.ok else -1
+        if stream_remux and 0 < covered < total:
+            part = {"file": f"{avid}.part0.mp4", "start": 0, "end": covered}
+            os.replace(mp4_path, os.path.join(folder, part["file"]))
+            checkpoint.parts = [part]
+            checkpoint.done = covered
+            checkpoint.save()
+            logger.info(f"保留前 {covered} 个分片，续传剩下的 {total - covered} 个")
+            return False
+        if os.path.exists(mp4_path):
+            os.remove(mp4_path)
+        checkpoint.parts = []
+        checkpoint.done = 0
+        checkpoint.remove()
+        return False
+
+    def _recordThroughput(self, segments):
+        '''分片吞吐计入下载器得分'''
+        getScores().recordThroughput(self.getDownloaderName(), getattr(self, "domain", ""), segments.bytes, segments.elapsed)
+
+    def _reresolve(self, avid: str) -> Optional[str]:
+        """通过getHTML/parseHTML重新获取视频流地址，跳过缓存"""
+        logger.info(f"{self.getDownloaderName()} 重新解析视频流: {avid}")
+        result = self._resolveFresh(avid)
+        if result is None or not result[0].m3u8:
+            return None
+        info, html = result
+        self.saveInfo(avid, info, html)
+        return info.m3u8
     
-    def _fetch_html(self, url: str, referer: str = "") -> Optional[str]:
+    def _fetch_html(self, url: str, referer: str = "",
+                    until: Optional[Tuple[Extractor, Sequence[str]]] = None,
+                    errors: Optional[list] = None,
+                    abort: Optional[threading.Event] = None) -> Optional[str]:
+        '''
+        until: (提取规则, 字段名)，边接收边匹配，字段都拿到后关闭连接，只返回已读取的部分
+        开启SaveHTML时总是读取完整页面
+        errors: 失败时追加错误类型（并发请求时lastError会被其他线程覆盖）
+        abort: 并发请求时其他请求已经拿到结果，置位后不再发出请求，边接收边匹配时在分块之间关闭连接，返回None
+        '''
         logger.debug(f"fetch url: {url}")
+        key = self._circuitKey(url)
+        if not breaker.allow(key):
+            # 站点已熔断，立即失败，不再等待超时
+            logger.debug(f"{key} 熔断中，跳过: {url}")
+            if errors is not None:
+                errors.append(CIRCUIT_OPEN)
+            return None
+        # 有多条线路时按实际请求的结果排序，网络错误时换下一条线路
+        candidates = routes.order(url, self.proxy or DIRECT, probe=False) if routes else [self.proxy or DIRECT]
+        for i, route in enumerate(candidates):
+            if abort is not None and abort.is_set():
+                return None
+            proxies = RouteManager.proxies(route)
+            begin = time.monotonic()
+            try:
+                if until is not None and not save_html:
+                    text = self._fetchUntil(url, referer, *until, proxies=proxies, abort=abort)
+                    if text is None:
+                        logger.debug(f"已不再需要，停止读取: {url}")
+                        return None
+                else:
+                    response = fetch(
+                        url,
+                        proxies=proxies,
+                        headers=headers,
+                        referer=referer,
+                        timeout=self.timeout,
+                    )
+                    response.raise_for_status()
+                    text = response.text
+            except requests.exceptions.RequestException as e:
+                kind = classifyError(e)
+                if routes:
+                    routes.record(url, route, False, kind=kind)
+                    if kind in TRIPPING_ERRORS and i + 1 < len(candidates):
+                        routes.failover(url, route, kind, candidates[i+1])
+                        continue
+                breaker.failure(key, kind)
+                self._recordError(kind, url)
+                logger.error(f"请求失败({kind}): {str(e)}")
+                if errors is not None:
+                    errors.append(kind)
+                return None
+            if routes:
+                # 网页只有前面一部分时也按小请求统计延迟
+                routes.record(url, route, True, time.monotonic() - begin)
+            breaker.success(key)
+            return text
+        return None
+
+    def _fetchUntil(self, url: str, referer: str, extractor: Extractor, names: Sequence[str],
+                    proxies: Optional[dict] = None, abort: Optional[threading.Event] = None) -> Optional[str]:
+        response = fetch(
+            url,
+            proxies=proxies,
+            headers=headers,
+            referer=referer,
+            timeout=self.timeout,
+            stream=True,
+        )
         try:
-            newHeader = headers
-            if referer:
-                newHeader["Referer"] = referer
-            response = requests.get(
-                url,
-                proxies=self.proxies,
-                headers=newHeader,
-                timeout=self.timeout,
-                impersonate="chrome110",  # 可选：chrome, chrome110, edge99, safari15_5
-            )
             response.raise_for_status()
-            return response.text
-        except requests.exceptions.RequestException as e:
-            logger.error(f"请求失败: {str(e)}")
-            return None
-    
\ No newline at end of file
+            try:
+                decoder = codecs.getincrementaldecoder(response.charset_encoding or "utf-8")(errors="replace")
+            except LookupError:
+                decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+            text = ""
+            watcher = extractor.watch(names)
+            for chunk in response.iter_content():
+                governor.consume(len(chunk))
+                if abort is not None and abort.is_set():
+                    return None
+                text += decoder.decode(chunk)
+                if watcher.found(text):
+                    # 提前关闭连接，剩下的页面不再下载
+                    logger.debug(f"已匹配 {', '.join(names)}，读取 {len(text)} 个字符后停止: {url}")
+                    return text
+            return text + decoder.decode(b"", final=True)
+        finally:
+            response.close()
@@ -1,6 +1,12 @@
 from .downloaderBase import *
-import re
+from ..extract import Extractor, Rule
 
+HOHOJ_SEARCH = Extractor([
+    Rule("id", r'[?&]id=(\d+)'),
+])
+HOHOJ_EMBED = Extractor([
+    Rule("m3u8", r'var videoSrc\s*=\s*"([^"]+)"'),
+])
 
 class HohoJDownloader(Downloader):
     def __init__(self, path: str, proxy = None, timeout = 15):
@@ -11,21 +17,19 @@ class HohoJDownloader(Downloader):
 
     def getHTML(self, avid: str) -> Optional[str]:
         '''需要先搜索，获取到详情页url'''
-        searchUrl = f"https://hohoj.tv/search?text={avid}"
+        searchUrl = f"{self.baseUrl}/search?text={avid}"
         logger.debug(searchUrl)
-        content = self._fetch_html(searchUrl)
+        content = self._fetch_html(searchUrl, until=(HOHOJ_SEARCH, ("id",)))
         if not content: return None
 
-        first_id = None  # 初始化为默认值
-        match = re.search(r'[?&]id=(\d+)', content)
-        if match:
-            first_id = match.group(1)
+        first_id = HOHOJ_SEARCH.first(content, "id")
+        if first_id:
             logger.info(first_id)
         if not first_id:
             return None
-        videoUrl = f"https://hohoj.tv/embed?id={first_id}"
+        videoUrl = f"{self.baseUrl}/embed?id={first_id}"
         logger.debug(videoUrl)
-        content = self._fetch_html(videoUrl, referer=f"https://hohoj.tv/video?id={first_id}")
+        content = self._fetch_html(videoUrl, referer=f"{self.baseUrl}/video?id={first_id}", until=(HOHOJ_EMBED, ("m3u8",)))
         if not content: return None
         return content
 
@@ -34,9 +38,8 @@ class HohoJDownloader(Downloader):
         downloadInfo = AVDownloadInfo()
 
         # 1. 提取m3u8
-        match = re.search(r'var videoSrc\s*=\s*"([^"]+)"', html)
-        if match:
-            downloadInfo.m3u8 = match.group(1)
+        if m3u8 := HOHOJ_EMBED.first(html, "m3u8"):
+            downloadInfo.m3u8 = m3u8
             logger.info(downloadInfo.m3u8)
         else:
             logger.error("未找到URL")
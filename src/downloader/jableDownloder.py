@@ -1,15 +1,22 @@
 from .downloaderBase import *
+from ..extract import Extractor, Rule
 import re
 
+JABLE = Extractor([
+    Rule("m3u8", r"var hlsUrl = '(https?://[^']+)'"),
+    Rule("title", r'<meta property="og:title" content="([^"]+)"'),
+])
+AVID_PATTERN = re.compile(r'([A-Z]+(?:-[A-Z]+)*-\d+)')
+
 class JableDownloader(Downloader):
     def getDownloaderName(self) -> str:
         return "Jable"
 
     def getHTML(self, avid: str) -> Optional[str]:
         '''需要实现的方法：根据avid，构造url并请求，获取html, 返回字符串'''
-        url = f'https://{self.domain}/videos/{avid}/'.lower()
+        url = f'{self.baseUrl}/videos/{avid}/'.lower()
         logger.debug(url)
-        content = self._fetch_html(url)
+        content = self._fetch_html(url, until=(JABLE, ("m3u8", "title")))
         if content: return content
         return None
 
@@ -18,10 +25,8 @@ class JableDownloader(Downloader):
         missavMetadata = AVDownloadInfo()
 
         # 1. 提取m3u8
-        pattern = r"var hlsUrl = '(https?://[^']+)'"
-        match = re.search(pattern, html)
-        if match:
-            missavMetadata.m3u8 = match.group(1)
+        if m3u8 := JABLE.first(html, "m3u8"):
+            missavMetadata.m3u8 = m3u8
             logger.info(missavMetadata.m3u8)
         else:
             logger.error("未找到 m3u8")
@@ -37,11 +42,10 @@ class JableDownloader(Downloader):
     def _extract_metadata(html: str, metadata: AVDownloadInfo) -> bool:
         try:
             # 提取OG标签
-            og_title = re.search(r'<meta property="og:title" content="([^"]+)"', html)
+            title_content = JABLE.first(html, "title")
 
-            if og_title: # 处理标题和番号
-                title_content = og_title.group(1)
-                if code_match := re.search(r'([A-Z]+(?:-[A-Z]+)*-\d+)', title_content):
+            if title_content: # 处理标题和番号
+                if code_match := AVID_PATTERN.search(title_content):
                     metadata.avid = code_match.group(1)
                     metadata.title = title_content.replace(metadata.avid, '').strip()
                 else:
@@ -1,25 +1,62 @@
 from .downloaderBase import *
+from .. import data
+from ..breaker import NOT_FOUND
+from ..extract import Extractor, Rule
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, Tuple
 
+MISSAV = Extractor([
+    Rule("title", r'<meta property="og:title" content="(.*?)"'),
+    Rule("uuid", r"m3u8\|([a-f0-9\|]+)\|com\|surrit\|https\|video"),
+])
+AVID_PATTERN = re.compile(r'^([A-Z]+(?:-[A-Z]+)*-\d+)')
+STREAM_PATTERN = re.compile(r'#EXT-X-STREAM-INF:BANDWIDTH=(\d+),.*?RESOLUTION=(\d+x\d+).*?\n(.*)')
+
 class MissAVDownloader(Downloader):
     def getDownloaderName(self) -> str:
         return "MissAV"
 
-    def getHTML(self, avid: str) -> Optional[str]:
-        '''需要实现的方法：根据avid，构造url并请求，获取html, 返回字符串'''
-        url = f'https://{self.domain}/cn/{avid}-uncensored-leak'.lower()
-        content = self._fetch_html(url)
-        if content: return content
+    # 按优先级排列的页面后缀
+    variants = ["-uncensored-leak", "-chinese-subtitle", ""]
+    # 读到uuid（在标题之后）就可以停止
+    until = (MISSAV, ("title", "uuid"))
 
-        url = f'https://{self.domain}/cn/{avid}-chinese-subtitle'.lower()
-        content = self._fetch_html(url)
-        if content: return content
+    def _variantUrl(self, avid: str, variant: str) -> str:
+        return f'{self.baseUrl}/cn/{avid}{variant}'.lower()
 
-        url = f'https://{self.domain}/cn/{avid}'.lower()
-        content = self._fetch_html(url)
-        if content: return content
+    def getHTML(self, avid: str) -> Optional[str]:
+        '''需要实现的方法：根据avid，构造url并请求，获取html, 返回字符串'''
+        # 之前解析成功过的后缀直接使用
+        variant = data.get_value(avid, downloaded_path, "MissAVVariant")
+        if variant is not None and variant in self.variants:
+            content = self._fetch_html(self._variantUrl(avid, variant), until=self.until)
+            if content: return content
 
+        # 所有后缀并发请求，按优先级返回第一个成功的结果
+        # 只有优先级更高的后缀都确定不存在(404)时才记住这个后缀；它们是因为熔断、超时等失败的，
+        # 记住后以后都会固定使用优先级低的后缀
+        pool = ThreadPoolExecutor(max_workers=len(self.variants))
+        abort = threading.Event()
+        try:
+            errors = {v: [] for v in self.variants}
+            futures = [(v, pool.submit(self._fetch_html, self._variantUrl(avid, v), until=self.until,
+                                       errors=errors[v], abort=abort))
+                       for v in self.variants]
+            definitive = True
+            for variant, future in futures:
+                content = future.result()
+                if content:
+                    if definitive:
+                        data.set_value(avid, variant, downloaded_path, "MissAVVariant")
+                    return content
+                definitive = definitive and errors[variant] == [NOT_FOUND]
+        finally:
+            # 优先级更低的请求不再需要：所有后缀同时在执行，没有排队的任务可以取消，
+            # 通过abort让它们在下一个分块或下一条线路之前关闭连接
+            abort.set()
+            pool.shutdown(wait=False)
         return None
 
     def parseHTML(self, html: str) -> Optional[AVDownloadInfo]:
@@ -28,7 +65,7 @@ class MissAVDownloader(Downloader):
 
         # 1. 提取m3u8
         if uuid := self._extract_uuid(html):
-            playlist_url = f"https://surrit.com/{uuid}/playlist.m3u8"
+            playlist_url = f"{missAVStreamHost}/{uuid}/playlist.m3u8"
             result = self._get_highest_quality_m3u8(playlist_url)
             if result:
                 m3u8_url, resolution = result
@@ -50,8 +87,8 @@ class MissAVDownloader(Downloader):
     @staticmethod
     def _extract_uuid(html: str) -> Optional[str]:
         try:
-            if match := re.search(r"m3u8\|([a-f0-9\|]+)\|com\|surrit\|https\|video", html):
-                return "-".join(match.group(1).split("|")[::-1])
+            if packed := MISSAV.first(html, "uuid"):
+                return "-".join(packed.split("|")[::-1])
             return None
         except Exception as e:
             logger.error(f"UUID提取异常: {str(e)}")
@@ -61,11 +98,10 @@ class MissAVDownloader(Downloader):
     def _extract_metadata(html: str, metadata: AVDownloadInfo) -> bool:
         try:
             # 提取OG标签
-            og_title = re.search(r'<meta property="og:title" content="(.*?)"', html)
+            title_content = MISSAV.first(html, "title")
 
-            if og_title: # 处理标题和番号
-                title_content = og_title.group(1)
-                if code_match := re.search(r'^([A-Z]+(?:-[A-Z]+)*-\d+)', title_content):
+            if title_content is not None: # 处理标题和番号
+                if code_match := AVID_PATTERN.search(title_content):
                     metadata.avid = code_match.group(1)
                     metadata.title = title_content.replace(metadata.avid, '').strip()
                 else:
@@ -80,16 +116,12 @@ class MissAVDownloader(Downloader):
     @staticmethod
     def _get_highest_quality_m3u8(playlist_url: str) -> Optional[Tuple[str, str]]:
         try:
-            response = requests.get(playlist_url, timeout=10, impersonate="chrome110")
+            response = fetch(playlist_url, timeout=10)
             response.raise_for_status()
             playlist_content = response.text
             
             streams = []
-            pattern = re.compile(
-                r'#EXT-X-STREAM-INF:BANDWIDTH=(\d+),.*?RESOLUTION=(\d+x\d+).*?\n(.*)'
-            )
-            
-            for match in pattern.finditer(playlist_content):
+            for match in STREAM_PATTERN.finditer(playlist_content):
                 bandwidth = int(match.group(1))
                 resolution = match.group(2)
                 url = match.group(3).strip()
@@ -4,24 +4,32 @@ from .downloader.missAVDownloader import MissAVDownloader
 from .downloader.hohoJDownloader import HohoJDownloader
 from .downloader.memoDownloader import MemoDownloader
 from .comm import *
+from .staging import workPath
+from . import data
 from typing import Optional
 
 class DownloaderMgr:
-    downloaders: dict = {}
-
     def __init__(self):
+        # 每个实例持有独立的下载器，常驻服务中每个worker各用一个DownloaderMgr
+        self.downloaders: dict = {}
+        # 配置了ScratchPath时下载到暂存目录，刮削完成后由gen_nfo移到SavePath
+        path = workPath()
+
         # 手动注册handler
-        downloader = MissAVDownloader(save_path, myproxy)
+        downloader = MissAVDownloader(path, myproxy)
         self.downloaders[downloader.getDownloaderName()] = downloader
 
-        downloader = JableDownloader(save_path, myproxy)
+        downloader = JableDownloader(path, myproxy)
         self.downloaders[downloader.getDownloaderName()] = downloader
 
-        downloader = HohoJDownloader(save_path, myproxy)
+        downloader = HohoJDownloader(path, myproxy)
         self.downloaders[downloader.getDownloaderName()] = downloader
 
-        downloader = MemoDownloader(save_path, myproxy)
+        downloader = MemoDownloader(path, myproxy)
         self.downloaders[downloader.getDownloaderName()] = downloader
+
+        # 启动时清理过期的解析缓存，包括已经关闭缓存(cacheTTL为0)的下载器留下的记录
+        data.prune_resolve_cache(resolve_cache_ttl, downloaded_path)
     
     def GetDownloader(self, downloaderName: str) -> Optional[Downloader]:
-        return self.downloaders[downloaderName]
+        return self.downloaders.get(downloaderName)
@@ -0,0 +1,202 @@
+# doc: 页面字段提取：规则预编译，先截取页面中相关的区域，再用字面前缀定位、正则只在候选位置上匹配
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+_SPECIAL = set(".^$*+?{}[]|()")
+
+def _hasTopLevelBranch(pattern: str) -> bool:
+    depth = 0
+    in_class = False
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == "\\":
+            i += 2
+            continue
+        if in_class:
+            in_class = c != "]"
+        elif c == "[":
+            in_class = True
+            if pattern[i+1:i+2] == "]":
+                i += 1 # []]中的]是字面量
+        elif c == "(":
+            depth += 1
+        elif c == ")":
+            depth -= 1
+        elif c == "|" and depth == 0:
+            return True
+        i += 1
+    return False
+
+def literalPrefix(pattern: str) -> str:
+    """正则开头的字面量部分，遇到第一个元字符为止；被量词修饰的最后一个字符不算，顶层有|时没有前缀"""
+    if _hasTopLevelBranch(pattern):
+        return ""
+    prefix = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == "\\":
+            if i + 1 >= len(pattern) or pattern[i+1].isalnum():
+                break # \s \d 等字符类
+            c = pattern[i+1]
+            i += 2
+        elif c in _SPECIAL:
+            if c in "*?{" and prefix:
+                prefix.pop()
+            break
+        else:
+            i += 1
+        if i < len(pattern) and pattern[i] in "*?{":
+            break # 当前字符可以出现0次
+        prefix.append(c)
+    return "".join(prefix)
+
+@dataclass
+class Rule:
+    """
+    name: 字段名
+    pattern: 正则，需要的部分用分组捕获；一个分组时结果为字符串，多个分组时为元组
+    many: 收集所有不重叠的匹配（列表），否则只取第一次匹配
+    """
+    name: str
+    pattern: str
+    many: bool = False
+    regex: re.Pattern = field(init=False, repr=False)
+    prefix: str = field(init=False)
+
+    def __post_init__(self):
+        self.regex = re.compile(self.pattern)
+        self.prefix = literalPrefix(self.pattern)
+
+    def _value(self, m: re.Match) -> Any:
+        if self.regex.groups == 0:
+            return m.group(0)
+        if self.regex.groups == 1:
+            return m.group(1)
+        return m.groups()
+
+    def scan(self, text: str, lo: int, hi: int):
+        """按顺序产生text[lo:hi]中不重叠的匹配，结果和finditer一致"""
+        if not self.prefix:
+            yield from self.regex.finditer(text, lo, hi)
+            return
+        pos = text.find(self.prefix, lo, hi)
+        while pos >= 0:
+            m = self.regex.match(text, pos, hi)
+            if m:
+                yield m
+                pos = max(m.end(), pos + 1)
+            else:
+                pos += 1
+            pos = text.find(self.prefix, pos, hi)
+
+class Extractor:
+    """
+    - region: (开始标记, 结束标记)，只在两者之间提取；开始标记不存在时使用整页，结束标记不存在时到页尾
+    - 每条规则用str.find定位字面前缀，正则只在候选位置上match，不会逐字符尝试整页
+    - 规则在模块加载时编译一次，各下载器和刮削共用
+    """
+    def __init__(self, rules: Sequence[Rule], region: Optional[Tuple[str, str]] = None):
+        self.rules = list(rules)
+        self.region = region
+
+    def bounds(self, html: str) -> Tuple[int, int]:
+        if not self.region:
+            return 0, len(html)
+        start_marker, end_marker = self.region
+        lo = html.find(start_marker)
+        if lo < 0:
+            return 0, len(html)
+        hi = html.find(end_marker, lo + len(start_marker))
+        return lo, len(html) if hi < 0 else hi
+
+    def extract(self, html: str) -> Dict[str, Any]:
+        """返回 {字段名: 值}，没有匹配到的字段不出现；many字段总是存在（可能为空列表）"""
+        lo, hi = self.bounds(html)
+        result: Dict[str, Any] = {}
+        for rule in self.rules:
+            if rule.many:
+                result[rule.name] = [rule._value(m) for m in rule.scan(html, lo, hi)]
+                continue
+            m = next(rule.scan(html, lo, hi), None)
+            if m:
+                result[rule.name] = rule._value(m)
+        return result
+
+    def found(self, html: str, names: Sequence[str]) -> bool:
+        """
+        流式读取时判断是否可以停止：names中的字段都已匹配，且匹配没有到达已读内容的末尾
+        （到达末尾的匹配可能还不完整，比如数字或url只读到一半）
+        """
+        lo, hi = self.bounds(html)
+        for rule in self.rules:
+            if rule.name not in names:
+                continue
+            m = next(rule.scan(html, lo, hi), None)
+            if m is None or m.end() >= len(html):
+                return False
+        return True
+
+    def watch(self, names: Sequence[str]) -> "Watcher":
+        """流式读取时用Watcher增量判断，代替每个分块都对整页调用found"""
+        return Watcher(self, names)
+
+    def first(self, html: str, name: str) -> Optional[Any]:
+        """只提取一个字段"""
+        lo, hi = self.bounds(html)
+        for rule in self.rules:
+            if rule.name == name:
+                m = next(rule.scan(html, lo, hi), None)
+                return rule._value(m) if m else None
+        return None
+
+class Watcher:
+    """
+    流式读取时增量地判断names中的字段是否都已匹配，结果和Extractor.found一致
+    - 每次只扫描新读到的部分，加上前面overlap个字符（跨过分块边界、或上次到达末尾还不完整的匹配），
+      总耗时和页面长度成正比；长度超过overlap的匹配可能被漏掉
+    - 已匹配的字段不再扫描
+    - 区域标记同样只在新读到的部分里查找；读到开始标记时从标记处重新扫描所有字段
+    """
+    def __init__(self, extractor: Extractor, names: Sequence[str], overlap: int = 4096):
+        self.extractor = extractor
+        self.rules = [rule for rule in extractor.rules if rule.name in names]
+        self.pending = list(self.rules)
+        self.overlap = overlap
+        self.scanned = 0            # 字段已扫描到的位置
+        self.read = 0               # 区域标记已查找到的位置
+        self.lo: Optional[int] = None
+        self.hi: Optional[int] = None
+
+    def _updateBounds(self, html: str):
+        start_marker, end_marker = self.extractor.region
+        if self.lo is None:
+            pos = html.find(start_marker, max(0, self.read - len(start_marker) + 1))
+            if pos >= 0:
+                # 之前是按整页匹配的，改为只在区域内匹配
+                self.lo = pos
+                self.pending = list(self.rules)
+                self.scanned = pos
+        if self.lo is not None and self.hi is None:
+            pos = html.find(end_marker, max(self.lo + len(start_marker), self.read - len(end_marker) + 1))
+            if pos >= 0:
+                self.hi = pos
+        self.read = len(html)
+
+    def found(self, html: str) -> bool:
+        """html: 到目前为止读到的全部内容"""
+        if self.extractor.region:
+            self._updateBounds(html)
+        lo = self.lo or 0
+        hi = len(html) if self.hi is None else self.hi
+        start = max(lo, self.scanned - self.overlap)
+        self.scanned = len(html)
+        pending = []
+        for rule in self.pending:
+            m = next(rule.scan(html, start, hi), None)
+            if m is None or m.end() >= len(html):
+                pending.append(rule)
+        self.pending = pending
+        return not pending
@@ -0,0 +1,135 @@
+# doc: 进程内共享的带宽和连接数控制：总带宽上限、每个host的并发连接数上限，以及按时段切换的限速配置
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+from urllib.parse import urlparse
+from .comm import *
+from .metrics import metrics
+from .ratelimit import TokenBucket
+
+MB = 1024 * 1024
+
+@dataclass
+class Profile:
+    """limit: 总带宽(MB/s)，host_connections: 每个host同时进行的请求数，0都表示不限"""
+    limit: float = 0.0
+    host_connections: int = 0
+
+@dataclass
+class Window:
+    start: int # 从0点开始的分钟数
+    end: int
+    profile: Profile
+
+    def contains(self, minute: int) -> bool:
+        if self.start <= self.end:
+            return self.start <= minute < self.end
+        return minute >= self.start or minute < self.end # 跨过0点
+
+def _minutes(value: str) -> int:
+    hour, minute = value.split(":", 1)
+    return int(hour) * 60 + int(minute)
+
+def parseSchedule(entries: List[dict], default: Profile) -> List[Window]:
+    """BandwidthSchedule配置：[{"start": "19:00", "end": "23:30", "limit": 5, "hostConnections": 4}]，省略的字段使用默认值"""
+    windows = []
+    for entry in entries:
+        try:
+            profile = Profile(float(entry.get("limit", default.limit)),
+                              int(entry.get("hostConnections", default.host_connections)))
+            windows.append(Window(_minutes(entry["start"]), _minutes(entry["end"]), profile))
+        except (KeyError, ValueError) as e:
+            logger.error(f"BandwidthSchedule配置有误，忽略: {entry} ({e})")
+    return windows
+
+class BandwidthGovernor:
+    """
+    网页、分片和图片请求都经过这里（见session.fetch）
+    - 总带宽: 字节令牌桶，请求完成后按实际字节数扣除（可以欠账），之后的请求等到还清才发出，
+      单个分片比桶大也不会卡住；同时按活跃连接数给每个请求设置curl的接收速率上限，平滑突发，不挤占同一条线路上的其他流量
+    - 每个host的连接数: 超过上限的请求等待，不会同时对一个CDN开太多连接
+    - 时段: 当前时间落在BandwidthSchedule的某个时段内时使用该时段的配置，否则使用默认配置，每分钟检查一次
+    """
+    def __init__(self, default: Profile, schedule: Optional[List[Window]] = None):
+        self.default = default
+        self.schedule = schedule or []
+        self.bucket = TokenBucket(0, 1)
+        self.cond = threading.Condition()
+        self.active: Dict[str, int] = {}
+        self.total = 0
+        self.profile = default
+        self.checked = time.monotonic()
+        self._apply(self.current())
+
+    def current(self) -> Profile:
+        now = datetime.now()
+        minute = now.hour * 60 + now.minute
+        for window in self.schedule:
+            if window.contains(minute):
+                return window.profile
+        return self.default
+
+    def _apply(self, profile: Profile):
+        self.profile = profile
+        with self.bucket.lock:
+            self.bucket.rate = profile.limit * MB
+            self.bucket.burst = max(1.0, profile.limit * MB) # 最多攒1秒的流量
+            # 不限速时清掉欠账，正在等待的请求立即放行
+            self.bucket.tokens = self.bucket.burst if not profile.limit else min(self.bucket.tokens, self.bucket.burst)
+        with self.cond:
+            self.cond.notify_all() # 连接数上限可能变大了
+
+    def _update(self):
+        now = time.monotonic()
+        if now - self.checked < 60:
+            return
+        self.checked = now
+        profile = self.current()
+        if profile != self.profile:
+            logger.info(f"切换限速配置: 总带宽 {profile.limit or '不限'} MB/s, 每个host连接数 {profile.host_connections or '不限'}")
+            self._apply(profile)
+
+    @contextmanager
+    def connection(self, url: str) -> Iterator[int]:
+        """占用host的一个连接，返回本次请求的接收速率上限(字节/秒，0表示不限)"""
+        self._update()
+        host = urlparse(url).netloc
+        begin = time.monotonic()
+        with self.cond:
+            while self.profile.host_connections and self.active.get(host, 0) >= self.profile.host_connections:
+                self.cond.wait(1.0)
+            self.active[host] = self.active.get(host, 0) + 1
+            self.total += 1
+            active = self.total
+        waited = time.monotonic() - begin
+        if waited > 0.01:
+            metrics.inc("nassav_governor_wait_seconds_total", waited, reason="connections")
+        try:
+            speed = 0
+            if self.profile.limit:
+                begin = time.monotonic()
+                self.bucket.acquire(0) # 等到之前的欠账还清
+                waited = time.monotonic() - begin
+                if waited > 0.01:
+                    metrics.inc("nassav_governor_wait_seconds_total", waited, reason="bandwidth")
+                speed = max(64 * 1024, int(self.profile.limit * MB / active))
+            yield speed
+        finally:
+            with self.cond:
+                self.active[host] -= 1
+                if not self.active[host]:
+                    del self.active[host]
+                self.total -= 1
+                self.cond.notify_all()
+
+    def consume(self, size: int):
+        """请求完成后扣除实际传输的字节数"""
+        if self.profile.limit and size > 0:
+            self.bucket.consume(size)
+
+# 进程内共享
+_default = Profile(bandwidth_limit, host_connections)
+governor = BandwidthGovernor(_default, parseSchedule(bandwidth_schedule, _default))
@@ -0,0 +1,289 @@
+# doc: 进程内的HLS分片下载器，替代外部的m3u8-Downloader-Go
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import BinaryIO, Callable, Dict, List, Optional, Tuple
+from urllib.parse import urljoin
+from .comm import *
+from .session import fetch
+from .breaker import classifyError, EMPTY_PLAYLIST, TRIPPING_ERRORS
+from .routes import RouteManager, DIRECT
+from .verify import checkSegment
+
+@dataclass
+class SegmentKey:
+    method: str = "NONE"
+    uri: str = ""
+    iv: Optional[bytes] = None
+
+@dataclass
+class Segment:
+    index: int
+    url: str
+    duration: float = 0.0
+    sequence: int = 0                             # media sequence，AES-128没有IV时用它作为IV
+    byterange: Optional[Tuple[int, int]] = None   # (length, offset)
+    key: Optional[SegmentKey] = None
+
+@dataclass
+class MediaPlaylist:
+    url: str
+    segments: List[Segment] = field(default_factory=list)
+    init: Optional[Segment] = None                # EXT-X-MAP，fmp4分片的初始化段
+    target_duration: float = 0.0
+    bandwidth: int = 0                            # master playlist中所选子流的码率(bit/s)，0表示未知
+
+    @property
+    def duration(self) -> float:
+        return sum(seg.duration for seg in self.segments)
+
+def _parse_attributes(line: str) -> Dict[str, str]:
+    """解析 KEY=VALUE,KEY="VALUE" 形式的属性列表"""
+    attrs = {}
+    for match in re.finditer(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)', line):
+        attrs[match.group(1)] = match.group(2).strip('"')
+    return attrs
+
+def _parse_byterange(value: str, last_end: int) -> Tuple[int, int]:
+    if "@" in value:
+        length, offset = value.split("@", 1)
+        return int(length), int(offset)
+    return int(value), last_end
+
+def isMasterPlaylist(text: str) -> bool:
+    return "#EXT-X-STREAM-INF" in text
+
+def selectVariant(text: str, url: str) -> Optional[Tuple[str, int]]:
+    """从master playlist中选带宽最高的子流，返回(url, 码率)，码率优先取AVERAGE-BANDWIDTH"""
+    best = None
+    lines = text.splitlines()
+    for i, line in enumerate(lines):
+        if not line.startswith("#EXT-X-STREAM-INF"):
+            continue
+        attrs = _parse_attributes(line.split(":", 1)[1])
+        bandwidth = int(attrs.get("BANDWIDTH", 0))
+        for uri in lines[i+1:]:
+            uri = uri.strip()
+            if uri and not uri.startswith("#"):
+                if best is None or bandwidth > best[0]:
+                    best = (bandwidth, urljoin(url, uri), int(attrs.get("AVERAGE-BANDWIDTH", bandwidth)))
+                break
+    return (best[1], best[2]) if best else None
+
+def parsePlaylist(text: str, url: str) -> MediaPlaylist:
+    """解析media playlist：分片、时长、AES-128密钥、字节范围、EXT-X-MAP"""
+    playlist = MediaPlaylist(url=url)
+    sequence = 0
+    duration = 0.0
+    key = None
+    byterange = None
+    last_end = {} # 每个uri上一个字节范围的结尾，BYTERANGE省略offset时接着它
+    for raw in text.splitlines():
+        line = raw.strip()
+        if not line:
+            continue
+        if line.startswith("#EXT-X-MEDIA-SEQUENCE:"):
+            sequence = int(line.split(":", 1)[1])
+        elif line.startswith("#EXT-X-TARGETDURATION:"):
+            playlist.target_duration = float(line.split(":", 1)[1])
+        elif line.startswith("#EXTINF:"):
+            duration = float(line.split(":", 1)[1].split(",", 1)[0])
+        elif line.startswith("#EXT-X-BYTERANGE:"):
+            byterange = line.split(":", 1)[1]
+        elif line.startswith("#EXT-X-KEY:"):
+            attrs = _parse_attributes(line.split(":", 1)[1])
+            method = attrs.get("METHOD", "NONE")
+            if method == "NONE":
+                key = None
+            elif method == "AES-128":
+                iv = attrs.get("IV")
+                key = SegmentKey(method, urljoin(url, attrs.get("URI", "")), bytes.fromhex(iv[2:]) if iv else None)
+            else:
+                raise ValueError(f"不支持的加密方式: {method}")
+        elif line.startswith("#EXT-X-MAP:"):
+            attrs = _parse_attributes(line.split(":", 1)[1])
+            init = Segment(index=-1, url=urljoin(url, attrs["URI"]), key=key)
+            if "BYTERANGE" in attrs:
+                init.byterange = _parse_byterange(attrs["BYTERANGE"], 0)
+            playlist.init = init
+        elif not line.startswith("#"):
+            seg = Segment(index=len(playlist.segments), url=urljoin(url, line),
+                          duration=duration, sequence=sequence, key=key)
+            if byterange is not None:
+                seg.byterange = _parse_byterange(byterange, last_end.get(seg.url, 0))
+                last_end[seg.url] = seg.byterange[1] + seg.byterange[0]
+            playlist.segments.append(seg)
+            sequence += 1
+            duration = 0.0
+            byterange = None
+    return playlist
+
+def _decrypt(data: bytes, key: bytes, iv: bytes) -> bytes:
+    # 只有加密的流才需要cryptography
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+    from cryptography.hazmat.primitives import padding
+    decryptor = Cipher(algorithms.AES(key), modes.CBC(iv)).decryptor()
+    data = decryptor.update(data) + decryptor.finalize()
+    unpadder = padding.PKCS7(128).unpadder()
+    try:
+        return unpadder.update(data) + unpadder.finalize()
+    except ValueError:
+        return data # 部分站点不做PKCS7填充
+
+class HLSDownloader:
+    """
+    使用方式：
+    1. fetchPlaylist获取并解析media playlist（master playlist会自动选最高带宽）
+    2. download用线程池并发拉取分片，按顺序写入out
+    分片请求走共享的SessionPool，复用到CDN的连接，并与网页请求使用相同的浏览器指纹和代理
+    传入routes时不使用固定的proxy：每个请求按线路排序依次尝试，一条线路失败只重试这个请求，不用从头下载整部视频
+    """
+    def __init__(self, proxy = None, concurrency: int = 8, timeout = 30, retries: int = 3,
+                 routes: Optional[RouteManager] = None, preferred: str = DIRECT):
+        self.proxies = {
+            'http': proxy,
+            'https': proxy
+        } if proxy else None
+        self.routes = routes
+        self.preferred = preferred
+        self.concurrency = max(1, concurrency)
+        self.timeout = timeout
+        self.retries = retries
+        self._keys: Dict[str, bytes] = {}
+        self._keys_lock = threading.Lock()
+        self.lastError: Optional[str] = None # 最近一次失败的错误类型，见breaker.py
+
+    def _get(self, url: str, byterange: Optional[Tuple[int, int]] = None) -> bytes:
+        if self.routes is None:
+            return self._getVia(url, byterange, self.proxies)
+        candidates = self.routes.order(url, self.preferred)
+        for i, route in enumerate(candidates):
+            begin = time.monotonic()
+            try:
+                data = self._getVia(url, byterange, self.routes.proxies(route))
+            except Exception as e:
+                kind = classifyError(e)
+                self.routes.record(url, route, False, kind=kind)
+                # 404等换线路也一样的错误直接抛出
+                if kind not in TRIPPING_ERRORS or i + 1 >= len(candidates):
+                    raise
+                self.routes.failover(url, route, kind, candidates[i+1])
+                continue
+            self.routes.record(url, route, True, time.monotonic() - begin, len(data))
+            return data
+
+    def _getVia(self, url: str, byterange: Optional[Tuple[int, int]], proxies: Optional[dict]) -> bytes:
+        reqHeaders = {}
+        if byterange:
+            length, offset = byterange
+            reqHeaders["Range"] = f"bytes={offset}-{offset+length-1}"
+        response = fetch(url, proxies=proxies, headers=reqHeaders, timeout=self.timeout)
+        response.raise_for_status()
+        if byterange and response.status_code == 200:
+            # 服务器忽略了Range，自己截取
+            length, offset = byterange
+            return response.content[offset:offset+length]
+        return response.content
+
+    def fetchPlaylist(self, url: str) -> Optional[MediaPlaylist]:
+        try:
+            text = self._get(url).decode("utf-8", errors="ignore")
+            bandwidth = 0
+            if isMasterPlaylist(text):
+                variant = selectVariant(text, url)
+                if variant is None:
+                    logger.error("master playlist中没有可用子流")
+                    self.lastError = EMPTY_PLAYLIST
+                    return None
+                url, bandwidth = variant
+                logger.debug(f"选择子流: {url}")
+                text = self._get(url).decode("utf-8", errors="ignore")
+            playlist = parsePlaylist(text, url)
+            playlist.bandwidth = bandwidth
+            if not playlist.segments:
+                logger.error(f"playlist没有分片: {url}")
+                self.lastError = EMPTY_PLAYLIST
+                return None
+            return playlist
+        except Exception as e:
+            self.lastError = classifyError(e)
+            logger.error(f"获取playlist失败({self.lastError}): {e}")
+            return None
+
+    def _key(self, uri: str) -> bytes:
+        with self._keys_lock:
+            if uri in self._keys:
+                return self._keys[uri]
+        key = self._get(uri)
+        with self._keys_lock:
+            self._keys[uri] = key
+        return key
+
+    def fetchSegment(self, seg: Segment, fmp4: bool = False) -> bytes:
+        """下载单个分片并解密，失败按指数退避重试；内容不完整（截断、错误页面）时只重新下载这个分片"""
+        for attempt in range(self.retries + 1):
+            try:
+                data = self._get(seg.url, seg.byterange)
+                if seg.key and seg.key.method == "AES-128":
+                    iv = seg.key.iv or seg.sequence.to_bytes(16, "big")
+                    data = _decrypt(data, self._key(seg.key.uri), iv)
+                if verify_download:
+                    checkSegment(data, fmp4, init=seg.index < 0)
+                return data
+            except Exception as e:
+                if attempt >= self.retries:
+                    raise
+                logger.warning(f"分片 {seg.index} 下载失败，重试 {attempt+1}/{self.retries}: {e}")
+                time.sleep(min(2 ** attempt, 10))
+
+    def download(self, playlist: MediaPlaylist, out: BinaryIO,
+                 onProgress: Optional[Callable[[int, int, int], None]] = None,
+                 start: int = 0, writeInit: bool = True) -> bool:
+        """
+        并发下载分片并按顺序写入out
+        同时在途的分片数限制在concurrency的2倍以内，乱序完成的分片只在内存中等待很短时间
+        :onProgress: 回调(已完成分片数, 分片总数, 本次写入字节数)，每写完一个分片调用一次
+        :start: 断点续传，从第start个分片开始
+        :writeInit: 是否写入EXT-X-MAP初始化段，往已有文件追加时不需要
+        """
+        total = len(playlist.segments)
+        written = 0
+        begin = time.time()
+        last_log = begin
+        pending = deque()
+        fmp4 = playlist.init is not None
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            try:
+                if playlist.init and writeInit:
+                    written += out.write(self.fetchSegment(playlist.init, fmp4))
+
+                it = iter(playlist.segments[start:])
+                for seg in it:
+                    pending.append(pool.submit(self.fetchSegment, seg, fmp4))
+                    if len(pending) >= self.concurrency * 2:
+                        break
+                done = start
+                while pending:
+                    data = pending.popleft().result()
+                    written += out.write(data)
+                    done += 1
+                    seg = next(it, None)
+                    if seg is not None:
+                        pending.append(pool.submit(self.fetchSegment, seg, fmp4))
+                    if onProgress:
+                        onProgress(done, total, written)
+                    now = time.time()
+                    if now - last_log >= 10 or done == total:
+                        last_log = now
+                        speed = written / max(now - begin, 1e-6) / 1024 / 1024
+                        logger.info(f"分片进度: {done}/{total}, {written/1024/1024:.1f}MB, {speed:.2f}MB/s")
+                return True
+            except Exception as e:
+                self.lastError = classifyError(e)
+                logger.error(f"分片下载失败({self.lastError}): {e}")
+                for future in pending:
+                    future.cancel()
+                return False
@@ -0,0 +1,221 @@
+# doc: 基于sqlite的下载队列/任务表，替代download_queue.txt，供常驻下载服务(worker.py)使用
+import sqlite3
+import time
+from typing import Dict, List, Optional
+from .comm import *
+from .data import _shared_connection
+
+# 任务状态
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+class JobQueue:
+    """
+    任务表：每个车牌号一行，记录状态、优先级、尝试次数、重试时间和租约
+    - 车牌号是主键，入队去重和出队都走索引，耗时与积压的任务数无关
+    - 优先级高的先下载，同优先级先进先出
+    - force: 用 -f 提交的任务，worker不检查是否已下载，直接重新下载
+    - 失败后按指数退避，等待一段时间才会被再次领取；尝试次数用完后标记为failed
+    - worker领取任务时写入租约(lease_owner/lease_until)，下载期间定期续约；
+      进程崩溃后租约过期，任务会被其他worker重新领取，不会像work文件那样卡死
+    """
+    def __init__(self, db_path: str, table_name: str = "Jobs", lease: int = 600, max_attempts: int = 3,
+                 backoff: float = 300, max_backoff: float = 6 * 3600):
+        self.db_path = db_path
+        self.table_name = table_name
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        # 和已下载记录共用进程内的长连接，线程之间用锁串行；多个进程同时写时由sqlite的timeout等锁
+        self.conn, self.lock = _shared_connection(db_path)
+        self.initialize()
+
+    def _write(self, sql: str, params: tuple = ()) -> int:
+        """单条写语句，返回影响的行数"""
+        with self.lock:
+            try:
+                rowcount = self.conn.execute(sql, params).rowcount
+                self.conn.commit()
+                return rowcount
+            except sqlite3.Error:
+                self.conn.rollback()
+                raise
+
+    def _read(self, sql: str, params: tuple = ()) -> list:
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def initialize(self):
+        with self.lock:
+            self.conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {self.table_name} (
+                avid TEXT PRIMARY KEY,
+                state TEXT NOT NULL DEFAULT '{PENDING}',
+                priority INTEGER NOT NULL DEFAULT 0,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_run_at REAL NOT NULL DEFAULT 0,
+                force INTEGER NOT NULL DEFAULT 0,
+                lease_owner TEXT,
+                lease_until REAL,
+                last_error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            ''')
+            # 旧的任务表没有优先级、重试时间和force
+            columns = {row[1] for row in self.conn.execute(f"PRAGMA table_info({self.table_name})")}
+            if "priority" not in columns:
+                self.conn.execute(f"ALTER TABLE {self.table_name} ADD COLUMN priority INTEGER NOT NULL DEFAULT 0")
+            if "next_run_at" not in columns:
+                self.conn.execute(f"ALTER TABLE {self.table_name} ADD COLUMN next_run_at REAL NOT NULL DEFAULT 0")
+            if "force" not in columns:
+                self.conn.execute(f"ALTER TABLE {self.table_name} ADD COLUMN force INTEGER NOT NULL DEFAULT 0")
+            self.conn.execute(f'DROP INDEX IF EXISTS idx_{self.table_name}_state')
+            # 出队: 按优先级取第一个可执行的pending任务；回收: 找租约过期的running任务
+            self.conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{self.table_name}_ready ON {self.table_name} (state, priority DESC, created_at)')
+            self.conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{self.table_name}_lease ON {self.table_name} (state, lease_until)')
+            self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS Workers (
+                worker_id TEXT PRIMARY KEY,
+                heartbeat REAL NOT NULL
+            )
+            ''')
+            self.conn.commit()
+
+    def enqueue(self, avid: str, priority: int = 0, force: bool = False) -> bool:
+        """加入任务表，已存在且未完成的任务不会重复加入；已结束的任务重新置为pending"""
+        return self.enqueueMany([avid], priority, force)[avid]
+
+    def enqueueMany(self, avids: List[str], priority: int = 0, force: bool = False) -> Dict[str, bool]:
+        """在一个事务里批量加入，返回每个车牌号是否新加入；已在排队的任务只会提高优先级、加上force"""
+        now = time.time()
+        result = {}
+        with self.lock:
+            conn = self.conn
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                for avid in avids:
+                    cursor = conn.execute(
+                        f'''INSERT INTO {self.table_name} (avid, state, priority, attempts, next_run_at, force, created_at, updated_at)
+                        VALUES (?, '{PENDING}', ?, 0, 0, ?, ?, ?)
+                        ON CONFLICT(avid) DO UPDATE SET state='{PENDING}', priority=excluded.priority, attempts=0,
+                        next_run_at=0, force=excluded.force, last_error=NULL, updated_at=excluded.updated_at
+                        WHERE state IN ('{DONE}', '{FAILED}')''',
+                        (avid, priority, int(force), now, now)
+                    )
+                    result[avid] = cursor.rowcount > 0
+                    if not result[avid]:
+                        conn.execute(
+                            f"UPDATE {self.table_name} SET priority=MAX(priority, ?), force=MAX(force, ?) WHERE avid=? AND state='{PENDING}'",
+                            (priority, int(force), avid)
+                        )
+                conn.commit()
+                return result
+            except sqlite3.Error:
+                conn.rollback()
+                raise
+
+    def claim(self, worker_id: str) -> Optional[str]:
+        """
+        原子地领取一个任务：先回收租约已过期的running任务，再按优先级取已到重试时间的pending任务
+        租约过期时尝试次数已用完的任务（每次都让worker崩溃或卡住）标记为failed，不再回收
+        """
+        now = time.time()
+        with self.lock:
+            conn = self.conn
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                expired = conn.execute(
+                    f'''UPDATE {self.table_name} SET state='{FAILED}', lease_owner=NULL, lease_until=NULL,
+                    last_error='租约过期，尝试次数已用完', updated_at=?
+                    WHERE state='{RUNNING}' AND lease_until < ? AND attempts >= ?''',
+                    (now, now, self.max_attempts)
+                ).rowcount
+                if expired:
+                    logger.warning(f"{expired} 个任务租约过期且尝试次数已用完，标记为failed")
+                row = conn.execute(
+                    f"SELECT avid FROM {self.table_name} WHERE state='{RUNNING}' AND lease_until < ? LIMIT 1",
+                    (now,)
+                ).fetchone()
+                if row is None:
+                    # 沿索引按优先级顺序扫描，跳过还在退避中的任务
+                    row = conn.execute(
+                        f'''SELECT avid FROM {self.table_name}
+                        WHERE state='{PENDING}' AND next_run_at <= ?
+                        ORDER BY priority DESC, created_at LIMIT 1''',
+                        (now,)
+                    ).fetchone()
+                if row is None:
+                    conn.commit()
+                    return None
+                conn.execute(
+                    f'''UPDATE {self.table_name} SET state='{RUNNING}', attempts=attempts+1,
+                    lease_owner=?, lease_until=?, updated_at=? WHERE avid=?''',
+                    (worker_id, now + self.lease, now, row[0])
+                )
+                conn.commit()
+                return row[0]
+            except sqlite3.Error as e:
+                logger.error(f"领取任务失败: {e}")
+                conn.rollback()
+                return None
+
+    def isForced(self, avid: str) -> bool:
+        """是否是用 -f 提交的任务"""
+        rows = self._read(f"SELECT force FROM {self.table_name} WHERE avid=?", (avid,))
+        return bool(rows and rows[0][0])
+
+    def renew(self, worker_id: str):
+        """为该worker持有的所有任务续约"""
+        self._write(
+            f"UPDATE {self.table_name} SET lease_until=? WHERE state='{RUNNING}' AND lease_owner=?",
+            (time.time() + self.lease, worker_id)
+        )
+
+    def complete(self, avid: str):
+        self._write(
+            f"UPDATE {self.table_name} SET state='{DONE}', lease_owner=NULL, lease_until=NULL, updated_at=? WHERE avid=?",
+            (time.time(), avid)
+        )
+
+    def fail(self, avid: str, error: str = ""):
+        """失败的任务在尝试次数用完前重新排队，第n次失败后等待 backoff * 2^(n-1) 秒（不超过max_backoff）"""
+        now = time.time()
+        self._write(
+            f'''UPDATE {self.table_name} SET
+            state=CASE WHEN attempts >= ? THEN '{FAILED}' ELSE '{PENDING}' END,
+            next_run_at=? + MIN(?, ? * (1 << MAX(attempts - 1, 0))),
+            lease_owner=NULL, lease_until=NULL, last_error=?, updated_at=? WHERE avid=?''',
+            (self.max_attempts, now, self.max_backoff, self.backoff, error, now, avid)
+        )
+
+    def pending(self) -> int:
+        """还会被执行的任务数（包括退避中和执行中的）"""
+        return self._read(
+            f"SELECT COUNT(*) FROM {self.table_name} WHERE state IN ('{PENDING}', '{RUNNING}')"
+        )[0][0]
+
+    def counts(self) -> Dict[str, int]:
+        """各状态的任务数"""
+        return dict(self._read(f"SELECT state, COUNT(*) FROM {self.table_name} GROUP BY state"))
+
+    def heartbeat(self, worker_id: str):
+        self._write("INSERT OR REPLACE INTO Workers (worker_id, heartbeat) VALUES (?, ?)", (worker_id, time.time()))
+
+    def unregister(self, worker_id: str):
+        self._write("DELETE FROM Workers WHERE worker_id=?", (worker_id,))
+
+    def serviceAlive(self, within: float = 60) -> bool:
+        """是否有常驻下载服务在运行（最近有心跳）"""
+        try:
+            return bool(self._read("SELECT 1 FROM Workers WHERE heartbeat > ? LIMIT 1", (time.time() - within,)))
+        except sqlite3.Error as e:
+            logger.error(f"数据库错误: {e}")
+            return False
+
+def open_queue() -> JobQueue:
+    """按配置打开DBPath中的任务表"""
+    return JobQueue(downloaded_path, lease=job_lease, max_attempts=job_max_attempts, backoff=job_retry_backoff)
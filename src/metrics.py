@@ -0,0 +1,181 @@
+# doc: 下载流程各阶段的耗时、字节数和结果统计，导出为Prometheus文本格式（textfile或HTTP端点）
+import atexit
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Optional, Tuple
+from .comm import *
+
+# 阶段耗时的分桶(秒)，从解析html到整部视频下载
+BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+class Stage:
+    """阶段内由调用方填写结果：ok=False表示失败，bytes为传输的字节数；阶段结束后elapsed为耗时"""
+    def __init__(self):
+        self.ok = True
+        self.bytes = 0
+        self.elapsed = 0.0
+
+class Metrics:
+    """
+    进程内的指标表，所有线程共用
+    - nassav_stage_duration_seconds: 阶段耗时直方图，标签 stage/downloader/domain/outcome
+    - nassav_stage_bytes_total: 阶段传输的字节数，和耗时一起可以算出吞吐
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters: Dict[Tuple[str, Labels], float] = {}
+        self.histograms: Dict[Tuple[str, Labels], List[float]] = {} # 各桶计数 + [sum, count]
+        self.samples: Optional[Dict[str, List[float]]] = None # 置为{}时按阶段保留每次的耗时（性能测试计算分位数）
+        self.process = "" # 导出时给所有指标加上process标签，区分main/worker/metadata
+        self.help: Dict[str, Tuple[str, str]] = {
+            "nassav_stage_duration_seconds": ("histogram", "各阶段耗时"),
+            "nassav_stage_bytes_total": ("counter", "各阶段传输的字节数"),
+            "nassav_errors_total": ("counter", "按类型统计的请求错误"),
+            "nassav_route_failover_total": ("counter", "单个请求失败后换线路的次数"),
+            "nassav_governor_wait_seconds_total": ("counter", "请求因总带宽或host连接数上限等待的时间"),
+        }
+
+    @staticmethod
+    def _labels(labels: dict) -> Labels:
+        return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, self._labels(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, self._labels(labels))
+        with self.lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = [0.0] * (len(BUCKETS) + 2)
+            for i, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    hist[i] += 1
+            hist[-2] += value
+            hist[-1] += 1
+
+    @contextmanager
+    def stage(self, stage: str, downloader: str = "", domain: str = "") -> Iterator[Stage]:
+        """
+        记录一个阶段的耗时和结果，抛出异常时outcome为error
+        with metrics.stage("fetch_html", name, domain) as s:
+            s.bytes = len(html); s.ok = bool(html)
+        """
+        s = Stage()
+        outcome = "error"
+        start = time.monotonic()
+        try:
+            yield s
+            outcome = "ok" if s.ok else "fail"
+        finally:
+            elapsed = s.elapsed = time.monotonic() - start
+            self.observe("nassav_stage_duration_seconds", elapsed,
+                         stage=stage, downloader=downloader, domain=domain, outcome=outcome)
+            if self.samples is not None:
+                with self.lock:
+                    self.samples.setdefault(stage, []).append(elapsed)
+            if s.bytes:
+                self.inc("nassav_stage_bytes_total", s.bytes, stage=stage, downloader=downloader, domain=domain)
+            logger.debug(f"[{stage}] {downloader or '-'} {domain or '-'} {outcome} 耗时 {elapsed:.2f}s {s.bytes}B")
+
+    def _format(self, labels: Labels, extra: str = "") -> str:
+        items = [f'{k}="{v}"' for k, v in (("process", self.process),) + labels if v != ""]
+        if extra:
+            items.append(extra)
+        return "{" + ",".join(items) + "}" if items else ""
+
+    def render(self) -> str:
+        """Prometheus文本格式"""
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {key: list(hist) for key, hist in self.histograms.items()}
+        lines = []
+        for name, (kind, text) in self.help.items():
+            lines.append(f"# HELP {name} {text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f"{name}{self._format(labels)} {value:g}")
+            for (metric, labels), hist in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                for bound, count in zip(BUCKETS, hist):
+                    le = 'le="%g"' % bound
+                    lines.append(f"{name}_bucket{self._format(labels, le)} {count:g}")
+                le = 'le="+Inf"'
+                lines.append(f"{name}_bucket{self._format(labels, le)} {hist[-1]:g}")
+                lines.append(f"{name}_sum{self._format(labels)} {hist[-2]:.3f}")
+                lines.append(f"{name}_count{self._format(labels)} {hist[-1]:g}")
+        return "\n".join(lines) + "\n"
+
+    def writeTextfile(self, path: str):
+        """原子写入，供node_exporter的textfile collector读取"""
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            tmp = path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(self.render())
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.error(f"写入指标文件失败: {e}")
+
+    def serve(self, port: int) -> ThreadingHTTPServer:
+        """在后台线程提供 http://127.0.0.1:<port>/metrics"""
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        logger.info(f"指标端点: http://127.0.0.1:{port}/metrics")
+        return server
+
+# 进程内共享
+metrics = Metrics()
+
+def exportPath(process: str) -> str:
+    """每种进程写各自的textfile（MetricsPath为./db/metrics.prom时worker写./db/metrics.worker.prom），互不覆盖"""
+    root, ext = os.path.splitext(metrics_path)
+    return f"{root}.{process}{ext or '.prom'}"
+
+def startExport(process: str, interval: float = 0):
+    """
+    按配置导出：MetricsPort非0时开启HTTP端点；MetricsPath非空时退出前写入textfile，
+    interval>0时（常驻服务）还会定期写入。process为main/worker/metadata，决定文件名和process标签
+    """
+    metrics.process = process
+    if metrics_port:
+        try:
+            metrics.serve(metrics_port)
+        except OSError as e:
+            logger.error(f"指标端点启动失败: {e}")
+    if not metrics_path:
+        return
+    path = exportPath(process)
+    atexit.register(metrics.writeTextfile, path)
+    if interval > 0:
+        def flush():
+            while True:
+                time.sleep(interval)
+                metrics.writeTextfile(path)
+        threading.Thread(target=flush, daemon=True).start()
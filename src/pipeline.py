@@ -0,0 +1,30 @@
+# doc: 单个车牌号的下载流程，main.py和常驻下载服务共用
+from .downloaderMgr import DownloaderMgr
+from .resolver import Resolver
+from .scoring import getScores
+from .breaker import LOCAL_ERRORS
+from .comm import *
+from .staging import staged
+
+def downloadAV(mgr: DownloaderMgr, avid: str) -> bool:
+    """并发解析所有下载器，按得分（或权重）依次尝试下载，任一下载器成功即返回True"""
+    if staged(avid):
+        logger.info(f"{avid} 已在ScratchPath中下载完成，等待移到SavePath")
+        return True
+    resolver = Resolver(mgr, resolve_deadline)
+    for candidate in resolver.candidates(avid):
+        downloader = candidate.downloader
+        logger.info(f"尝试使用Downloader: {downloader.getDownloaderName()} 下载")
+        downloader.saveInfo(avid, candidate.info, candidate.html)
+        logger.info(candidate.info)
+
+        # 下载失败使用下一个downloader
+        if not downloader.downloadM3u8(candidate.info.m3u8, avid):
+            logger.error(f"{candidate.info.m3u8} 下载视频失败")
+            # 解析成功但视频流不可用，同样计入失败；空间不足、转封装失败等本机的问题不计入
+            if downloader.lastError not in LOCAL_ERRORS:
+                getScores().recordResolve(downloader.getDownloaderName(), downloader.domain, False)
+            continue
+        return True
+    logger.error(f"{avid} 没有可用的视频流")
+    return False
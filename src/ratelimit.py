@@ -0,0 +1,90 @@
+# doc: 按host限速的令牌桶，遇到403/429时自适应降速
+import threading
+import time
+from typing import Dict, Optional
+from urllib.parse import urlparse
+from .comm import *
+
+class TokenBucket:
+    """rate: 每秒补充的令牌数，burst: 桶容量（允许的突发请求数）"""
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float):
+        if now < self.updated: # 暂停中
+            return
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self, tokens: float = 1.0):
+        """阻塞直到取得令牌"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate if self.rate > 0 else 1.0
+            time.sleep(min(wait, 1.0))
+
+    def consume(self, tokens: float):
+        """先用后扣：直接扣除，令牌可以变成负数，之后的acquire等到补回来为止"""
+        with self.lock:
+            self._refill(time.monotonic())
+            self.tokens -= tokens
+
+    def drain(self, seconds: float = 0.0):
+        """清空令牌，并在seconds秒内不再补充"""
+        with self.lock:
+            self.tokens = 0.0
+            self.updated = time.monotonic() + seconds
+
+class HostRateLimiter:
+    """
+    每个host一个令牌桶
+    - 403/429: 速率减半（不低于min_rate），清空令牌并暂停一段时间（优先使用Retry-After）
+    - 请求成功: 速率缓慢回升到配置值
+    """
+    def __init__(self, rate: float = 1.0, burst: float = 5, min_rate: float = 0.05):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.lock = threading.Lock()
+
+    def _bucket(self, url: str) -> TokenBucket:
+        host = urlparse(url).netloc
+        with self.lock:
+            bucket = self.buckets.get(host)
+            if bucket is None:
+                bucket = TokenBucket(self.rate, self.burst)
+                self.buckets[host] = bucket
+            return bucket
+
+    def acquire(self, url: str):
+        self._bucket(url).acquire()
+
+    def penalize(self, url: str, retry_after: Optional[float] = None) -> float:
+        """被限流，返回需要暂停的秒数"""
+        bucket = self._bucket(url)
+        with bucket.lock:
+            bucket.rate = max(self.min_rate, bucket.rate / 2)
+            rate = bucket.rate
+        pause = retry_after if retry_after is not None else 1.0 / rate
+        bucket.drain(pause)
+        logger.warning(f"{urlparse(url).netloc} 被限流，降速到 {rate:.2f} req/s，暂停 {pause:.0f}s")
+        return pause
+
+    def reward(self, url: str):
+        bucket = self._bucket(url)
+        with bucket.lock:
+            if bucket.rate < self.rate:
+                bucket.rate = min(self.rate, bucket.rate + self.rate * 0.1)
+
+# 进程内共享：常驻服务的多个worker下载完各自刮削时共用同一组令牌桶，对JavBus的总请求速率不随worker数增加
+scrape_limiter = HostRateLimiter(scrape_rate, scrape_burst)
@@ -0,0 +1,74 @@
+# doc: ffmpeg转封装，ts -> mp4；FragmentedMP4开启时输出fMP4，moov在开头，写入中的文件也能播放
+import os
+import subprocess
+from typing import List
+from .comm import *
+
+# 开头写不含样本表的moov，之后每个关键帧一个moof+mdat：播放器不用先读到文件末尾，也不需要faststart那样再重写一遍整个文件
+FRAGMENT_FLAGS = "frag_keyframe+empty_moov+default_base_moof"
+
+def _outputArgs(dst: str) -> List[str]:
+    flags = ["-movflags", FRAGMENT_FLAGS] if fragmented_mp4 else []
+    return ["-c", "copy"] + flags + ["-f", "mp4", dst]
+
+def _ffmpegCommand(src: str, dst: str) -> List[str]:
+    return ["ffmpeg", "-y", "-loglevel", "error", "-i", src] + _outputArgs(dst)
+
+def remuxFile(ts_path: str, mp4_path: str) -> bool:
+    """把完整的ts文件转封装成mp4"""
+    command = _ffmpegCommand(ts_path, mp4_path)
+    logger.debug(" ".join(command))
+    return subprocess.run(command).returncode == 0
+
+def concatParts(part_paths: List[str], mp4_path: str) -> bool:
+    """断点续传产生的多个part按顺序无损拼接成一个mp4"""
+    list_path = mp4_path + ".parts.txt"
+    with open(list_path, 'w', encoding='utf-8') as f:
+        for part in part_paths:
+            f.write(f"file '{os.path.abspath(part)}'\n")
+    command = ["ffmpeg", "-y", "-loglevel", "error", "-f", "concat", "-safe", "0", "-i", list_path] + _outputArgs(mp4_path)
+    logger.debug(" ".join(command))
+    ok = subprocess.run(command).returncode == 0
+    os.remove(list_path)
+    return ok
+
+class StreamRemuxer:
+    """
+    流式转封装：分片按顺序写入ffmpeg的stdin，边下载边生成mp4，不落地中间的ts文件
+    用法和文件对象一样，下载成功后调用close，失败调用abort
+    """
+    def __init__(self, mp4_path: str):
+        self.mp4_path = mp4_path
+        command = _ffmpegCommand("pipe:0", mp4_path)
+        logger.debug(" ".join(command))
+        self.proc = subprocess.Popen(command, stdin=subprocess.PIPE)
+
+    def write(self, data: bytes) -> int:
+        self.proc.stdin.write(data)
+        return len(data)
+
+    def close(self) -> bool:
+        """写完所有分片，等待ffmpeg写出moov并退出"""
+        try:
+            self.proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        if self.proc.wait() != 0:
+            logger.error(f"ffmpeg转封装失败: {self.proc.returncode}")
+            self._removeOutput()
+            return False
+        return True
+
+    def abort(self):
+        """下载失败，结束ffmpeg并删除不完整的mp4"""
+        self.proc.kill()
+        try:
+            self.proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        self.proc.wait()
+        self._removeOutput()
+
+    def _removeOutput(self):
+        if os.path.exists(self.mp4_path):
+            os.remove(self.mp4_path)
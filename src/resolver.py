@@ -0,0 +1,85 @@
+# doc: 并发解析所有启用的下载器，按权重挑选在截止时间内返回的视频流
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from dataclasses import dataclass
+from typing import Iterator, List, Optional
+from .downloaderMgr import DownloaderMgr
+from .downloader.downloaderBase import Downloader, AVDownloadInfo
+from .scoring import getScores
+from .comm import *
+
+@dataclass
+class Candidate:
+    downloader: Downloader
+    weight: int
+    info: AVDownloadInfo
+    html: str
+    elapsed: float
+
+class Resolver:
+    """
+    所有下载器同时请求和解析，按权重从高到低依次产出候选：
+    - 高权重的下载器还没返回时，最多等到截止时间，之后它的结果不再等待
+    - 低权重的下载器早已返回的结果直接可用，不需要再排队请求
+    这样一个挂掉的域名最多让整体等待deadline，而不是每个下载器的超时时间累加
+    AdaptiveOrder为true时，顺序按实测的成功率、解析耗时和吞吐动态调整，weight只作为先验
+    """
+    def __init__(self, mgr: DownloaderMgr, deadline: float = 20):
+        self.mgr = mgr
+        self.deadline = deadline
+
+    def _enabledDownloaders(self) -> List[tuple]:
+        downloaders = []
+        for it in sorted_downloaders:
+            downloader = self.mgr.GetDownloader(it["downloaderName"])
+            if downloader is None:
+                logger.error(f"下载器 {it['downloaderName']} 没有找到")
+                continue
+            if not downloader.setDomain(it["domain"]): # 设置成配置中的域名
+                logger.error(f"下载器 {downloader.getDownloaderName()} 的域名没有配置")
+                continue
+            downloaders.append((downloader, it["weight"]))
+        if adaptive_order:
+            downloaders = getScores().order(downloaders)
+        return downloaders
+
+    @staticmethod
+    def _probe(downloader: Downloader, weight: int, avid: str) -> Optional[Candidate]:
+        start = time.time()
+        try:
+            result = downloader.resolve(avid)
+        except Exception as e:
+            logger.error(f"{downloader.getDownloaderName()} 解析异常: {e}")
+            result = None
+        elapsed = time.time() - start
+        # 使用缓存时（html为空）没有请求站点，不计入得分，否则接近0的耗时会拉低解析耗时的平均值
+        if result is None or result[1]:
+            getScores().recordResolve(downloader.getDownloaderName(), downloader.domain, result is not None, elapsed)
+        if result is None:
+            return None
+        info, html = result
+        logger.info(f"{downloader.getDownloaderName()} 解析成功，耗时 {elapsed:.1f}s")
+        return Candidate(downloader, weight, info, html, elapsed)
+
+    def candidates(self, avid: str) -> Iterator[Candidate]:
+        """按权重从高到低产出在截止时间内解析成功的候选"""
+        downloaders = self._enabledDownloaders()
+        if not downloaders:
+            raise ValueError(f"cfg没有配置下载器：{sorted_downloaders}")
+
+        pool = ThreadPoolExecutor(max_workers=len(downloaders))
+        try:
+            futures = [(downloader, pool.submit(self._probe, downloader, weight, avid))
+                       for downloader, weight in downloaders]
+            deadline = time.time() + self.deadline
+            for downloader, future in futures:
+                try:
+                    candidate = future.result(timeout=max(0, deadline - time.time()))
+                except TimeoutError:
+                    logger.warning(f"{downloader.getDownloaderName()} 未在 {self.deadline}s 内完成解析，跳过")
+                    continue
+                if candidate is not None:
+                    yield candidate
+        finally:
+            # 超时的请求留在后台自然结束，不阻塞下载
+            pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,145 @@
+# doc: 多条线路（直连和多个代理）的选择：按host测量各线路的延迟和吞吐，选最快的，单个请求失败时换线路重试
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+from .comm import *
+from .session import fetch
+from .breaker import classifyError, TRIPPING_ERRORS
+from .metrics import metrics
+
+DIRECT = "" # 直连
+
+@dataclass
+class RouteStats:
+    latency: Optional[float] = None    # 小请求耗时的EWMA(秒)
+    throughput: Optional[float] = None # 大请求有效吞吐的EWMA(字节/秒)
+    failures: int = 0                  # 连续失败次数
+    down_until: float = 0.0
+
+class RouteManager:
+    """
+    - 线路: 直连 + 配置中的Proxy和Proxies，按(host, 线路)分别统计
+    - 测速: 第一次访问某个视频流host时（之后每probe_ttl秒）通过所有线路并发请求同一个url的前256KB，
+      得到延迟和吞吐；之后用实际请求的结果持续更新
+    - 排序: 有数据的线路按估算的下载1MB耗时排序，没有数据的排在后面，其中preferred优先；
+      连续失败的线路冷却一段时间，冷却中排在最后，仍可作为最后的选择
+    """
+    PROBE_BYTES = 256 * 1024
+    REFERENCE = 1024 * 1024
+
+    def __init__(self, routes: List[str], probe_ttl: float = 600, alpha: float = 0.3,
+                 cooldown: float = 30, max_cooldown: float = 600, probe_timeout: float = 8):
+        self.routes = list(dict.fromkeys(routes)) # 去重并保持顺序
+        self.probe_ttl = probe_ttl
+        self.alpha = alpha
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.probe_timeout = probe_timeout
+        self.stats: Dict[Tuple[str, str], RouteStats] = {}
+        self.probed: Dict[str, float] = {}
+        self.lock = threading.Lock()
+        self.probe_locks: Dict[str, threading.Lock] = {}
+
+    @staticmethod
+    def proxies(route: str) -> Optional[dict]:
+        return {'http': route, 'https': route} if route else None
+
+    @staticmethod
+    def label(route: str) -> str:
+        return urlparse(route).netloc or route if route else "direct"
+
+    def _stats(self, host: str, route: str) -> RouteStats:
+        return self.stats.setdefault((host, route), RouteStats())
+
+    def _cost(self, stats: RouteStats) -> float:
+        """估算的下载1MB耗时，没有吞吐数据时按1MB/s估算"""
+        return (stats.latency or 0.0) + self.REFERENCE / (stats.throughput or self.REFERENCE)
+
+    def order(self, url: str, preferred: str = DIRECT, probe: bool = True) -> List[str]:
+        """按优先级排好的线路，probe为True时需要的话先测速（网页请求不测速，只用实际请求的结果）"""
+        host = urlparse(url).netloc
+        if probe and len(self.routes) > 1:
+            self._probe(url, host)
+        now = time.time()
+        with self.lock:
+            def key(route: str):
+                stats = self._stats(host, route)
+                measured = stats.latency is not None or stats.throughput is not None
+                # 冷却中的排最后；有数据的按耗时排在没有数据的前面；其余preferred优先
+                return (stats.down_until > now, not measured, self._cost(stats) if measured else 0.0, route != preferred)
+            return sorted(self.routes, key=key)
+
+    def _probe(self, url: str, host: str):
+        with self.lock:
+            if time.time() - self.probed.get(host, 0) < self.probe_ttl:
+                return
+            lock = self.probe_locks.setdefault(host, threading.Lock())
+        # 同一个host只有一个线程测速，其他线程等测速结束后直接使用结果
+        with lock:
+            with self.lock:
+                if time.time() - self.probed.get(host, 0) < self.probe_ttl:
+                    return
+            with ThreadPoolExecutor(max_workers=len(self.routes)) as pool:
+                results = list(pool.map(lambda route: self._probeRoute(url, route), self.routes))
+            with self.lock:
+                self.probed[host] = time.time()
+            summary = ", ".join(f"{self.label(route)}: {'失败' if elapsed is None else f'{elapsed*1000:.0f}ms'}"
+                                for route, elapsed in zip(self.routes, results))
+            logger.info(f"{host} 线路测速: {summary}")
+
+    def _probeRoute(self, url: str, route: str) -> Optional[float]:
+        begin = time.monotonic()
+        try:
+            response = fetch(url, proxies=self.proxies(route), headers={"Range": f"bytes=0-{self.PROBE_BYTES-1}"},
+                             timeout=self.probe_timeout)
+            response.raise_for_status()
+            size = len(response.content)
+        except Exception as e:
+            self.record(url, route, False, kind=classifyError(e))
+            return None
+        elapsed = time.monotonic() - begin
+        self.record(url, route, True, elapsed, size)
+        return elapsed
+
+    def record(self, url: str, route: str, ok: bool, elapsed: float = 0.0, size: int = 0, kind: str = ""):
+        """记录一次请求的结果；失败只统计换线路可能有用的错误（网络错误、403/429/5xx）"""
+        host = urlparse(url).netloc
+        with self.lock:
+            stats = self._stats(host, route)
+            if ok:
+                stats.failures = 0
+                stats.down_until = 0.0
+                if elapsed <= 0:
+                    return
+                # 大请求（分片、测速）计入有效吞吐（包含了延迟），小请求（网页、playlist）计入延迟
+                if size >= 64 * 1024:
+                    sample = size / elapsed
+                    stats.throughput = sample if stats.throughput is None else \
+                        self.alpha * sample + (1 - self.alpha) * stats.throughput
+                else:
+                    stats.latency = elapsed if stats.latency is None else \
+                        self.alpha * elapsed + (1 - self.alpha) * stats.latency
+                return
+            if kind and kind not in TRIPPING_ERRORS:
+                return
+            stats.failures += 1
+            if stats.failures >= 2:
+                stats.down_until = time.time() + min(self.max_cooldown, self.cooldown * 2 ** (stats.failures - 2))
+
+    def failover(self, url: str, route: str, kind: str, next_route: str):
+        metrics.inc("nassav_route_failover_total", domain=urlparse(url).netloc, route=self.label(route), kind=kind)
+        logger.warning(f"{urlparse(url).netloc} 经 {self.label(route)} 请求失败({kind})，换用 {self.label(next_route)}")
+
+def _routes() -> Optional[RouteManager]:
+    if not auto_route:
+        return None
+    candidates = [DIRECT] + ([myproxy] if myproxy else []) + [proxy for proxy in extra_proxies if proxy]
+    if len(candidates) < 2:
+        return None
+    return RouteManager(candidates, probe_ttl=route_probe_ttl)
+
+# 进程内共享，只有直连一条线路或关闭AutoRoute时为None
+routes = _routes()
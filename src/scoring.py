@@ -0,0 +1,97 @@
+# doc: 根据下载器的实际表现（解析成功率、解析耗时、分片吞吐）动态排序，配置的weight作为先验
+import math
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+from .comm import *
+from . import data
+
+@dataclass
+class DownloaderStats:
+    success: float = 1.0               # 成功率的指数滑动平均
+    latency: Optional[float] = None    # 解析耗时(秒)的指数滑动平均
+    throughput: Optional[float] = None # 分片吞吐(字节/秒)的指数滑动平均
+    samples: int = 0
+    updated_at: float = 0.0
+
+class DownloaderScores:
+    """
+    每个(下载器, 域名)一份滑动统计，保存在数据库的DownloaderStats表中，main.py和常驻服务共用
+    得分 = (1-c) * 先验 + c * 实测
+    - 先验: weight / 最大weight
+    - 实测: 成功率 * (解析耗时得分 + 吞吐得分) / 2，两项都映射到0~1
+    - c: 置信度，随样本数增加到1，长时间没有新样本时衰减回先验，让恢复的站点有机会重新排到前面
+    """
+    def __init__(self, db_path: str, alpha: float = 0.3, full_confidence: int = 10,
+                 ref_latency: float = 5.0, ref_throughput: float = 2 * 1024 * 1024, half_life: float = 86400):
+        self.db_path = db_path
+        self.alpha = alpha
+        self.full_confidence = full_confidence
+        self.ref_latency = ref_latency
+        self.ref_throughput = ref_throughput
+        self.half_life = half_life
+        self.lock = threading.Lock()
+        self.stats: Dict[Tuple[str, str], DownloaderStats] = {
+            key: DownloaderStats(*value) for key, value in data.load_downloader_stats(db_path).items()
+        }
+
+    def _ewma(self, old: Optional[float], value: float) -> float:
+        return value if old is None else old + self.alpha * (value - old)
+
+    def _update(self, downloader: str, domain: str, **values):
+        with self.lock:
+            stats = self.stats.setdefault((downloader, domain), DownloaderStats())
+            for name, value in values.items():
+                old = getattr(stats, name) if stats.samples or name != "success" else None
+                setattr(stats, name, self._ewma(old, value))
+            stats.samples += 1
+            stats.updated_at = time.time()
+            row = (stats.success, stats.latency, stats.throughput, stats.samples, stats.updated_at)
+        data.save_downloader_stats(downloader, domain, row, self.db_path)
+
+    def recordResolve(self, downloader: str, domain: str, ok: bool, elapsed: Optional[float] = None):
+        """解析结果；失败时不计耗时"""
+        values = {"success": 1.0 if ok else 0.0}
+        if ok and elapsed is not None:
+            values["latency"] = elapsed
+        self._update(downloader, domain, **values)
+
+    def recordThroughput(self, downloader: str, domain: str, nbytes: int, seconds: float):
+        if nbytes <= 0 or seconds <= 0:
+            return
+        self._update(downloader, domain, throughput=nbytes / seconds)
+
+    def score(self, downloader: str, domain: str, weight: float, max_weight: float) -> float:
+        prior = weight / max_weight if max_weight > 0 else 0.0
+        with self.lock:
+            stats = self.stats.get((downloader, domain))
+        if stats is None or stats.samples == 0:
+            return prior
+        age = max(0.0, time.time() - stats.updated_at)
+        confidence = min(stats.samples, self.full_confidence) / self.full_confidence * math.pow(0.5, age / self.half_life)
+        # 没有数据的一项取中间值
+        latency = 0.5 if stats.latency is None else self.ref_latency / (self.ref_latency + stats.latency)
+        throughput = 0.5 if stats.throughput is None else stats.throughput / (stats.throughput + self.ref_throughput)
+        measured = stats.success * (latency + throughput) / 2
+        return (1 - confidence) * prior + confidence * measured
+
+    def order(self, downloaders: List[tuple]) -> List[tuple]:
+        """downloaders: [(downloader, weight)]，按得分从高到低返回，同分时按weight"""
+        max_weight = max((weight for _, weight in downloaders), default=0)
+        scored = [(self.score(d.getDownloaderName(), getattr(d, "domain", ""), weight, max_weight), weight, d)
+                  for d, weight in downloaders]
+        scored.sort(key=lambda item: (item[0], item[1]), reverse=True)
+        logger.debug("下载器得分: " + ", ".join(f"{d.getDownloaderName()}={s:.2f}" for s, _, d in scored))
+        return [(d, weight) for _, weight, d in scored]
+
+_scores: Optional[DownloaderScores] = None
+_scores_lock = threading.Lock()
+
+def getScores() -> DownloaderScores:
+    """进程内共享，第一次使用时从数据库加载"""
+    global _scores
+    with _scores_lock:
+        if _scores is None:
+            _scores = DownloaderScores(downloaded_path)
+        return _scores
@@ -1,17 +1,22 @@
 # doc: 使用javbus刮削
 import json
-from loguru import logger
 import os
+import tempfile
 from dataclasses import dataclass, asdict, field
 from typing import Optional, List, Dict
 from pathlib import Path
 from .comm import *
 from curl_cffi import requests
+from .session import fetch
+from .governor import governor
+from .ratelimit import HostRateLimiter
+from .metrics import metrics
+from .extract import Extractor, Rule
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
 from datetime import datetime
 from urllib.parse import urljoin, urlparse
 import time
-import re
 from xml.etree import ElementTree as ET
 from xml.dom import minidom
 
@@ -73,6 +78,18 @@ class AVMetadata:
             logger.error(f"JSON序列化失败: {str(e)}")
             return False
 
+# JavBus详情页，只在<head>到相关推荐之前的部分提取
+JAVBUS = Extractor([
+    Rule("title", r'<title>(([\dA-Z]+-\d+)?.*?) - JavBus</title>'),
+    Rule("description", r'<meta name="description" content="([^"]+)">'),
+    Rule("keywords", r'<meta name="keywords" content="([^"]+)">'),
+    Rule("cover", r'<a class="bigImage" href="([^"]+)"><img src="[^"]+"'),
+    Rule("date", r'<span class="header">發行日期:</span> ([^<]+)'),
+    Rule("duration", r'<span class="header">長度:</span> ([^<]+)'),
+    Rule("actress", r'<a class="avatar-box" href="[^"]+">\s*<div class="photo-frame">\s*<img src="([^"]+)"[^>]+>\s*</div>\s*<span>([^<]+)</span>', many=True),
+    Rule("fanart", r'<a class="sample-box" href="(.*?\.jpg)">', many=True),
+], region=("<head", 'id="related-waterfall"'))
+
 headers = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
     "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8",
@@ -83,42 +100,66 @@ headers = {
 }
      
 class Sracper:
-    def __init__(self, path: str, proxy = None, timeout = 15):
+    def __init__(self, path: str, proxy = None, timeout = 15, limiter: Optional[HostRateLimiter] = None, max_retries: int = 3,
+                 work_path: Optional[str] = None):
         """
         :path: 配置的路径，如/vol2/user/missav
         :avid: 车牌号
+        :limiter: 按host限速，批量刮削时多个Sracper共用一个
+        :work_path: 车牌号文件夹所在的目录（ScratchPath），默认同path；演员头像始终放在path/thumb
         """
+        self.limiter = limiter
+        self.max_retries = max_retries
         self.path = path
+        self.work_path = work_path or path
         self.proxy = proxy
         self.proxies = {
             'http': proxy,
             'https': proxy
         } if proxy else None
         self.timeout = timeout
-        self.domain = "www.javbus.com"
+        self.baseUrl = scrape_base_url.rstrip("/")
+        self.domain = urlparse(self.baseUrl).netloc
+
+    def _stage(self, stage: str):
+        return metrics.stage(stage, "JavBus", self.domain)
 
     def scrape(self, avid: str) -> Optional[AVMetadata]:
+        with self._stage("scrape") as stage:
+            metadata = self._scrape(avid)
+            stage.ok = metadata is not None
+        return metadata
+
+    def _scrape(self, avid: str) -> Optional[AVMetadata]:
         # 获取html
-        url= f"https://{self.domain}/{avid.upper()}"
+        url= f"{self.baseUrl}/{avid.upper()}"
         logger.info(url)
-        html = self._fetch_html(url, referer="self.domain")
+        with self._stage("scrape_html") as stage:
+            html = self._fetch_html(url, referer=f"{self.baseUrl}")
+            stage.ok = html is not None
+            stage.bytes = len(html or "")
         if html is None:
             return None
         logger.info("fetch html succ")
         
         # 解析元数据
-        metadata = self._extract(html)
+        with self._stage("scrape_parse") as stage:
+            metadata = self._extract(html)
+            stage.ok = bool(metadata)
         if not metadata:
             return None
         logger.info(f"parse metadata succ: \n{metadata}")
 
         # 下载图像
-        if not self.downloadIMG(metadata):
+        with self._stage("scrape_images") as stage:
+            stage.ok = self.downloadIMG(metadata)
+        if not stage.ok:
             return None
         logger.info(f"download img succ")
 
         # 生成nfo
-        self.genNFO(metadata)
+        with self._stage("gen_nfo_file"):
+            self.genNFO(metadata)
         logger.info(f"gennfo succ")
         return metadata
 
@@ -126,64 +167,28 @@ class Sracper:
     def _extract(self, html: str) -> Optional[AVMetadata]:
         try:
             metadata = AVMetadata()
-            # 0. 提取avid
-            pattern = r'<title>((\d|[A-Z])+-\d+)'
-            avid = re.search(pattern, html).group(1)
-            if not avid:
-                return None
-            logger.debug(avid)
-            # 1. 提取标题
-            title_pattern = r'<title>(.*?) - JavBus</title>'
-            title = re.search(title_pattern, html).group(1)
-            if not title:
-                return None
-            logger.debug(title)
-            # 2. 提取封面图
-            cover_pattern = r'<a class="bigImage" href="([^"]+)"><img src="([^"]+)"'
-            cover = re.search(cover_pattern, html).group(1)
-            if not cover:
-                return None
-            logger.debug(cover)
-            # 3. 提取描述
-            desc_pattern = r'<meta name="description" content="([^"]+)">'
-            desc = re.search(desc_pattern, html).group(1)
-            if not desc:
+            fields = JAVBUS.extract(html)
+            # 标题以车牌号开头
+            title, avid = fields.get("title", (None, None))
+            if not avid or not title:
                 return None
-            logger.debug(desc)
-            # 4. 提取关键字
-            keywords_pattern = r'<meta name="keywords" content="([^"]+)">'
-            keywords = re.search(keywords_pattern, html).group(1).split(',')
-            if not keywords:
-                return None
-            logger.debug(keywords)
-            # 5. 提取发行日期
-            date_pattern = r'<span class="header">發行日期:</span> ([^<]+)'
-            date = re.search(date_pattern, html).group(1).strip()
-            if not date:
-                return None
-            logger.debug(date)
-            # 6. 提取时长
-            duration_pattern = r'<span class="header">長度:</span> ([^<]+)'
-            duration = re.search(duration_pattern, html).group(1).strip()
-            if not duration:
-                return None
-            logger.debug(duration)
-            # 7. 提取演员及头像
-            actors_pattern = r'<a class="avatar-box" href="[^"]+">\s*<div class="photo-frame">\s*<img src="([^"]+)"[^>]+>\s*</div>\s*<span>([^<]+)</span>'
-            actresses = re.findall(actors_pattern, html)
-            logger.debug(actresses)
-            # 匹配样品图像
-            fanart_pattern = r'<a class="sample-box" href="(.*?\.jpg)">'
-            fanarts = re.findall(fanart_pattern, html)
-            if not fanarts:
-                fanarts = []
+            for name in ("cover", "description", "keywords", "date", "duration"):
+                if not fields.get(name):
+                    return None
+            cover = fields["cover"]
+            desc = fields["description"]
+            keywords = fields["keywords"].split(',')
+            date = fields["date"].strip()
+            duration = fields["duration"].strip()
+            actresses = fields["actress"]
+            fanarts = fields["fanart"]
 
             metadata.avid = avid
             metadata.title = title
             if is_complete_url(cover):
                 metadata.cover = cover
             else:
-                metadata.cover = f"https://{self.domain}{cover}"
+                metadata.cover = f"{self.baseUrl}{cover}"
             metadata.description = desc
             metadata.keywords = keywords
             metadata.release_date = date
@@ -192,7 +197,7 @@ class Sracper:
                 if is_complete_url(img):
                     metadata.actress[name] = img
                 else:
-                    metadata.actress[name] = f"https://{self.domain}{img}"
+                    metadata.actress[name] = f"{self.baseUrl}{img}"
             metadata.fanarts = fanarts
 
             return metadata
@@ -206,7 +211,7 @@ class Sracper:
         # 下载横版海报
         prefix = metadata.avid+"-" # Jellyfin海报格式
         fanartCount = 1
-        if self._download_file(metadata.cover, metadata.avid+"/"+prefix+f"fanart-{fanartCount}.jpg", referer=f"https://{self.domain}/{metadata.avid}"):
+        if self._download_file(metadata.cover, metadata.avid+"/"+prefix+f"fanart-{fanartCount}.jpg", referer=f"{self.baseUrl}/{metadata.avid}"):
             # 裁剪竖版封面
             self._crop_img(metadata.avid+"/"+prefix+f"fanart-{fanartCount}.jpg", metadata.avid+"/"+prefix+"poster.jpg")
         else:
@@ -216,7 +221,7 @@ class Sracper:
         # 下载预览图
         for fanart in metadata.fanarts:
             fanartCount += 1
-            self._download_file(fanart, metadata.avid+"/"+prefix+f"fanart-{fanartCount}.jpg", referer=f"https://{self.domain}/{metadata.avid}")
+            self._download_file(fanart, metadata.avid+"/"+prefix+f"fanart-{fanartCount}.jpg", referer=f"{self.baseUrl}/{metadata.avid}")
 
         # 检查演员是否存在，不存在则下载图像
         for av, url in metadata.actress.items():
@@ -226,7 +231,7 @@ class Sracper:
                 logger.info(f"av {av} already exist")
                 continue
             else:
-                self._download_file(url, os.path.join(self.path, "thumb/"+av+".jpg"), referer=f"https://{self.domain}/{metadata.avid}")
+                self._download_file(url, os.path.join(self.path, "thumb/"+av+".jpg"), referer=f"{self.baseUrl}/{metadata.avid}")
         return True
 
     def genNFO(self, metadata: AVMetadata) -> bool:
@@ -276,51 +281,71 @@ class Sracper:
         dom = minidom.parseString(xml_str)
         
         # 写入文件
-        with open(os.path.join(self.path, metadata.avid, metadata.avid+".nfo"), 'w', encoding='utf-8') as f:
+        with open(os.path.join(self.work_path, metadata.avid, metadata.avid+".nfo"), 'w', encoding='utf-8') as f:
             dom.writexml(f, indent="  ", addindent="  ", newl="\n", encoding='utf-8')
         return True
 
-    def _download_file(self, url: str, filename: str, referer: str = "") -> bool:
-        """通用下载方法，下载到指定位置"""
-        logger.debug(f"download {url} to {os.path.join(self.path, filename)}")
+    def _get(self, url: str, referer: str = "", **kwargs) -> requests.Response:
+        """带限速的GET，被403/429限流时按限速器给出的时间暂停后重试"""
+        for attempt in range(self.max_retries + 1):
+            if self.limiter:
+                self.limiter.acquire(url)
+            response = fetch(url, proxies=self.proxies, headers=headers, referer=referer,
+                             timeout=self.timeout, allow_redirects=False, **kwargs)
+            if response.status_code not in (403, 429) or not self.limiter or attempt >= self.max_retries:
+                break
+            retry_after = response.headers.get("Retry-After")
+            pause = self.limiter.penalize(url, float(retry_after) if retry_after and retry_after.isdigit() else None)
+            response.close() # 流式请求不关闭的话连接不会回到连接池
+            time.sleep(pause)
         try:
-            newHeader = headers
-            if referer:
-                newHeader["Referer"] = referer
-            response = requests.get(url, stream=True, impersonate="chrome110", proxies=self.proxies,\
-                                    headers=newHeader,timeout=self.timeout, allow_redirects=False)
             response.raise_for_status()
-            
-            with open(os.path.join(self.path, filename), 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
-            return True
-        except Exception as e:
-            logger.error(f"下载失败: {e}")
-            return False
+        except requests.exceptions.HTTPError:
+            response.close()
+            raise
+        if self.limiter:
+            self.limiter.reward(url)
+        return response
+
+    def _download_file(self, url: str, filename: str, referer: str = "") -> bool:
+        """通用下载方法，下载到指定位置"""
+        logger.debug(f"download {url} to {os.path.join(self.work_path, filename)}")
+        target = os.path.join(self.work_path, filename)
+        tmp = None
+        response = None
+        with metrics.stage("scrape_file", "JavBus", urlparse(url).netloc) as stage:
+            try:
+                response = self._get(url, referer=referer, stream=True)
+                
+                # 先写同目录下唯一的临时文件再改名，并发刮削同一个演员头像时不会写坏
+                fd, tmp = tempfile.mkstemp(dir=os.path.dirname(target), prefix=os.path.basename(target) + ".", suffix=".part")
+                with os.fdopen(fd, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=8192):
+                        if chunk:
+                            stage.bytes += f.write(chunk)
+                            governor.consume(len(chunk))
+                os.replace(tmp, target)
+                return True
+            except Exception as e:
+                logger.error(f"下载失败: {e}")
+                stage.ok = False
+                if tmp and os.path.exists(tmp):
+                    os.remove(tmp)
+                return False
+            finally:
+                if response is not None:
+                    response.close() # 释放连接和governor的连接数
     
     def _fetch_html(self, url: str, referer: str = "") -> Optional[str]:
         try:
-            newHeader = headers
-            if referer:
-                newHeader["Referer"] = referer
-            response = requests.get(
-                url,
-                proxies=self.proxies,
-                headers=newHeader,
-                timeout=self.timeout,
-                impersonate="chrome110",  # 可选：chrome, chrome110, edge99, safari15_5
-                allow_redirects=False
-            )
-            response.raise_for_status()
+            response = self._get(url, referer=referer)
             return response.text
         except requests.exceptions.RequestException as e:
             logger.error(f"请求失败: {str(e)}")
             return None
     
     def _crop_img(self, srcname, optname):
-        img = Image.open(os.path.join(self.path, srcname))
+        img = Image.open(os.path.join(self.work_path, srcname))
         width, height = img.size
         if height > width:
             return
@@ -332,5 +357,35 @@ class Sracper:
         bottom = height
         # 裁剪并保存
         cropped_img = img.crop((left, top, right, bottom))
-        cropped_img.save(os.path.join(self.path, optname))
+        cropped_img.save(os.path.join(self.work_path, optname))
         logger.debug(f"裁剪完成，尺寸: {cropped_img.size}")
+
+class BatchScraper:
+    """
+    并发批量刮削：worker池共用一个按host的令牌桶限速器
+    总耗时取决于允许的请求速率(ScrapeRate/ScrapeBurst)，而不是固定的sleep
+    limiter: 传入进程内共享的限速器（ratelimit.scrape_limiter），多个BatchScraper同时运行时不会超出限速；
+    不传时按rate/burst新建一个
+    """
+    def __init__(self, path: str, proxy = None, workers: int = 4, rate: float = 1.0, burst: float = 5,
+                 work_path: Optional[str] = None, limiter: Optional[HostRateLimiter] = None):
+        self.path = path
+        self.work_path = work_path
+        self.proxy = proxy
+        self.workers = max(1, workers)
+        self.limiter = limiter or HostRateLimiter(rate, burst)
+
+    def _scrape(self, avid: str) -> bool:
+        try:
+            scraper = Sracper(self.path, self.proxy, limiter=self.limiter, work_path=self.work_path)
+            return scraper.scrape(avid) is not None
+        except Exception as e:
+            logger.error(f"{avid} 刮削异常: {e}")
+            return False
+
+    def scrapeAll(self, avids: List[str]) -> Dict[str, bool]:
+        """返回每个车牌号是否刮削成功"""
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            results = dict(zip(avids, pool.map(self._scrape, avids)))
+        logger.info(f"批量刮削完成: 成功 {sum(results.values())}/{len(results)}")
+        return results
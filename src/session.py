@@ -0,0 +1,93 @@
+# doc: 按host和代理复用的curl_cffi会话，下载器、刮削器和分片下载共用
+import threading
+from contextlib import ExitStack
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlparse
+from curl_cffi import requests
+from .comm import *
+from .governor import governor
+
+class SessionPool:
+    """
+    每个(scheme, host, proxy)对应一个Session：
+    - 连接保持keep-alive，同一个host的后续请求不再重复DNS、TCP、TLS和指纹握手
+    - 使用chrome指纹，站点支持时通过ALPN协商HTTP/2
+    - curl_cffi的Session为每个线程持有独立的curl句柄，可以在线程池中共享
+    请求头按次传入，不会修改任何共享的headers
+    """
+    def __init__(self, impersonate: str = "chrome110"):
+        self.impersonate = impersonate
+        self._sessions: Dict[Tuple[str, str, str], requests.Session] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(url: str, proxies: Optional[dict]) -> Tuple[str, str, str]:
+        parsed = urlparse(url)
+        proxy = (proxies or {}).get(parsed.scheme) or ""
+        return parsed.scheme, parsed.netloc, proxy
+
+    def get(self, url: str, proxies: Optional[dict] = None) -> requests.Session:
+        key = self._key(url, proxies)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = requests.Session(impersonate=self.impersonate, proxies=proxies)
+                self._sessions[key] = session
+            return session
+
+    def request(self, method: str, url: str, proxies: Optional[dict] = None,
+                headers: Optional[dict] = None, **kwargs) -> requests.Response:
+        return self.get(url, proxies).request(method, url, headers=headers, **kwargs)
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+# 进程内共享
+sessions = SessionPool()
+
+class StreamResponse:
+    """
+    流式请求的响应：在close()或退出with之前一直占用governor的host连接数，
+    其余属性都转发给curl_cffi的Response
+    """
+    def __init__(self, response: requests.Response, release: ExitStack):
+        self._response = response
+        self._release = release
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    def close(self):
+        try:
+            self._response.close()
+        finally:
+            self._release.close() # 重复调用时ExitStack不会再次释放
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def fetch(url: str, proxies: Optional[dict] = None, headers: Optional[dict] = None,
+          referer: str = "", **kwargs) -> requests.Response:
+    """
+    GET请求，referer只作用于本次请求
+    经过带宽控制：非流式请求按实际字节数计入总带宽；流式请求返回StreamResponse，
+    调用方关闭响应之前一直占用host的连接数，读取时由调用方调用governor.consume计入总带宽
+    """
+    reqHeaders = dict(headers or {})
+    if referer:
+        reqHeaders["Referer"] = referer
+    with ExitStack() as stack:
+        speed = stack.enter_context(governor.connection(url))
+        if speed:
+            kwargs.setdefault("max_recv_speed", speed)
+        response = sessions.request("GET", url, proxies=proxies, headers=reqHeaders, **kwargs)
+        if kwargs.get("stream"):
+            return StreamResponse(response, stack.pop_all())
+        governor.consume(len(response.content))
+    return response
@@ -0,0 +1,123 @@
+# doc: 本地暂存目录：整个车牌号文件夹（视频、图片、nfo）先在ScratchPath中生成，完成后一次性移到SavePath
+import os
+import shutil
+from typing import Dict, Optional, Tuple
+from .comm import *
+from .checkpoint import CHECKPOINT_FILE
+from .hls import MediaPlaylist
+from .metrics import metrics
+
+MB = 1024 * 1024
+MARGIN = 1.1 # 估算大小的余量
+STAGING_DIR = ".staging" # 跨设备复制时SavePath中的临时目录，复制完再改名，媒体库扫描跳过.开头的目录
+
+def workPath() -> str:
+    """下载和刮削时生成文件的根目录，没有配置ScratchPath时直接写SavePath"""
+    return scratch_path or save_path
+
+def staged(avid: str) -> bool:
+    """ScratchPath中有已经下载完成、还没移到SavePath的视频（上次移动失败，比如空间不够）"""
+    if not scratch_path:
+        return False
+    folder = os.path.join(scratch_path, avid)
+    return os.path.exists(os.path.join(folder, avid+".mp4")) and not os.path.exists(os.path.join(folder, CHECKPOINT_FILE))
+
+def estimateSize(playlist: MediaPlaylist) -> Optional[int]:
+    """视频大小(字节)：有字节范围时直接相加，否则按子流的码率和总时长估算，都没有时返回None"""
+    if all(seg.byterange for seg in playlist.segments):
+        return sum(seg.byterange[0] for seg in playlist.segments)
+    if playlist.bandwidth:
+        return int(playlist.bandwidth / 8 * playlist.duration)
+    return None
+
+def _existing(path: str) -> str:
+    """path还不存在时取最近的已存在的上级目录，只检查不创建（NAS卷没挂载时不能在系统盘上建出SavePath）"""
+    path = os.path.abspath(path)
+    while not os.path.exists(path) and os.path.dirname(path) != path:
+        path = os.path.dirname(path)
+    return path
+
+def _device(path: str) -> int:
+    return os.stat(_existing(path)).st_dev
+
+def _free(path: str) -> int:
+    return shutil.disk_usage(_existing(path)).free
+
+def checkSpace(size: int) -> bool:
+    """
+    下载前检查空间：工作目录需要视频大小（ts模式转封装时ts和mp4同时存在，需要两倍），
+    使用ScratchPath且和SavePath不在同一个设备上时，SavePath还需要一份视频大小；两个目录都保留DiskReserve
+    """
+    needs: Dict[int, Tuple[str, int]] = {}
+    for path, need in ((workPath(), size if stream_remux else size * 2), (save_path, size if scratch_path else 0)):
+        device = _device(path)
+        prev = needs.get(device, (path, 0))
+        needs[device] = (prev[0], prev[1] + need)
+    for path, need in needs.values():
+        free = _free(path)
+        if free < need * MARGIN + disk_reserve * MB:
+            logger.error(f"{path} 空间不足: 需要约 {need/MB:.0f}MB + 保留 {disk_reserve}MB，剩余 {free/MB:.0f}MB")
+            return False
+    return True
+
+def _treeSize(folder: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, files in os.walk(folder) for name in files)
+
+def _moveInto(src: str, dst: str):
+    """把src整个移到dst（同一个设备）；dst已存在时逐个替换其中的文件，同名的子目录（如extrafanart）递归合并"""
+    if not os.path.exists(dst):
+        os.rename(src, dst)
+        return
+    for name in os.listdir(src):
+        src_item, dst_item = os.path.join(src, name), os.path.join(dst, name)
+        if os.path.isdir(src_item) and os.path.isdir(dst_item):
+            _moveInto(src_item, dst_item)
+            continue
+        if os.path.isdir(dst_item):
+            shutil.rmtree(dst_item)
+        elif os.path.isdir(src_item) and os.path.exists(dst_item):
+            os.remove(dst_item)
+        os.replace(src_item, dst_item)
+    os.rmdir(src)
+
+def _removeLeftovers(folder: str, avid: str):
+    """删除下载过程中的断点记录、断点续传的part和合并用的临时文件，不发布到SavePath"""
+    leftovers = {CHECKPOINT_FILE, CHECKPOINT_FILE + ".tmp", f"{avid}.concat.mp4"}
+    for name in os.listdir(folder):
+        if name in leftovers or (name.startswith(f"{avid}.part") and name.endswith(".mp4")):
+            os.remove(os.path.join(folder, name))
+            logger.debug(f"删除残留文件: {name}")
+
+def publish(avid: str) -> bool:
+    """
+    把ScratchPath中的车牌号文件夹移到SavePath（先删除断点续传的残留文件）：同一个设备上直接改名；
+    否则先按顺序把文件复制到SavePath/.staging，全部完成后再改名，媒体库中不会出现只复制了一半的文件夹
+    """
+    src = os.path.join(scratch_path, avid) if scratch_path else ""
+    if not src or not os.path.isdir(src):
+        return True
+    dst = os.path.join(save_path, avid)
+    _removeLeftovers(src, avid)
+    with metrics.stage("publish") as stage:
+        if _device(scratch_path) == _device(save_path):
+            _moveInto(src, dst)
+            stage.ok = True
+            return True
+        size = _treeSize(src)
+        if _free(save_path) < size + disk_reserve * MB:
+            logger.error(f"{save_path} 空间不足，{avid} 保留在 {src}，空间足够后重新执行即可")
+            return False
+        tmp = os.path.join(save_path, STAGING_DIR, avid)
+        shutil.rmtree(tmp, ignore_errors=True)
+        try:
+            shutil.copytree(src, tmp, copy_function=shutil.copyfile)
+        except OSError as e:
+            logger.error(f"复制到 {save_path} 失败，{avid} 保留在 {src}: {e}")
+            shutil.rmtree(tmp, ignore_errors=True)
+            return False
+        _moveInto(tmp, dst)
+        shutil.rmtree(src, ignore_errors=True)
+        stage.bytes = size
+        stage.ok = True
+    logger.info(f"{avid} 已移到 {dst} ({size/MB:.0f}MB)")
+    return True
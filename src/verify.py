@@ -0,0 +1,263 @@
+# doc: 完整性检查：分片下载后检查格式，mp4生成后只读box头和moov/moof检查结构和时长，不解码
+import os
+import struct
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Tuple
+
+TS_PACKET = 188
+
+class SegmentError(ValueError):
+    """分片内容不完整或者不是媒体数据（比如CDN返回了错误页面）"""
+
+def _boxes(data: bytes, start: int = 0, end: Optional[int] = None) -> Iterator[Tuple[bytes, int, int]]:
+    """遍历data[start:end]中的box，产生(类型, 内容开始, box结尾)，box超出范围时抛出ValueError"""
+    end = len(data) if end is None else end
+    pos = start
+    while pos < end:
+        if end - pos < 8:
+            raise ValueError(f"{pos}处剩余 {end-pos} 字节，不够一个box头")
+        size, kind = struct.unpack_from(">I4s", data, pos)
+        header = 8
+        if size == 1:
+            if end - pos < 16:
+                raise ValueError(f"{kind} 的64位长度不完整")
+            size = struct.unpack_from(">Q", data, pos + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header or pos + size > end:
+            raise ValueError(f"{kind} 长度 {size} 超出范围")
+        yield kind, pos + header, pos + size
+        pos += size
+
+def checkSegment(data: bytes, fmp4: bool = False, init: bool = False):
+    """
+    检查一个分片（已解密）：
+    - fMP4: box要正好覆盖整个分片，媒体分片要有mdat
+    - TS（以0x47开头）: 长度是188的整数倍，首、中、尾三个包的同步字节正确
+    - 以<开头的是网页或xml
+    其他格式（比如伪装成图片的分片）不检查
+    """
+    if not data:
+        raise SegmentError("分片为空")
+    if data[:1] == b"<":
+        raise SegmentError("分片是网页或文本")
+    if fmp4:
+        try:
+            kinds = [kind for kind, _, _ in _boxes(data)]
+        except ValueError as e:
+            raise SegmentError(f"fMP4分片不完整: {e}")
+        if not init and b"mdat" not in kinds:
+            raise SegmentError("fMP4分片没有mdat")
+        return
+    if data[0] == 0x47:
+        packets, rest = divmod(len(data), TS_PACKET)
+        if rest:
+            raise SegmentError(f"TS分片长度 {len(data)} 不是188的整数倍，可能被截断")
+        for i in (0, packets // 2, packets - 1):
+            if data[i * TS_PACKET] != 0x47:
+                raise SegmentError(f"TS分片第{i}个包同步字节错误")
+
+@dataclass
+class Mp4Info:
+    ok: bool = False
+    reason: str = ""
+    duration: float = 0.0   # 秒：普通mp4取mvhd，fMP4取视频轨各fragment覆盖的时长
+    fragmented: bool = False
+    fragments: int = 0
+
+@dataclass
+class _Track:
+    timescale: int = 0
+    handler: bytes = b""
+    default_duration: int = 0     # trex
+    start: Optional[int] = None   # fMP4中第一个fragment的开始时间(timescale单位)
+    end: int = 0                  # 已覆盖到的时间
+
+def _fullBox(data: bytes, pos: int) -> Tuple[int, int]:
+    """version, flags"""
+    value = struct.unpack_from(">I", data, pos)[0]
+    return value >> 24, value & 0xFFFFFF
+
+def _timescaleDuration(data: bytes, pos: int) -> Tuple[int, int]:
+    """mvhd/mdhd: (timescale, duration)"""
+    version, _ = _fullBox(data, pos)
+    if version == 1:
+        return struct.unpack_from(">IQ", data, pos + 20)
+    return struct.unpack_from(">II", data, pos + 12)
+
+def _parseMoov(data: bytes, tracks: Dict[int, _Track]) -> Tuple[float, bool]:
+    """返回(mvhd时长(秒), 是否有mvex)，轨道信息写入tracks"""
+    duration, fragmented = 0.0, False
+    for kind, start, end in _boxes(data):
+        if kind == b"mvhd":
+            timescale, value = _timescaleDuration(data, start)
+            duration = value / timescale if timescale else 0.0
+        elif kind == b"trak":
+            track = _Track()
+            for kind2, start2, end2 in _boxes(data, start, end):
+                if kind2 == b"tkhd": # tkhd在mdia之前
+                    version, _ = _fullBox(data, start2)
+                    track_id = struct.unpack_from(">I", data, start2 + (20 if version == 1 else 12))[0]
+                    track = tracks.setdefault(track_id, track)
+                elif kind2 == b"mdia":
+                    for kind3, start3, _ in _boxes(data, start2, end2):
+                        if kind3 == b"mdhd":
+                            track.timescale = _timescaleDuration(data, start3)[0]
+                        elif kind3 == b"hdlr":
+                            track.handler = data[start3 + 8:start3 + 12]
+        elif kind == b"mvex":
+            fragmented = True
+            for kind2, start2, _ in _boxes(data, start, end):
+                if kind2 == b"trex":
+                    track_id, _, default_duration = struct.unpack_from(">III", data, start2 + 4)
+                    tracks.setdefault(track_id, _Track()).default_duration = default_duration
+    return duration, fragmented
+
+def _parseMoof(data: bytes, tracks: Dict[int, _Track]) -> Optional[str]:
+    """把每个traf覆盖到的时间累加到对应轨道，时间轴不连续时返回原因"""
+    for kind, start, end in _boxes(data):
+        if kind != b"traf":
+            continue
+        track, base, total, default_duration = None, None, 0, 0
+        for kind2, start2, _ in _boxes(data, start, end):
+            if kind2 == b"tfhd":
+                _, flags = _fullBox(data, start2)
+                track_id = struct.unpack_from(">I", data, start2 + 4)[0]
+                track = tracks.setdefault(track_id, _Track())
+                default_duration = track.default_duration
+                pos = start2 + 8 + (8 if flags & 0x01 else 0) + (4 if flags & 0x02 else 0)
+                if flags & 0x08:
+                    default_duration = struct.unpack_from(">I", data, pos)[0]
+            elif kind2 == b"tfdt":
+                version, _ = _fullBox(data, start2)
+                base = struct.unpack_from(">Q" if version == 1 else ">I", data, start2 + 4)[0]
+            elif kind2 == b"trun":
+                _, flags = _fullBox(data, start2)
+                count = struct.unpack_from(">I", data, start2 + 4)[0]
+                if not flags & 0x100:
+                    total += count * default_duration
+                    continue
+                pos = start2 + 8 + (4 if flags & 0x01 else 0) + (4 if flags & 0x04 else 0)
+                stride = 4 * bin(flags & 0xF00).count("1")
+                total += sum(struct.unpack_from(">I", data, pos + i * stride)[0] for i in range(count))
+        if track is None:
+            continue
+        if base is None:
+            base = track.end if track.start is not None else 0
+        if track.start is None:
+            track.start = track.end = base
+        # 允许1秒以内的误差（音视频交错、B帧），更大的跳变说明中间缺了数据
+        if track.timescale and base - track.end > track.timescale:
+            return f"轨道时间轴在 {track.end / track.timescale:.1f}s 处跳到 {base / track.timescale:.1f}s"
+        track.end = max(track.end, base + total)
+    return None
+
+class _Truncated(ValueError):
+    pass
+
+def _topBoxes(f, size: int) -> Iterator[Tuple[bytes, int, int, int]]:
+    """文件的顶层box: (类型, 开始, 头长度, box长度)，box头不完整或超出文件末尾时抛出_Truncated"""
+    pos = 0
+    while pos < size:
+        f.seek(pos)
+        header = f.read(16)
+        if len(header) < 8:
+            raise _Truncated(f"{pos}处的box头不完整")
+        box_size, kind = struct.unpack_from(">I4s", header)
+        if box_size == 1 and len(header) == 16:
+            box_size, offset = struct.unpack_from(">Q", header, 8)[0], 16
+        else:
+            box_size, offset = (size - pos if box_size == 0 else box_size), 8
+        if box_size < offset or pos + box_size > size:
+            raise _Truncated(f"{kind.decode(errors='replace')} 超出文件末尾，文件被截断")
+        yield kind, pos, offset, box_size
+        pos += box_size
+
+def _payload(f, pos: int, offset: int, box_size: int) -> bytes:
+    f.seek(pos + offset)
+    return f.read(box_size - offset)
+
+def _fragmentSpan(tracks: Dict[int, _Track]) -> Optional[float]:
+    """fMP4已覆盖的时长：有视频轨时以视频轨为准，否则取最长的轨道"""
+    spans = [(t.handler == b"vide", (t.end - t.start) / t.timescale)
+             for t in tracks.values() if t.timescale and t.start is not None]
+    return max(spans)[1] if spans else None
+
+def inspectMp4(path: str) -> Mp4Info:
+    """
+    只读取box头、moov和moof，不读mdat：
+    - 顶层box正好覆盖整个文件（被截断时最后一个box会超出文件末尾），第一个是ftyp，有moov和mdat
+    - 普通mp4的时长取mvhd；fMP4（empty_moov时mvhd时长为0）按各fragment的tfdt和trun累加，同时检查时间轴连续
+    """
+    info = Mp4Info()
+    tracks: Dict[int, _Track] = {}
+    kinds = []
+    try:
+        with open(path, "rb") as f:
+            for kind, pos, offset, box_size in _topBoxes(f, os.path.getsize(path)):
+                kinds.append(kind)
+                if kind == b"moov":
+                    info.duration, info.fragmented = _parseMoov(_payload(f, pos, offset, box_size), tracks)
+                elif kind == b"moof":
+                    info.fragments += 1
+                    reason = _parseMoof(_payload(f, pos, offset, box_size), tracks)
+                    if reason:
+                        info.reason = reason
+                        return info
+    except _Truncated as e:
+        info.reason = str(e)
+        return info
+    except (OSError, ValueError, struct.error) as e:
+        info.reason = f"解析失败: {e}"
+        return info
+
+    if not kinds or kinds[0] != b"ftyp":
+        info.reason = "没有ftyp"
+    elif b"moov" not in kinds:
+        info.reason = "没有moov"
+    elif b"mdat" not in kinds:
+        info.reason = "没有mdat"
+    if info.reason:
+        return info
+    if info.fragmented and info.fragments:
+        info.duration = _fragmentSpan(tracks) or info.duration
+    info.ok = True
+    return info
+
+def salvageFragments(path: str, durations: List[float]) -> int:
+    """
+    下载中断时正在写入的fMP4：保留到最后一个正好落在分片边界上的完整fragment，截掉后面的部分，
+    返回保留的分片数（durations为这个文件对应的各分片的EXTINF）。不是fMP4或一个完整的分片都没有时返回0
+    """
+    tracks: Dict[int, _Track] = {}
+    fragmented, keep, covered = False, 0, 0
+    try:
+        with open(path, "rb") as f:
+            try:
+                for kind, pos, offset, box_size in _topBoxes(f, os.path.getsize(path)):
+                    if kind == b"moov":
+                        fragmented = _parseMoov(_payload(f, pos, offset, box_size), tracks)[1]
+                    elif kind == b"moof" and fragmented:
+                        if _parseMoof(_payload(f, pos, offset, box_size), tracks):
+                            break
+                    elif kind == b"mdat" and fragmented:
+                        count = coveredSegments(durations, _fragmentSpan(tracks) or 0.0)
+                        if count > 0:
+                            keep, covered = pos + box_size, count
+            except _Truncated:
+                pass # 最后一个fragment没写完
+    except (OSError, ValueError, struct.error):
+        return 0
+    if covered:
+        os.truncate(path, keep)
+    return covered
+
+def coveredSegments(durations: List[float], duration: float, epsilon: float = 0.5) -> int:
+    """时长正好覆盖到前几个分片（durations为各分片的EXTINF）的结尾时返回分片数，不在分片边界上时返回-1"""
+    elapsed = 0.0
+    for i, value in enumerate(durations):
+        if abs(elapsed - duration) <= epsilon:
+            return i
+        elapsed += value
+    return len(durations) if abs(elapsed - duration) <= epsilon else -1
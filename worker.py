@@ -0,0 +1,121 @@
+# doc: 常驻下载服务，从sqlite任务表领取任务，N个worker并发下载
+from src import downloaderMgr
+from src.comm import *
+from src import data
+from src.jobs import open_queue
+from src.pipeline import downloadAV
+from src.metrics import startExport
+import argparse
+import os
+import signal
+import socket
+import threading
+from metadata import *
+
+class WorkerService:
+    def __init__(self, worker_count: int = 2, drain: bool = False):
+        self.worker_count = max(1, worker_count)
+        self.drain = drain # 没有可领取的任务时退出，用于定时任务
+        self.queue = open_queue()
+        self.service_id = f"{socket.gethostname()}-{os.getpid()}"
+        self.stop_event = threading.Event()
+        self.threads = []
+
+    def importQueueFile(self):
+        """把旧的download_queue.txt中的车牌号导入任务表，然后清空"""
+        try:
+            with open(queue_path, 'r', encoding='utf-8') as f:
+                avids = [line.strip().upper() for line in f if line.strip()]
+        except FileNotFoundError:
+            return
+        for avid in avids:
+            self.queue.enqueue(avid)
+        with open(queue_path, 'w', encoding='utf-8') as f:
+            f.write("")
+        if avids:
+            logger.info(f"从 {queue_path} 导入 {len(avids)} 个任务")
+
+    def _heartbeat(self):
+        # 心跳 + 续约：间隔取租约的1/3，保证正常运行的任务不会被抢走
+        interval = max(1, min(30, job_lease / 3))
+        while not self.stop_event.is_set():
+            self.queue.heartbeat(self.service_id)
+            for i in range(self.worker_count):
+                self.queue.renew(f"{self.service_id}-{i}")
+            self.stop_event.wait(interval)
+
+    def _work(self, index: int):
+        worker_id = f"{self.service_id}-{index}"
+        mgr = downloaderMgr.DownloaderMgr()
+        while not self.stop_event.is_set():
+            avid = self.queue.claim(worker_id)
+            if avid is None:
+                if self.drain:
+                    break
+                self.stop_event.wait(5)
+                continue
+
+            # 数据库查询也放在try里，出错时任务标记失败，worker线程继续领取下一个
+            try:
+                if not self.queue.isForced(avid) and data.find_in_db(avid, downloaded_path, "MissAV"):
+                    logger.info(f"{avid} 已在小姐姐数据库中")
+                    self.queue.complete(avid)
+                    continue
+
+                logger.info(f"[{worker_id}] 开始执行 车牌号: {avid}")
+                if not downloadAV(mgr, avid):
+                    raise ValueError(f"{avid} 下载失败")
+                gen_nfo(avid)
+                self.queue.complete(avid)
+                logger.info(f"[{worker_id}] {avid} 下载完成")
+            except Exception as e:
+                logger.error(f"[{worker_id}] {e}")
+                try:
+                    self.queue.fail(avid, str(e))
+                except Exception as err:
+                    # 任务表也写不进去时由租约过期后重新领取
+                    logger.error(f"[{worker_id}] 无法标记 {avid} 失败: {err}")
+
+    def run(self):
+        db = data.open_db(downloaded_path, "MissAV")
+        if db_bloom_filter:
+            db.enableBloom() # 本进程和其他进程插入的车牌号都会加入过滤器
+        self.importQueueFile()
+        startExport("worker", interval=60)
+        workers = [threading.Thread(target=self._work, args=(i,), daemon=True) for i in range(self.worker_count)]
+        self.threads = [threading.Thread(target=self._heartbeat, daemon=True)] + workers
+        for t in self.threads:
+            t.start()
+        logger.info(f"下载服务已启动: {self.service_id}, worker数: {self.worker_count}")
+
+        # 主线程等待退出信号；正在下载的任务租约过期后会被重新领取
+        while not self.stop_event.is_set():
+            if self.drain and not any(t.is_alive() for t in workers):
+                break
+            self.stop_event.wait(1)
+        self.stop_event.set()
+        self.queue.unregister(self.service_id)
+        logger.info("下载服务已退出")
+
+    def stop(self, *_):
+        self.stop_event.set()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="常驻下载服务")
+    parser.add_argument('-n', '--workers', type=int, default=worker_count, help='并发worker数')
+    parser.add_argument('--drain', action='store_true', help='下载完当前可执行的任务后退出（定时任务使用）')
+    parser.add_argument('--status', action='store_true', help='打印各状态的任务数后退出')
+    args = parser.parse_args()
+
+    if args.status:
+        for state, count in sorted(open_queue().counts().items()):
+            print(f"{state}\t{count}")
+        exit(0)
+
+    service = WorkerService(args.workers, args.drain)
+    if args.drain and service.queue.serviceAlive():
+        logger.info("下载服务已在运行")
+        exit(0)
+    signal.signal(signal.SIGINT, service.stop)
+    signal.signal(signal.SIGTERM, service.stop)
+    service.run()